@@ -0,0 +1,372 @@
+"""
+Servicio HTTP local del CDSS con micro-batching de peticiones.
+
+Expone el mismo preprocesamiento y modelo que la app de Streamlit:
+    GET  /health   -> estado y configuración
+    GET  /metrics  -> latencia por etapa en formato de texto de Prometheus (CDSS_METRICS=1)
+    GET  /drift    -> deriva de las entradas frente al entrenamiento (ver src/drift.py)
+    POST /predict  -> diagnóstico principal, top-3, probabilidades por clase y alertas de rangos clínicos
+    POST /explain  -> valores SHAP por clase del paciente
+
+Cada predicción queda en el registro de auditoría (src/audit.py; CDSS_AUDIT=0 lo desactiva).
+
+El cuerpo de /predict y /explain es el dict de entradas del formulario
+(mismas claves y valores que `inputs` en display_prediccion). Las peticiones
+concurrentes se agrupan en lotes de hasta --max-batch-size filas o
+--max-wait-ms milisegundos antes de llamar a predict_proba / shap_values.
+
+Uso (desde la raíz del proyecto):
+    python -m app.service --port 8502
+"""
+import argparse
+import asyncio
+import json
+import sys
+import traceback
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from pathlib import Path
+
+import numpy as np
+
+BASE_PATH = Path(__file__).resolve().parent.parent
+if str(BASE_PATH) not in sys.path:
+    sys.path.insert(0, str(BASE_PATH))
+
+from src.audit import make_record, writer_from_env
+from src.drift import DriftMonitor
+from src.explanations import create_explainer, expected_values, shap_values_by_class
+from src.models import CompiledPredictor, summarize_prediction
+from src.preprocessing import DIAGNOSTICO_MAP
+from src.registry import load_serving_artifacts
+from src.telemetry import METRICS, PROMETHEUS_CONTENT_TYPE, set_model_version, span
+from src.utils import stable_hash
+from src.validation import DEFAULT_VALIDATOR
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8502
+DEFAULT_MAX_BATCH_SIZE = 64
+DEFAULT_MAX_WAIT_MS = 5.0
+MAX_BODY_BYTES = 1 << 20
+
+
+class ExplainerUnavailable(RuntimeError):
+    """ El servicio se arrancó sin explainer SHAP (--no-explain). """
+
+
+class MicroBatcher:
+    """
+    Agrupa peticiones concurrentes y ejecuta `batch_fn` una vez por lote en un hilo aparte,
+    para no bloquear el event loop. `batch_fn` recibe una matriz (n, f) y devuelve un
+    arreglo con una fila de resultado por fila de entrada.
+    """
+
+    def __init__(self, batch_fn, max_batch_size=DEFAULT_MAX_BATCH_SIZE, max_wait_ms=DEFAULT_MAX_WAIT_MS):
+        self.batch_fn = batch_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.queue = asyncio.Queue()
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.batches = 0
+        self.rows = 0
+        self._task = None
+
+    def start(self):
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+        self.executor.shutdown(wait=False)
+
+    async def submit(self, row):
+        futuro = asyncio.get_running_loop().create_future()
+        await self.queue.put((row, futuro))
+        return await futuro
+
+    async def _collect(self):
+        loop = asyncio.get_running_loop()
+        lote = [await self.queue.get()]
+        limite = loop.time() + self.max_wait
+        while len(lote) < self.max_batch_size:
+            if not self.queue.empty():
+                lote.append(self.queue.get_nowait())
+                continue
+            restante = limite - loop.time()
+            if restante <= 0:
+                break
+            try:
+                lote.append(await asyncio.wait_for(self.queue.get(), restante))
+            except asyncio.TimeoutError:
+                break
+        return lote
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            lote = await self._collect()
+            filas = np.vstack([row for row, _ in lote])
+            try:
+                resultados = await loop.run_in_executor(self.executor, self.batch_fn, filas)
+            except Exception as e:
+                for _, futuro in lote:
+                    if not futuro.done():
+                        futuro.set_exception(e)
+                continue
+            self.batches += 1
+            self.rows += len(lote)
+            for (_, futuro), resultado in zip(lote, resultados):
+                if not futuro.done():
+                    futuro.set_result(resultado)
+
+
+class CDSSService:
+    """ Rutas del servicio sobre un CompiledPredictor y un explainer SHAP compartidos (BoosterExplainer por defecto). """
+
+    def __init__(self, predictor, explainer=None, max_batch_size=DEFAULT_MAX_BATCH_SIZE, max_wait_ms=DEFAULT_MAX_WAIT_MS,
+                 drift_monitor=None, audit_writer=None, model_version=None):
+        self.predictor = predictor
+        self.explainer = explainer
+        self.drift_monitor = drift_monitor
+        self.audit_writer = audit_writer
+        self.model_version = model_version
+        self.predict_batcher = MicroBatcher(predictor.predict_proba, max_batch_size, max_wait_ms)
+        self.explain_batcher = MicroBatcher(lambda X: shap_values_by_class(explainer, X), max_batch_size, max_wait_ms) if explainer else None
+
+    def start(self):
+        self.predict_batcher.start()
+        if self.explain_batcher:
+            self.explain_batcher.start()
+
+    async def stop(self):
+        await self.predict_batcher.stop()
+        if self.explain_batcher:
+            await self.explain_batcher.stop()
+
+    def _transform(self, inputs):
+        try:
+            # transform reutiliza un buffer por hilo: se copia la fila antes de encolarla
+            x = self.predictor.transform(inputs).copy()
+        except KeyError as e:
+            raise ValueError(f"Falta el campo o el valor no es válido: {e}") from e
+        except (TypeError, ValueError) as e:
+            raise ValueError(f"Entrada no válida: {e}") from e
+        # null, NaN e Infinity llegan a la fila como NaN/inf: no se puntúan
+        no_finitos = [self.predictor.feature_names[i] for i in np.flatnonzero(~np.isfinite(x[0]))]
+        if no_finitos:
+            campos = [f for f in no_finitos if f in inputs] or no_finitos
+            raise ValueError(f"Falta el campo o el valor no es válido: {', '.join(repr(str(f)) for f in campos)}")
+        return x
+
+    async def predict(self, inputs):
+        x = self._transform(inputs)
+        with span("validacion"):
+            alertas = DEFAULT_VALIDATOR.validate(inputs).records(0)
+        if self.drift_monitor is not None:
+            self.drift_monitor.update(x)
+        pred_proba = await self.predict_batcher.submit(x)
+        if self.audit_writer is not None:
+            self.audit_writer.record(make_record(
+                inputs, pred_proba, [DIAGNOSTICO_MAP[i] for i in sorted(DIAGNOSTICO_MAP)], self.model_version,
+                stable_hash({"model_version": self.model_version, "inputs": inputs}), n_alertas=len(alertas), origen="servicio"))
+        return {
+            **summarize_prediction(pred_proba),
+            "probabilidades": {DIAGNOSTICO_MAP[i]: float(p) for i, p in enumerate(pred_proba)},
+            "alertas": alertas,
+        }
+
+    async def explain(self, inputs):
+        if self.explain_batcher is None:
+            raise ExplainerUnavailable("El explainer SHAP no está disponible en este servicio.")
+        x = self._transform(inputs)
+        shap_values = await self.explain_batcher.submit(x)
+        return {
+            "feature_names": self.predictor.feature_names,
+            "x": x[0].tolist(),
+            "expected_value": expected_values(self.explainer).tolist(),
+            "shap_values": {DIAGNOSTICO_MAP[i]: sv.tolist() for i, sv in enumerate(shap_values)},
+        }
+
+    def health(self):
+        return {
+            "status": "ok",
+            "backend": self.predictor.backend.name,
+            "max_batch_size": self.predict_batcher.max_batch_size,
+            "max_wait_ms": self.predict_batcher.max_wait * 1000,
+            "predict_batches": self.predict_batcher.batches,
+            "predict_rows": self.predict_batcher.rows,
+            "audit_written": self.audit_writer.written if self.audit_writer else None,
+            "audit_dropped": self.audit_writer.dropped if self.audit_writer else None,
+        }
+
+    async def handle(self, method, path, body):
+        """ Devuelve (status, payload) para una petición ya leída. """
+        if method == "GET" and path == "/health":
+            return HTTPStatus.OK, self.health()
+        if method == "GET" and path == "/metrics":
+            return HTTPStatus.OK, METRICS.render_prometheus()
+        if method == "GET" and path == "/drift":
+            if self.drift_monitor is None:
+                return HTTPStatus.SERVICE_UNAVAILABLE, {"error": "El monitor de deriva no está disponible en este servicio."}
+            return HTTPStatus.OK, self.drift_monitor.status()
+        if path not in ("/predict", "/explain"):
+            return HTTPStatus.NOT_FOUND, {"error": f"Ruta no encontrada: {path}"}
+        if method != "POST":
+            return HTTPStatus.METHOD_NOT_ALLOWED, {"error": "Use POST."}
+        try:
+            inputs = json.loads(body or b"{}")
+            if not isinstance(inputs, dict):
+                raise ValueError("El cuerpo debe ser un objeto JSON con las entradas del paciente.")
+            if path == "/predict":
+                return HTTPStatus.OK, await self.predict(inputs)
+            return HTTPStatus.OK, await self.explain(inputs)
+        except (ValueError, json.JSONDecodeError) as e:
+            return HTTPStatus.BAD_REQUEST, {"error": str(e)}
+        except ExplainerUnavailable as e:
+            return HTTPStatus.SERVICE_UNAVAILABLE, {"error": str(e)}
+
+
+# --- Servidor HTTP/1.1 mínimo sobre asyncio ---
+async def _read_request(reader):
+    linea = await reader.readline()
+    if not linea:
+        return None
+    method, target, version = linea.decode("latin-1").rstrip("\r\n").split(" ", 2)
+    headers = {}
+    while True:
+        linea = await reader.readline()
+        if linea in (b"\r\n", b"\n", b""):
+            break
+        nombre, _, valor = linea.decode("latin-1").partition(":")
+        headers[nombre.strip().lower()] = valor.strip()
+    longitud = int(headers.get("content-length", 0))
+    if longitud > MAX_BODY_BYTES:
+        raise ValueError("Cuerpo de la petición demasiado grande.")
+    body = await reader.readexactly(longitud) if longitud else b""
+    keep_alive = headers.get("connection", "").lower() != "close" and version == "HTTP/1.1"
+    return method, target.split("?", 1)[0], body, keep_alive
+
+
+def _write_response(writer, status, payload, keep_alive):
+    # Las rutas devuelven un dict (JSON) o texto ya formateado (/metrics)
+    if isinstance(payload, str):
+        cuerpo, tipo = payload.encode("utf-8"), PROMETHEUS_CONTENT_TYPE
+    else:
+        cuerpo, tipo = json.dumps(payload, ensure_ascii=False).encode("utf-8"), "application/json; charset=utf-8"
+    cabecera = (
+        f"HTTP/1.1 {status.value} {status.phrase}\r\n"
+        f"Content-Type: {tipo}\r\n"
+        f"Content-Length: {len(cuerpo)}\r\n"
+        f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+    )
+    writer.write(cabecera.encode("latin-1") + cuerpo)
+
+
+async def start_server(service, host=DEFAULT_HOST, port=DEFAULT_PORT):
+    """ Arranca el servidor asyncio; devuelve el objeto asyncio.Server. """
+
+    async def connection(reader, writer):
+        try:
+            while True:
+                try:
+                    request = await _read_request(reader)
+                except (ValueError, asyncio.IncompleteReadError) as e:
+                    _write_response(writer, HTTPStatus.BAD_REQUEST, {"error": str(e)}, False)
+                    break
+                if request is None:
+                    break
+                method, path, body, keep_alive = request
+                try:
+                    status, payload = await service.handle(method, path, body)
+                except Exception as e:
+                    # Fallo interno (p. ej. del backend dentro del MicroBatcher): se responde igualmente
+                    print(f"❌ Error interno en {method} {path}: {e!r}", file=sys.stderr)
+                    traceback.print_exc()
+                    status, payload = HTTPStatus.INTERNAL_SERVER_ERROR, {"error": "Error interno del servicio."}
+                _write_response(writer, status, payload, keep_alive)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    service.start()
+    return await asyncio.start_server(connection, host, port)
+
+
+def build_service(backend="booster", max_batch_size=DEFAULT_MAX_BATCH_SIZE, max_wait_ms=DEFAULT_MAX_WAIT_MS, explain=True,
+                  model_version=None):
+    """ Carga los artefactos (registro o pickles) y construye el servicio con el mismo preprocesamiento que la app. """
+    model, scaler, manifest, origen = load_serving_artifacts(model_version)
+    print(f"Modelo cargado desde {origen}")
+    set_model_version(manifest["model_version"])
+    predictor = CompiledPredictor(model, scaler, backend=backend)
+    explainer = create_explainer(model) if explain else None
+    try:
+        drift_monitor = DriftMonitor.from_artifacts(model, scaler, model_version=manifest["model_version"])
+    except FileNotFoundError as e:
+        print(f"Monitor de deriva no disponible: {e}")
+        drift_monitor = None
+    return CDSSService(predictor, explainer, max_batch_size, max_wait_ms, drift_monitor, writer_from_env(),
+                       manifest["model_version"])
+
+
+# --- Cliente para la app de Streamlit ---
+class CDSSClient:
+    """ Cliente HTTP síncrono del servicio, usado por la app cuando CDSS_SERVICE_URL está definido. """
+
+    def __init__(self, base_url, timeout=10.0):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+
+    def _post(self, path, inputs):
+        datos = json.dumps(inputs, ensure_ascii=False, default=_json_default).encode("utf-8")
+        request = urllib.request.Request(self.base_url + path, data=datos,
+                                         headers={"Content-Type": "application/json"}, method="POST")
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            return json.loads(response.read())
+
+    def predict(self, inputs):
+        return self._post("/predict", inputs)
+
+    def explain(self, inputs):
+        return self._post("/explain", inputs)
+
+
+def _json_default(valor):
+    if isinstance(valor, np.generic):
+        return valor.item()
+    raise TypeError(f"Tipo no serializable: {type(valor).__name__}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Servicio HTTP local del CDSS con micro-batching.")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--max-batch-size", type=int, default=DEFAULT_MAX_BATCH_SIZE, help="Filas máximas por lote.")
+    parser.add_argument("--max-wait-ms", type=float, default=DEFAULT_MAX_WAIT_MS, help="Espera máxima para completar un lote.")
+    parser.add_argument("--backend", default="booster", help="Backend de inferencia (ver src.backends).")
+    parser.add_argument("--no-explain", action="store_true", help="No cargar el explainer SHAP (/explain deshabilitado).")
+    parser.add_argument("--model-version", default=None, help="Versión del registro (por defecto, la activa).")
+    args = parser.parse_args()
+
+    service = build_service(args.backend, args.max_batch_size, args.max_wait_ms, explain=not args.no_explain,
+                            model_version=args.model_version)
+
+    async def serve():
+        server = await start_server(service, args.host, args.port)
+        print(f"Servicio CDSS escuchando en http://{args.host}:{args.port}")
+        async with server:
+            await server.serve_forever()
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
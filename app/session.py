@@ -0,0 +1,95 @@
+# Resultado de una predicción guardado por sesión
+"""
+Registro compacto que la app guarda en st.session_state tras cada predicción y que leen
+todas las páginas (resultado, análisis de SHAP, casos similares y reporte PDF). Guarda
+arreglos compactos y una referencia compartida a los nombres de características en lugar de
+las entradas en bruto, los dicts de resultados y el DataFrame procesado de cada sesión; el
+diagnóstico principal, el top 3 y el nivel de confianza se derivan de las probabilidades
+con las mismas funciones que summarize_prediction.
+"""
+from dataclasses import dataclass
+
+import numpy as np
+
+from src.models import confidence_level, top_k_diagnoses
+from src.preprocessing import DIAGNOSTICO_MAP
+
+CLASES = tuple(DIAGNOSTICO_MAP[i] for i in sorted(DIAGNOSTICO_MAP))
+
+# Una tupla de nombres por conjunto de características, compartida por todas las sesiones
+_NOMBRES_COMPARTIDOS = {}
+
+
+def shared_feature_names(feature_names):
+    """ Tupla de nombres de características compartida entre sesiones (una por proceso y orden). """
+    nombres = tuple(str(f) for f in feature_names)
+    return _NOMBRES_COMPARTIDOS.setdefault(nombres, nombres)
+
+
+def _readonly(values, dtype=np.float32):
+    valores = np.array(values, dtype=dtype)
+    valores.setflags(write=False)
+    return valores
+
+
+@dataclass(frozen=True, slots=True)
+class PredictionResult:
+    """
+    Resultado de una predicción: probabilidades (n_clases,) en float64, tal como salen del
+    modelo, para que los umbrales de confianza y los empates se resuelvan igual que en
+    summarize_prediction; fila procesada (n_features,) y valores SHAP (n_clases, n_features)
+    o None en float32. Todos los arreglos son de solo lectura. De las entradas en bruto solo
+    se conservan la edad y el área (nombre del PDF y filtros de casos similares).
+    """
+    prediction_id: str
+    model_version: str
+    proba: np.ndarray
+    x: np.ndarray
+    shap_values: np.ndarray
+    feature_names: tuple
+    alertas: tuple
+    edad: float
+    area: str
+
+    @classmethod
+    def create(cls, prediction_id, model_version, proba, x, feature_names, alertas, inputs, shap_values=None):
+        """ Construye el registro; `x` y `shap_values` admiten el eje de lote de una sola fila. """
+        return cls(
+            prediction_id=prediction_id,
+            model_version=model_version,
+            proba=_readonly(np.ravel(proba), np.float64),
+            x=_readonly(np.ravel(x)),
+            shap_values=None if shap_values is None else _readonly(np.asarray(shap_values).reshape(len(CLASES), -1)),
+            feature_names=shared_feature_names(feature_names),
+            alertas=tuple(alertas),
+            edad=float(inputs["edad"]),
+            area=inputs.get("area"),
+        )
+
+    @property
+    def principal_index(self):
+        return int(self.top_3_indices[0])
+
+    @property
+    def diagnostico_principal(self):
+        return CLASES[self.principal_index]
+
+    @property
+    def confianza_principal(self):
+        return float(self.proba[self.principal_index])
+
+    @property
+    def nivel_confianza(self):
+        return confidence_level(self.confianza_principal)
+
+    @property
+    def top_3_indices(self):
+        return top_k_diagnoses(self.proba.reshape(1, -1), 3)[0][0]
+
+    @property
+    def top_3_diagnosticos(self):
+        return [CLASES[i] for i in self.top_3_indices]
+
+    @property
+    def top_3_confianzas(self):
+        return [float(self.proba[i]) for i in self.top_3_indices]
@@ -1,13 +1,32 @@
+import os
+import sys
+import threading
 import streamlit as st
 import pandas as pd
 import numpy as np
-import pickle
 import joblib
 from pathlib import Path
-from fpdf import FPDF
-import base64
-import shap
-import matplotlib.pyplot as plt
+# shap, matplotlib y fpdf se importan en las funciones que los usan: importar shap
+# cuesta segundos y las páginas de inicio y el formulario no lo necesitan.
+
+# El paquete `src` vive en la raíz del proyecto
+BASE_PATH = Path(__file__).resolve().parent.parent
+if str(BASE_PATH) not in sys.path:
+    sys.path.insert(0, str(BASE_PATH))
+
+from app.service import CDSSClient
+from app.session import PredictionResult
+from src.audit import make_record, writer_from_env
+from src.drift import DriftMonitor
+from src.evaluation import CV_MODELS, CV_SCORING, load_or_compute_curves
+from src.explanations import CachedExplainer, DEFAULT_SHAP_CACHE_MB, DEFAULT_SHAP_ENGINE, PopulationShapStore, create_explainer, expected_values
+from src.models import CompiledPredictor, load_manifest
+from src.registry import REGISTRY_DIR, current_version, load_version
+from src.preprocessing import DIAGNOSTICO_MAP, SEXO_MAP, AREA_MAP, SINO_MAP
+from src.similarity import DEFAULT_K, SimilarityIndex, age_band
+from src.telemetry import record_size, set_model_version, span, start_exporters_from_env
+from src.utils import METRICS_DIR, BoundedLRUCache, stable_hash
+from src.validation import DEFAULT_VALIDATOR
 
 # --- Configuración de la Página ---
 st.set_page_config(
@@ -234,48 +253,130 @@ def set_custom_style():
 @st.cache_resource
 def load_resources():
     """ Carga el modelo, scaler y otros recursos necesarios. """
-    base_path = Path(__file__).resolve().parent.parent
+    base_path = BASE_PATH
     model_path = base_path / "models" / "final_model.pkl"
     scaler_path = base_path / "models" / "scaler.pkl"
-    X_train_path = base_path / "data" / "processed" / "X_train.csv"
+    manifest_path = base_path / "models" / "manifest.json"
     
-    resources = {"model": None, "scaler": None, "explainer": None, "feature_names": None, "error": None}
+    resources = {"model": None, "scaler": None, "predictor": None, "feature_names": None,
+                 "model_version": None, "manifest": None, "service_client": None, "error": None}
+
+    # Con CDSS_SERVICE_URL la app actúa como cliente del servicio HTTP local (python -m app.service)
+    if os.environ.get("CDSS_SERVICE_URL"):
+        resources["service_client"] = CDSSClient(os.environ["CDSS_SERVICE_URL"])
+
+    # Versión activa del registro (models/registry); CDSS_MODEL_VERSION fija otra versión.
+    # Sin registro se usan los pickles y models/manifest.json.
+    registry_version = os.environ.get("CDSS_MODEL_VERSION") or current_version()
+    if registry_version:
+        try:
+            print(f"Cargando versión {registry_version} desde: {REGISTRY_DIR.resolve()}")
+            resources["model"], resources["scaler"], resources["manifest"] = load_version(registry_version)
+        except FileNotFoundError:
+            resources["error"] = f"Error: No se encontró la versión {registry_version} en: {REGISTRY_DIR}"
+        except Exception as e:
+            resources["error"] = f"Error al cargar la versión {registry_version} del registro: {e}"
+    else:
+        try:
+            print(f"Cargando modelo desde: {model_path.resolve()}")
+            resources["model"] = joblib.load(model_path)
+        except FileNotFoundError:
+            resources["error"] = f"Error: No se encontró el archivo del modelo en: {model_path}"
+        except Exception as e:
+            resources["error"] = f"Error al cargar el modelo: {e}"
+
+        try:
+            print(f"Cargando scaler desde: {scaler_path.resolve()}")
+            resources["scaler"] = joblib.load(scaler_path)
+        except FileNotFoundError:
+            resources["error"] = f"Error: No se encontró el archivo del scaler en: {scaler_path}"
+        except Exception as e:
+            resources["error"] = f"Error al cargar el scaler: {e}"
+
+        # Nombres y orden de características, clases y versión salen del manifiesto: sin leer datasets
+        try:
+            print(f"Cargando manifiesto desde: {manifest_path.resolve()}")
+            resources["manifest"] = load_manifest(manifest_path)
+        except FileNotFoundError:
+            resources["error"] = f"Error: No se encontró el manifiesto en: {manifest_path}. Genérelo con `python -m src.models manifest`."
+        except Exception as e:
+            resources["error"] = f"Error al cargar el manifiesto: {e}"
+
+    if resources["model"] is not None and resources["scaler"] is not None:
+        # Ruta de inferencia precompilada: se construye una vez y se comparte entre sesiones
+        # CDSS_BACKEND permite elegir el motor de inferencia (ver `python -m src.evaluation parity`)
+        try:
+            resources["predictor"] = CompiledPredictor(resources["model"], resources["scaler"],
+                                                       backend=os.environ.get("CDSS_BACKEND", "booster"))
+        except Exception as e:
+            resources["error"] = f"Error al preparar el motor de inferencia: {e}"
+
+    manifest = resources["manifest"]
+    if manifest is not None:
+        resources["feature_names"] = manifest["feature_names"]
+        resources["model_version"] = manifest["model_version"]
+        # Spans de latencia etiquetados con la versión servida (CDSS_METRICS=1; ver src/telemetry.py)
+        set_model_version(manifest["model_version"])
+        start_exporters_from_env()
+        if resources["model"] is not None and list(resources["model"].feature_names_in_) != manifest["feature_names"]:
+            resources["error"] = "Error: Las características del manifiesto no coinciden con las del modelo. Regenere el manifiesto."
+        
+    return resources
 
-    try:
-        print(f"Cargando modelo desde: {model_path.resolve()}")
-        resources["model"] = joblib.load(model_path)
-    except FileNotFoundError:
-        resources["error"] = f"Error: No se encontró el archivo del modelo en: {model_path}"
-    except Exception as e:
-        resources["error"] = f"Error al cargar el modelo: {e}"
+@st.cache_resource
+def load_explainer(model_version):
+    """
+    Crea el explainer SHAP en su primer uso (al analizar un caso), no al arrancar la app.
+    Por defecto usa las contribuciones nativas del booster (sin importar shap);
+    CDSS_SHAP_ENGINE=tree vuelve a shap.TreeExplainer. La caché SHAP se comparte entre
+    sesiones (CDSS_SHAP_CACHE_MB limita su memoria).
+    """
+    resources = load_resources()
+    print("Creando explainer SHAP...")
+    return CachedExplainer(
+        create_explainer(resources["model"], os.environ.get("CDSS_SHAP_ENGINE", DEFAULT_SHAP_ENGINE)),
+        model_version=model_version,
+        max_mb=float(os.environ.get("CDSS_SHAP_CACHE_MB", DEFAULT_SHAP_CACHE_MB)),
+    )
 
+def get_explainer(resources):
+    """ Explainer SHAP compartido, o None si no se puede crear. """
     try:
-        print(f"Cargando scaler desde: {scaler_path.resolve()}")
-        resources["scaler"] = joblib.load(scaler_path)
-    except FileNotFoundError:
-        resources["error"] = f"Error: No se encontró el archivo del scaler en: {scaler_path}"
+        return load_explainer(resources["model_version"])
     except Exception as e:
-        resources["error"] = f"Error al cargar el scaler: {e}"
-        
+        print(f"Error al crear explainer SHAP: {e}")
+        return None
+
+@st.cache_resource
+def load_drift_monitor(model_version):
+    """ Monitor de deriva de las entradas compartido entre sesiones (ver src/drift.py). """
+    resources = load_resources()
+    return DriftMonitor.from_artifacts(resources["model"], resources["scaler"], model_version=model_version)
+
+def get_drift_monitor(resources):
+    """ Monitor de deriva, o None si faltan las estadísticas de referencia. """
     try:
-        print(f"Cargando X_train para nombres de características SHAP desde: {X_train_path.resolve()}")
-        X_train = pd.read_csv(X_train_path)
-        resources["feature_names"] = X_train.columns.tolist()
-        # Crear el explainer SHAP
-        resources["explainer"] = shap.TreeExplainer(resources["model"].named_steps['classifier'])
-    except FileNotFoundError:
-        resources["error"] = f"Error: No se encontró el archivo X_train.csv en: {X_train_path}. Necesario para SHAP."
+        return load_drift_monitor(resources["model_version"])
     except Exception as e:
-        resources["error"] = f"Error al cargar X_train o crear explainer SHAP: {e}"
-        
-    return resources
+        print(f"Monitor de deriva no disponible: {e}")
+        return None
 
-# --- Mapeos y Definiciones ---
-DIAGNOSTICO_MAP = {0: 'DM2', 1: 'EDA', 2: 'HTA', 3: 'IRA'}
-SEXO_MAP = {'Femenino': 0, 'Masculino': 1}
-AREA_MAP = {'Rural': 0, 'Urbano': 1}
-SINO_MAP = {'No': 0, 'Sí': 1}
+@st.cache_resource
+def load_audit_writer():
+    """ Escritor del registro de auditoría compartido entre sesiones (None si CDSS_AUDIT=0). """
+    return writer_from_env()
+
+@st.cache_resource
+def load_similarity_index():
+    """ Índice de casos similares (arreglos en memory-map); None si no se ha construido. """
+    return SimilarityIndex.open()
 
+@st.cache_resource
+def load_population_store():
+    """ Abre (sin leer) el almacén SHAP poblacional de reports/shap; None si no se ha construido. """
+    return PopulationShapStore.open()
+
+# --- Mapeos y Definiciones ---
 # Define your color palette
 COLORS = {
     # Colores principales del módulo
@@ -351,13 +452,6 @@ COLORS = {
     'probability_DM2': '#9C27B0',
 }
 
-# Rangos clínicos para validación (ejemplos, se pueden ajustar)
-RANGOS_CLINICOS = {
-    'pas': (90, 180), 'pad': (60, 120), 'fc': (60, 100), 'fr': (12, 20),
-    'temp': (36.0, 38.5), 'spo2': (92, 100), 'glucosa': (70, 180),
-    'hba1c': (4.0, 10.0), 'creatinina': (0.6, 1.3), 'colesterol': (125, 240),
-    'leucocitos': (4000, 11000)
-}
 
 # Lista de síntomas para checkboxes
 SINTOMAS_RESPIRATORIOS = ['sintoma_tos', 'sintoma_dificultad_respiratoria', 'sintoma_dolor_garganta', 'sintoma_congestion_nasal', 'sintoma_epistaxis']
@@ -367,11 +461,6 @@ SINTOMAS_CARDIOVASCULARES = ['sintoma_palpitaciones', 'sintoma_dolor_pecho', 'si
 SINTOMAS_GENERALES = ['sintoma_cefalea', 'sintoma_deshidratacion', 'sintoma_vision_borrosa', 'sintoma_fiebre', 'sintoma_escalofrios', 'sintoma_debilidad', 'sintoma_malestar_general', 'sintoma_mareo', 'sintoma_fatiga', 'sintoma_asintomatico']
 TODOS_SINTOMAS = SINTOMAS_RESPIRATORIOS + SINTOMAS_DIGESTIVOS + SINTOMAS_METABOLICOS + SINTOMAS_CARDIOVASCULARES + SINTOMAS_GENERALES
 
-DIAGNOSTICO_MAP = {0: 'DM2', 1: 'EDA', 2: 'HTA', 3: 'IRA'}
-SEXO_MAP = {'Femenino': 0, 'Masculino': 1}
-AREA_MAP = {'Rural': 0, 'Urbano': 1}
-SINO_MAP = {'No': 0, 'Sí': 1}
-
 # Define your color palette
 COLORS = {
     # Colores principales del módulo
@@ -447,13 +536,7 @@ COLORS = {
     'probability_DM2': '#9C27B0',
 }
 
-# Rangos clínicos para validación (ejemplos, se pueden ajustar)
-RANGOS_CLINICOS = {
-    'pas': (90, 180), 'pad': (60, 120), 'fc': (60, 100), 'fr': (12, 20),
-    'temp': (36.0, 38.5), 'spo2': (92, 100), 'glucosa': (70, 180),
-    'hba1c': (4.0, 10.0), 'creatinina': (0.6, 1.3), 'colesterol': (125, 240),
-    'leucocitos': (4000, 11000)
-}
+# Rangos clínicos: src/validation.py (RANGOS_CLINICOS)
 
 # Lista de síntomas para checkboxes
 SINTOMAS_RESPIRATORIOS = ['sintoma_tos', 'sintoma_dificultad_respiratoria', 'sintoma_dolor_garganta', 'sintoma_congestion_nasal', 'sintoma_epistaxis']
@@ -611,12 +694,11 @@ def display_prediccion(resources):
     # Columna para validaciones y resultados
     with col2:
         st.subheader("Validación y Alertas")
-        alertas = []
-        for key, (min_val, max_val) in RANGOS_CLINICOS.items():
-            if key in inputs and not (min_val <= inputs[key] <= max_val):
-                alerta = f"⚠️ **{key.upper()}** ({inputs[key]}) fuera del rango normal ({min_val} - {max_val})."
-                st.markdown(f"<div style='background-color: {COLORS['critical_bg']}; color: {COLORS['critical_color']}; border: {COLORS['critical_border']}; padding: 10px; border-radius: 5px;'>🚨 {alerta}</div>", unsafe_allow_html=True)
-                alertas.append(alerta)
+        # Mismo motor vectorizado que la validación por lotes, sobre RANGOS_CLINICOS
+        with span("validacion"):
+            alertas = DEFAULT_VALIDATOR.validate(inputs).messages(0, raw=inputs)
+        for alerta in alertas:
+            st.markdown(f"<div style='background-color: {COLORS['critical_bg']}; color: {COLORS['critical_color']}; border: {COLORS['critical_border']}; padding: 10px; border-radius: 5px;'>🚨 {alerta}</div>", unsafe_allow_html=True)
         if not alertas:
             st.markdown(f"<div style='background-color: {COLORS['normal_bg']}; color: {COLORS['normal_color']}; border: {COLORS['normal_border']}; padding: 10px; border-radius: 5px;'>✅ Todos los valores clínicos están dentro de los rangos de referencia.</div>", unsafe_allow_html=True)
 
@@ -625,82 +707,65 @@ def display_prediccion(resources):
         if st.button("Analizar Caso Clínico", use_container_width=True, type="primary"):
             # --- Lógica de Predicción ---
             with st.spinner("Procesando datos y ejecutando modelo..."):
-                # 1. Crear DataFrame de entrada
-                input_data = {}
-                
-                # Mapear valores categóricos y binarios
-                input_data['sexo'] = SEXO_MAP[inputs['sexo']]
-                input_data['area'] = AREA_MAP[inputs['area']]
-                input_data['tabaquismo'] = SINO_MAP[inputs['tabaquismo']]
-                input_data['alcoholismo'] = SINO_MAP[inputs['alcoholismo']]
-                input_data['sedentarismo'] = SINO_MAP[inputs['sedentarismo']]
-                input_data['ant_familiar_dm'] = SINO_MAP[inputs['ant_familiar_dm']]
-                input_data['ant_familiar_hta'] = SINO_MAP[inputs['ant_familiar_hta']]
-                
-                # Añadir síntomas
-                for sintoma in TODOS_SINTOMAS:
-                    input_data[sintoma] = 1 if inputs[sintoma] else 0
-                
-                # Añadir resto de valores numéricos
-                for key in ['edad', 'distrito', 'ocupacion', 'imc', 'pas', 'pad', 'fc', 'fr', 'temp', 'spo2', 'glucosa', 'hba1c', 'creatinina', 'colesterol', 'leucocitos', 'tiempo_enfermedad']:
-                    input_data[key] = inputs[key]
-
-                # 2. Feature Engineering
-                input_data['presion_pulso'] = input_data['pas'] - input_data['pad']
-                
-                imc_bins = [0, 18.5, 24.9, 29.9, np.inf]
-                imc_labels = [0, 1, 2, 3]
-                input_data['imc_categoria'] = pd.cut([input_data['imc']], bins=imc_bins, labels=imc_labels, right=False)[0]
-
-                # 3. Ordenar y escalar
-                feature_order = resources['model'].feature_names_in_
-                df_input = pd.DataFrame([input_data])[feature_order]
-                
-                numerical_cols = ['edad', 'imc', 'pas', 'pad', 'fc', 'fr', 'temp', 'spo2', 'glucosa', 'hba1c', 'creatinina', 'colesterol', 'leucocitos', 'tiempo_enfermedad', 'presion_pulso']
-                df_input[numerical_cols] = resources['scaler'].transform(df_input[numerical_cols])
-
-                # 4. Predicción
-                pred_proba = resources['model'].predict_proba(df_input)[0]
-                
-                # Calcular valores SHAP para la predicción actual
-                if resources["explainer"] and resources["feature_names"]:
-                    # Ensure df_input has the same columns as the explainer expects
-                    # This might involve reordering or adding missing columns with default values
-                    # For TreeExplainer, it's usually fine if the order is consistent
-                    shap_values_raw = resources["explainer"].shap_values(df_input)
-                    # shap_values_raw will be a list of arrays, one for each class
-                    # We need to store all of them to allow analysis for any class
-                    st.session_state['shap_values'] = shap_values_raw
-                    st.session_state['feature_names'] = resources["feature_names"]
-                    st.session_state['df_input_processed'] = df_input # Store processed input for waterfall plot
+                service_client = resources.get("service_client")
+                if service_client is not None:
+                    # Servicio HTTP local (app/service.py): mismo preprocesamiento, modelo y SHAP
+                    try:
+                        respuesta = service_client.predict(inputs)
+                        explicacion = service_client.explain(inputs)
+                    except Exception as e:
+                        st.error(f"No se pudo consultar el servicio de inferencia: {e}")
+                        return
+                    pred_proba = np.array([respuesta['probabilidades'][DIAGNOSTICO_MAP[i]] for i in sorted(DIAGNOSTICO_MAP)])
+                    x_input = np.array([explicacion['x']], dtype=np.float32)
+                    shap_values_raw = np.array([[explicacion['shap_values'][DIAGNOSTICO_MAP[i]] for i in sorted(DIAGNOSTICO_MAP)]])
                 else:
-                    st.warning("SHAP explainer o nombres de características no disponibles. La interpretabilidad no se mostrará.")
+                    # 1-3. Codificar, derivar características y escalar sobre la fila preasignada
+                    predictor = resources['predictor']
+                    x_input = predictor.transform(inputs)
 
-                # 5. Procesar Resultados
-                top_3_indices = pred_proba.argsort()[-3:][::-1]
-                top_3_diagnosticos = [DIAGNOSTICO_MAP[i] for i in top_3_indices]
-                top_3_confianzas = [pred_proba[i] for i in top_3_indices]
+                    # 4. Predicción
+                    pred_proba = predictor.predict_proba(x_input)[0]
 
-                diagnostico_principal = top_3_diagnosticos[0]
-                confianza_principal = top_3_confianzas[0]
+                    # Deriva de las entradas frente al entrenamiento (las alertas van al log del servidor)
+                    drift_monitor = get_drift_monitor(resources)
+                    if drift_monitor is not None:
+                        drift_monitor.update(x_input)
 
-                if confianza_principal >= 0.8:
-                    nivel_confianza = "Alta"
-                elif confianza_principal >= 0.6:
-                    nivel_confianza = "Media"
-                else:
-                    nivel_confianza = "Baja"
-
-                # Guardar resultados en session_state para el PDF
-                st.session_state['results'] = {
-                    "diagnostico_principal": diagnostico_principal,
-                    "confianza_principal": confianza_principal,
-                    "nivel_confianza": nivel_confianza,
-                    "top_3_diagnosticos": top_3_diagnosticos,
-                    "top_3_confianzas": top_3_confianzas,
-                    "alertas": alertas,
-                    "inputs": inputs
-                }
+                    # Calcular valores SHAP para la predicción actual
+                    explainer = get_explainer(resources)
+                    shap_values_raw = explainer.shap_values(x_input) if explainer else None
+
+                if shap_values_raw is None or not resources["feature_names"]:
+                    st.warning("SHAP explainer o nombres de características no disponibles. La interpretabilidad no se mostrará.")
+                    shap_values_raw = None
+
+                # 5. Resultado compacto de la sesión (app/session.py): lo leen el análisis y el PDF.
+                # Guarda los valores SHAP de todas las clases para analizar cualquiera de ellas.
+                resultado = PredictionResult.create(
+                    prediction_id=stable_hash({"model_version": resources["model_version"], "inputs": inputs}),
+                    model_version=resources["model_version"],
+                    proba=pred_proba,
+                    x=x_input,
+                    feature_names=resources["feature_names"] or resources["predictor"].feature_names,
+                    alertas=alertas,
+                    inputs=inputs,
+                    shap_values=shap_values_raw,
+                )
+                st.session_state['resultado'] = resultado
+                diagnostico_principal = resultado.diagnostico_principal
+                confianza_principal = resultado.confianza_principal
+                nivel_confianza = resultado.nivel_confianza
+                top_3_diagnosticos = resultado.top_3_diagnosticos
+                top_3_confianzas = resultado.top_3_confianzas
+
+                # Registro de auditoría: solo se encola, lo escribe un hilo en segundo plano.
+                # Con el servicio HTTP es el servicio quien registra la predicción.
+                audit_writer = load_audit_writer()
+                if audit_writer is not None and service_client is None:
+                    audit_writer.record(make_record(inputs, pred_proba, [DIAGNOSTICO_MAP[i] for i in sorted(DIAGNOSTICO_MAP)],
+                                                    resources["model_version"], resultado.prediction_id,
+                                                    n_alertas=len(alertas), origen="app"))
 
             st.subheader("Resultado del Análisis")
             st.markdown(f"""
@@ -737,23 +802,46 @@ def display_prediccion(resources):
                     st.markdown(f"<div style='color: {COLORS.get(color_key, '#333333')}; background-color: {COLORS.get(bg_key, '#F0F2F6')}; padding: 5px 10px; border-radius: 5px; margin: 5px 0;'>{icon} {i+1}. {diag} ({conf:.2%})</div>", unsafe_allow_html=True)
 
     # --- Descarga de PDF ---
-    if 'results' in st.session_state:
+    # El PDF solo se genera cuando se solicita y se sirve con st.download_button (endpoint de
+    # descarga de Streamlit) en lugar de un data URI en base64 que se reenviaba en cada rerun.
+    if 'resultado' in st.session_state:
         st.write("---")
         st.subheader("Descargar Reporte")
-        
-        pdf_bytes = generate_pdf(st.session_state['results'])
-        st.markdown(f"""
-            <div class="download-button">
-                <a href="data:application/pdf;base64,{base64.b64encode(pdf_bytes).decode()}" download="reporte_diagnostico_{st.session_state['results']['inputs']['edad']}.pdf">
-                    <button style="background-color: {COLORS['download_button_bg']}; color: {COLORS['download_button_text']}; border-radius: 10px; border: none; padding: 10px 20px; cursor: pointer; width: 100%;">
-                        📄 Descargar Reporte en PDF
-                    </button>
-                </a>
-            </div>
-        """, unsafe_allow_html=True)
-
-def generate_pdf(results):
+
+        resultado = st.session_state['resultado']
+        results_key = resultado.prediction_id
+        if st.session_state.get('pdf_results_key') != results_key:
+            st.button("📄 Generar Reporte en PDF", use_container_width=True,
+                      on_click=st.session_state.__setitem__, args=('pdf_results_key', results_key))
+        else:
+            st.download_button(
+                "📄 Descargar Reporte en PDF",
+                data=get_pdf_bytes(resultado, results_key),
+                file_name=f"reporte_diagnostico_{resultado.edad:g}.pdf",
+                mime="application/pdf",
+                use_container_width=True,
+            )
+
+@st.cache_resource
+def get_pdf_cache():
+    """ Caché de reportes PDF compartida entre sesiones, indexada por el hash de los resultados. """
+    return BoundedLRUCache(int(float(os.environ.get("CDSS_PDF_CACHE_MB", 16)) * 1024 * 1024))
+
+def get_pdf_bytes(resultado, results_key):
+    """ Devuelve el PDF de `resultado`, generándolo solo si no está en caché. """
+    cache = get_pdf_cache()
+    pdf_bytes = cache.get(results_key)
+    if pdf_bytes is None:
+        with span("pdf"):
+            pdf_bytes = generate_pdf(resultado)
+        record_size("pdf", len(pdf_bytes))
+        cache.put(results_key, pdf_bytes)
+    return pdf_bytes
+
+def generate_pdf(resultado):
     """Genera un reporte en PDF con los resultados del diagnóstico."""
+    from fpdf import FPDF
+
     pdf = FPDF()
     pdf.add_page()
     pdf.set_font("Arial", 'B', 16)
@@ -766,22 +854,23 @@ def generate_pdf(results):
     pdf.set_font("Arial", 'B', 12)
     pdf.cell(0, 10, "Diagnóstico Principal", 0, 1)
     pdf.set_font("Arial", '', 12)
-    pdf.cell(0, 10, f"  - {results['diagnostico_principal']} con una confianza del {results['confianza_principal']:.2%}", 0, 1)
-    pdf.cell(0, 10, f"  - Nivel de Confianza General: {results['nivel_confianza']}", 0, 1)
+    pdf.cell(0, 10, f"  - {resultado.diagnostico_principal} con una confianza del {resultado.confianza_principal:.2%}", 0, 1)
+    pdf.cell(0, 10, f"  - Nivel de Confianza General: {resultado.nivel_confianza}", 0, 1)
     pdf.ln(5)
 
     # Diferenciales
     pdf.set_font("Arial", 'B', 12)
     pdf.cell(0, 10, "Diagnósticos Diferenciales", 0, 1)
     pdf.set_font("Arial", '', 12)
-    for i in range(1, len(results['top_3_diagnosticos'])):
-        diag = results['top_3_diagnosticos'][i]
-        conf = results['top_3_confianzas'][i]
+    top_3_diagnosticos, top_3_confianzas = resultado.top_3_diagnosticos, resultado.top_3_confianzas
+    for i in range(1, len(top_3_diagnosticos)):
+        diag = top_3_diagnosticos[i]
+        conf = top_3_confianzas[i]
         pdf.cell(0, 8, f"  {i+1}. {diag} ({conf:.2%})", 0, 1)
     pdf.ln(5)
 
     # Alertas
-    if results['alertas']:
+    if resultado.alertas:
         pdf.set_font("Arial", 'B', 12)
         # Convertir color hexadecimal a RGB para FPDF
         critical_color_hex = COLORS['critical_color'].lstrip('#')
@@ -789,8 +878,10 @@ def generate_pdf(results):
         pdf.set_text_color(*critical_color_rgb)
         pdf.cell(0, 10, "Alertas Clínicas Identificadas", 0, 1)
         pdf.set_font("Arial", '', 12)
-        for alerta in results['alertas']:
-            pdf.cell(0, 8, f"  - {alerta.replace('**', '')}", 0, 1)
+        for alerta in resultado.alertas:
+            # Las fuentes estándar de FPDF solo cubren latin-1: se quitan los emojis de la alerta
+            texto = alerta.replace('**', '').encode('latin-1', 'ignore').decode('latin-1').strip()
+            pdf.cell(0, 8, f"  - {texto}", 0, 1)
     
     pdf.set_text_color(0, 0, 0)
     pdf.ln(10)
@@ -800,20 +891,61 @@ def generate_pdf(results):
     return bytes(pdf.output(dest='S'))
 
 
+@st.cache_resource
+def get_figure_cache():
+    """ Caché de figuras renderizadas (PNG) compartida entre sesiones, acotada por tamaño. """
+    return BoundedLRUCache(int(float(os.environ.get("CDSS_FIGURE_CACHE_MB", 32)) * 1024 * 1024))
+
+@st.cache_resource
+def get_pyplot_lock():
+    return threading.Lock()
+
+def cached_figure_png(prediction_id, plot_type, draw):
+    """
+    Devuelve el PNG de la figura `plot_type` de una predicción. En caso de fallo de caché,
+    `draw()` dibuja sobre una figura nueva de pyplot, que se renderiza y se cierra siempre
+    para que las figuras no se acumulen ni se mezclen entre gráficos.
+    """
+    key = (prediction_id, plot_type)
+    png = get_figure_cache().get(key)
+    if png is None:
+        import io
+        import matplotlib.pyplot as plt
+
+        # pyplot tiene estado global: se serializa el dibujo entre sesiones y solo se
+        # cierran las figuras creadas aquí
+        with get_pyplot_lock():
+            previas = set(plt.get_fignums())
+            plt.figure()
+            try:
+                with span("graficos"):
+                    draw()
+                    buffer = io.BytesIO()
+                    plt.gcf().savefig(buffer, format="png", bbox_inches="tight", dpi=100)
+                    png = buffer.getvalue()
+            finally:
+                for num in set(plt.get_fignums()) - previas:
+                    plt.close(num)
+        get_figure_cache().put(key, png)
+    return png
+
 def display_analisis(resources):
+    import shap
+    import matplotlib.pyplot as plt
+
     st.header("Módulo de Análisis de Resultados")
     st.subheader("Interpretación de la Predicción")
 
-    if 'results' not in st.session_state or 'shap_values' not in st.session_state:
+    resultado = st.session_state.get('resultado')
+    if resultado is None or resultado.shap_values is None:
         st.info("Por favor, realice una predicción en el 'Módulo de Predicción de Diagnóstico' primero para ver el análisis de resultados.")
         return
 
-    results = st.session_state['results']
-    shap_values = st.session_state['shap_values']
-    feature_names = st.session_state['feature_names']
-    df_input_processed = st.session_state['df_input_processed']
-    diagnostico_principal = results['diagnostico_principal']
-    confianza_principal = results['confianza_principal']
+    prediction_id = resultado.prediction_id
+    feature_names = list(resultado.feature_names)
+    df_input_processed = pd.DataFrame(resultado.x[None, :], columns=feature_names)
+    diagnostico_principal = resultado.diagnostico_principal
+    confianza_principal = resultado.confianza_principal
     
     st.write(f"**Diagnóstico Principal:** {diagnostico_principal} (Confianza: {confianza_principal:.2%})")
     
@@ -822,119 +954,69 @@ def display_analisis(resources):
     st.subheader("1. Probabilidades por Clase")
 
     try:
-        top_diagnosticos = results.get('top_3_diagnosticos', [])
-        top_confianzas = results.get('top_3_confianzas', [])
-
-        # Si no hay top_3, usamos solo el diagnóstico principal
-        if not top_diagnosticos or not top_confianzas:
-            top_diagnosticos = [diagnostico_principal]
-            top_confianzas = [confianza_principal]
-
-        fig_proba, ax_proba = plt.subplots(figsize=(8, 4))
-        y_pos = np.arange(len(top_diagnosticos))
-
-        # Colores: usa un color genérico si no hay definición en COLORS
-        bar_colors = []
-        for d in top_diagnosticos:
-            color_key = f'probability_{d}'
-            bar_colors.append(COLORS[color_key] if color_key in COLORS else '#1f77b4')
-
-        ax_proba.barh(y_pos, top_confianzas, align='center', color=bar_colors)
-        ax_proba.set_yticks(y_pos)
-        ax_proba.set_yticklabels(top_diagnosticos)
-        ax_proba.invert_yaxis()
-        ax_proba.set_xlabel('Probabilidad')
-        ax_proba.set_title('Probabilidad de cada Diagnóstico')
-        st.pyplot(fig_proba)
+        top_diagnosticos = resultado.top_3_diagnosticos
+        top_confianzas = resultado.top_3_confianzas
+
+        def draw_probabilities():
+            fig_proba, ax_proba = plt.subplots(figsize=(8, 4))
+            y_pos = np.arange(len(top_diagnosticos))
+
+            # Colores: usa un color genérico si no hay definición en COLORS
+            bar_colors = []
+            for d in top_diagnosticos:
+                color_key = f'probability_{d}'
+                bar_colors.append(COLORS[color_key] if color_key in COLORS else '#1f77b4')
+
+            ax_proba.barh(y_pos, top_confianzas, align='center', color=bar_colors)
+            ax_proba.set_yticks(y_pos)
+            ax_proba.set_yticklabels(top_diagnosticos)
+            ax_proba.invert_yaxis()
+            ax_proba.set_xlabel('Probabilidad')
+            ax_proba.set_title('Probabilidad de cada Diagnóstico')
+
+        st.image(cached_figure_png(prediction_id, "probabilidades", draw_probabilities))
 
     except Exception as e:
         st.warning(f"No se pudo generar el gráfico de probabilidades: {e}")
 
-    # Get the index of the principal diagnosis
-    principal_diag_index = list(DIAGNOSTICO_MAP.keys())[list(DIAGNOSTICO_MAP.values()).index(diagnostico_principal)]
+    principal_diag_index = resultado.principal_index
 
     # 2) Top 10 factores más influyentes usando valores SHAP
     st.markdown("---")
     st.subheader(f"2. Top 10 Factores más Influyentes para {diagnostico_principal}")
 
-    # --- Función robusta para obtener los valores SHAP correctos según el tipo de salida ---
-    def select_shap_values(shap_values, class_index=0):
-        # Si shap_values es lista o tupla (caso multiclase)
-        if isinstance(shap_values, (list, tuple)):
-            if class_index < len(shap_values):
-                return np.array(shap_values[class_index])
-            else:
-                return np.array(shap_values[0])
-        # Si es numpy array
-        sv = np.array(shap_values)
-        if sv.ndim == 3:  # (n_classes, n_samples, n_features)
-            if class_index < sv.shape[0]:
-                return sv[class_index]
-            else:
-                return sv[0]
-        elif sv.ndim == 2:  # (n_samples, n_features)
-            return sv
-        else:
-            return sv.reshape(1, -1)
-
-    # Seleccionar los valores SHAP de la clase principal
-    shap_class_values = select_shap_values(shap_values, class_index=principal_diag_index)
-
-    # Asegurar forma (1, n_features)
-    if shap_class_values.ndim == 1:
-        shap_values_for_summary_plot = shap_class_values.reshape(1, -1)
-    elif shap_class_values.shape[0] == 1:
-        shap_values_for_summary_plot = shap_class_values
-    else:
-        shap_values_for_summary_plot = shap_class_values[0].reshape(1, -1)
-
-    # --- Asegurar que las formas de shap y los datos coincidan ---
-    if isinstance(df_input_processed, pd.DataFrame):
-        data_for_plot = df_input_processed.values
-    else:
-        data_for_plot = np.array(df_input_processed)
-
-    shap_features = shap_values_for_summary_plot.shape[1]
-    data_features = data_for_plot.shape[1]
-
-    if shap_features != data_features:
-        min_features = min(shap_features, data_features)
-        shap_values_for_summary_plot = shap_values_for_summary_plot[:, :min_features]
-        data_for_plot = data_for_plot[:, :min_features]
-        feature_names = feature_names[:min_features]
+    # Contribuciones del paciente para la clase principal: shap_values es (n_clases, n_features)
+    shap_class_values = resultado.shap_values[principal_diag_index]
+    data_for_plot = df_input_processed.values
 
     # --- Graficar ---
-    shap.summary_plot(
-        shap_values_for_summary_plot,
-        data_for_plot,
-        feature_names=feature_names,
-        plot_type="bar",
-        show=False
-    )
-    st.pyplot(plt.gcf())
+    def draw_summary():
+        shap.summary_plot(
+            shap_class_values.reshape(1, -1),
+            data_for_plot,
+            feature_names=feature_names,
+            plot_type="bar",
+            show=False
+        )
+
+    st.image(cached_figure_png(prediction_id, f"shap_summary_{principal_diag_index}", draw_summary))
 
 
     # 3) Visualización tipo waterfall
     st.markdown("---")
     st.subheader(f"3. Cómo cada factor influye en la predicción de {diagnostico_principal}")
 
-    if isinstance(df_input_processed, pd.DataFrame) and len(df_input_processed) == 1:
-        # Manejar expected_value de forma segura (puede ser escalar o lista)
-        explainer = resources["explainer"]
-        if isinstance(explainer.expected_value, (list, np.ndarray)):
-            expected_value = explainer.expected_value[min(principal_diag_index, len(explainer.expected_value)-1)]
-        else:
-            expected_value = explainer.expected_value
-
+    explainer = get_explainer(resources)
+    if explainer is not None and isinstance(df_input_processed, pd.DataFrame) and len(df_input_processed) == 1:
         explanation = shap.Explanation(
-            values=shap_class_values[0] if shap_class_values.ndim > 1 else shap_class_values,
-            base_values=expected_value,
+            values=shap_class_values,
+            base_values=expected_values(explainer)[principal_diag_index],
             data=df_input_processed.iloc[0].values,
             feature_names=feature_names
         )
 
-        shap.plots.waterfall(explanation, show=False)
-        st.pyplot(plt.gcf())
+        st.image(cached_figure_png(prediction_id, f"shap_waterfall_{principal_diag_index}",
+                                   lambda: shap.plots.waterfall(explanation, show=False)))
     else:
         st.warning("No se pudo generar el gráfico de cascada SHAP. Asegúrese de que el input procesado sea un DataFrame de una sola fila.")
 
@@ -945,20 +1027,9 @@ def display_analisis(resources):
     st.subheader("4. Explicación en Lenguaje Médico")
 
     try:
-        shap_for_explanation = shap_class_values[0] if shap_class_values.ndim > 1 else shap_class_values
-
-        # Depuración: verifica tamaños
-        st.write(f"🔹 SHAP features: {len(shap_for_explanation)} | Feature names: {len(feature_names)}")
-
-        if len(shap_for_explanation) != len(feature_names):
-            st.warning("⚠️ El número de valores SHAP no coincide con el número de características. Se ajustará automáticamente.")
-            min_len = min(len(shap_for_explanation), len(feature_names))
-            shap_for_explanation = shap_for_explanation[:min_len]
-            feature_names = feature_names[:min_len]
-
         # Generar explicación médica
         medical_explanation = generate_medical_explanation(
-            shap_for_explanation,
+            shap_class_values,
             feature_names,
             diagnostico_principal,
             df_input_processed.iloc[0]
@@ -980,9 +1051,181 @@ def display_analisis(resources):
     clinical_recommendations = get_clinical_recommendations(diagnostico_principal)
     st.markdown(clinical_recommendations)
 
-def display_dashboard():
+    # 6) Comparación con la población de X_test (almacén SHAP precalculado)
+    st.markdown("---")
+    st.subheader("6. Comparación con la Población")
+    store = load_population_store()
+    if store is None:
+        st.info("El almacén SHAP poblacional no está disponible. Genérelo con `python -m src.explanations build-store`.")
+    else:
+        if store.model_version and store.model_version != resources.get("model_version"):
+            st.warning("El almacén SHAP poblacional se generó con otra versión del modelo; regenérelo para comparar correctamente.")
+        comparacion = store.compare(principal_diag_index, shap_class_values, top=10)
+        st.write(f"Percentil de cada contribución del paciente frente a {store.n_samples} pacientes del conjunto de prueba para {diagnostico_principal}:")
+        st.dataframe(comparacion.style.format({
+            "shap_paciente": "{:+.3f}", "percentil_poblacion": "{:.0f}",
+            "p5": "{:+.3f}", "mediana": "{:+.3f}", "p95": "{:+.3f}",
+        }), use_container_width=True, hide_index=True)
+
+    # 7) Casos históricos más parecidos (índice precalculado de src/similarity.py)
+    st.markdown("---")
+    st.subheader("7. Casos Similares")
+    index = load_similarity_index()
+    if index is None:
+        st.info("El índice de casos similares no está disponible. Genérelo con `python -m src.similarity build`.")
+        return
+    if index.model_version and index.model_version != resources.get("model_version"):
+        st.warning("El índice de casos similares se generó con otra versión del modelo; regenérelo para comparar correctamente.")
+    tramo_edad = age_band(resultado.edad)
+    nombre_tramo = f"{tramo_edad[0]}+ años" if np.isinf(tramo_edad[1]) else f"{tramo_edad[0]}-{tramo_edad[1] - 1} años"
+
+    col1, col2, col3, col4 = st.columns(4)
+    with col1:
+        opciones_diag = ["Todos"] + [DIAGNOSTICO_MAP[i] for i in sorted(DIAGNOSTICO_MAP)]
+        filtro_diag = st.selectbox("Diagnóstico confirmado", opciones_diag,
+                                   index=opciones_diag.index(diagnostico_principal), key="similares_diagnostico")
+    with col2:
+        opciones_area = ["Todas"] + list(AREA_MAP)
+        filtro_area = st.selectbox("Área", opciones_area, key="similares_area",
+                                   index=opciones_area.index(resultado.area) if resultado.area in AREA_MAP else 0)
+    with col3:
+        opciones_edad = ["Todas las edades", f"Mismo tramo ({nombre_tramo})"]
+        filtro_edad = st.selectbox("Edad", opciones_edad, key="similares_edad")
+    with col4:
+        k = st.number_input("Casos", min_value=1, max_value=50, value=DEFAULT_K, key="similares_k")
+
+    codigos = {nombre: codigo for codigo, nombre in DIAGNOSTICO_MAP.items()}
+    with span("casos_similares"):
+        similares = index.search(
+            resultado.x, int(k),
+            diagnostico=codigos.get(filtro_diag),
+            area=filtro_area if filtro_area in AREA_MAP else None,
+            edad=tramo_edad if filtro_edad != "Todas las edades" else None,
+        )
+    if similares.empty:
+        st.info("No hay casos históricos que cumplan los filtros seleccionados.")
+        return
+    similares['sexo'] = similares['sexo'].map({codigo: nombre for nombre, codigo in SEXO_MAP.items()})
+    similares['area'] = similares['area'].map({codigo: nombre for nombre, codigo in AREA_MAP.items()})
+    st.write(f"Los {len(similares)} casos más parecidos entre {index.n_rows} casos históricos con diagnóstico confirmado "
+             "(distancia en el espacio escalado del modelo; leucocitos en 10³/µL):")
+    st.dataframe(similares.style.format({
+        "distancia": "{:.2f}", "edad": "{:.0f}", "pas": "{:.0f}", "pad": "{:.0f}", "temp": "{:.1f}",
+        "spo2": "{:.0f}", "glucosa": "{:.0f}", "hba1c": "{:.1f}", "leucocitos": "{:.1f}",
+    }), use_container_width=True, hide_index=True)
+
+@st.cache_data(show_spinner=False)
+def load_metric_report(name, mtime_ns, index_col=None):
+    """ CSV de reports/metrics; `mtime_ns` forma parte de la clave de caché. """
+    return pd.read_csv(METRICS_DIR / name, index_col=index_col)
+
+def read_metric_report(name, index_col=None):
+    """ Reporte de reports/metrics, o None si no existe. Se relee solo si cambió la fecha de modificación. """
+    try:
+        mtime_ns = (METRICS_DIR / name).stat().st_mtime_ns
+    except FileNotFoundError:
+        return None
+    return load_metric_report(name, mtime_ns, index_col)
+
+@st.cache_resource(show_spinner="Calculando curvas ROC y de calibración...")
+def load_eval_curves(model_version):
+    """ Curvas de la versión servida: se leen de reports/curves o se calculan una vez sobre X_test. """
+    return load_or_compute_curves(load_resources()["model"], model_version)
+
+def display_dashboard(resources):
+    import matplotlib.pyplot as plt
+
     st.header("Módulo de Dashboard de Métricas")
-    st.info("Esta sección presentará un dashboard con las métricas de rendimiento del modelo.")
+    model_version = resources["model_version"]
+    st.caption(f"Versión del modelo: {model_version}. Métricas de reports/metrics y del conjunto de prueba (X_test/y_test).")
+
+    reporte = read_metric_report("classification_report_test.csv", index_col=0)
+    finales = read_metric_report("metrics_final_test.csv")
+    try:
+        curvas = load_eval_curves(model_version)
+    except Exception as e:
+        curvas = None
+        st.warning(f"No se pudieron obtener las curvas ROC y de calibración: {e}")
+
+    # 1) Métricas principales
+    st.subheader("1. Rendimiento en el Conjunto de Prueba")
+    col1, col2, col3, col4 = st.columns(4)
+    if reporte is not None and 'accuracy' in reporte.index:
+        col1.metric("Accuracy", f"{reporte.loc['accuracy', 'precision']:.2%}")
+    if finales is not None:
+        col2.metric("Balanced accuracy", f"{finales['balanced_accuracy'].iloc[0]:.2%}")
+        col3.metric("Kappa de Cohen", f"{finales['cohen_kappa'].iloc[0]:.4f}")
+    if curvas is not None:
+        col4.metric("AUC macro (OvR)", f"{np.mean(list(curvas['auc'].values())):.4f}")
+
+    col_izq, col_der = st.columns(2)
+    with col_izq:
+        st.markdown("**Reporte de clasificación**")
+        if reporte is not None:
+            st.dataframe(reporte.style.format("{:.4f}"), use_container_width=True)
+        else:
+            st.info("No se encontró classification_report_test.csv.")
+    with col_der:
+        st.markdown("**Matriz de confusión** (filas: real, columnas: predicho)")
+        confusion = read_metric_report("confusion_matrix_test.csv", index_col=0)
+        if confusion is not None:
+            st.dataframe(confusion.style.background_gradient(cmap="Blues"), use_container_width=True)
+        else:
+            st.info("No se encontró confusion_matrix_test.csv.")
+
+    # 2) Curvas ROC y de calibración (precalculadas por versión del modelo)
+    st.markdown("---")
+    st.subheader("2. Curvas ROC y de Calibración")
+    if curvas is not None:
+        def draw_roc():
+            for clase in curvas["classes"]:
+                fpr, tpr = curvas["roc"][clase]
+                plt.plot(fpr, tpr, label=f"{clase} (AUC {curvas['auc'][clase]:.3f})")
+            plt.plot([0, 1], [0, 1], linestyle="--", color="grey", linewidth=1)
+            plt.xlabel("Tasa de falsos positivos")
+            plt.ylabel("Tasa de verdaderos positivos")
+            plt.title("ROC uno contra el resto")
+            plt.legend(loc="lower right")
+
+        def draw_calibration():
+            for clase in curvas["classes"]:
+                prob_pred, prob_true = curvas["calibration"][clase]
+                plt.plot(prob_pred, prob_true, marker="o", label=f"{clase} (Brier {curvas['brier'][clase]:.4f})")
+            plt.plot([0, 1], [0, 1], linestyle="--", color="grey", linewidth=1)
+            plt.xlabel("Probabilidad predicha")
+            plt.ylabel("Frecuencia observada")
+            plt.title("Curva de calibración")
+            plt.legend(loc="upper left")
+
+        col_roc, col_cal = st.columns(2)
+        col_roc.image(cached_figure_png(f"dashboard_{model_version}", "roc", draw_roc))
+        col_cal.image(cached_figure_png(f"dashboard_{model_version}", "calibracion", draw_calibration))
+
+    # 3) Validación cruzada (10 folds sobre X_train)
+    st.markdown("---")
+    st.subheader("3. Validación Cruzada")
+    filas = {}
+    for nombre in CV_MODELS:
+        # Mismo nombre de archivo que escribe `python -m src.evaluation cv`
+        folds = read_metric_report(f"cv_results_{nombre.lower().replace(' ', '_')}.csv")
+        if folds is not None:
+            metricas = folds[[m for m in CV_SCORING if m in folds.columns]]
+            filas[nombre] = {m: f"{metricas[m].mean():.4f} ± {metricas[m].std(ddof=0):.4f}" for m in metricas.columns}
+    if filas:
+        st.dataframe(pd.DataFrame(filas).T, use_container_width=True)
+    else:
+        st.info("No hay resultados de validación cruzada. Genérelos con `python -m src.evaluation cv`.")
+
+    # 4) Importancia global (SHAP medio absoluto por clase)
+    st.markdown("---")
+    st.subheader("4. Importancia Global de las Características (SHAP)")
+    clase = st.selectbox("Diagnóstico", options=[DIAGNOSTICO_MAP[i] for i in sorted(DIAGNOSTICO_MAP)], key="dashboard_shap_clase")
+    indice = list(DIAGNOSTICO_MAP.values()).index(clase)
+    importancia = read_metric_report(f"shap_mean_abs_class_{list(DIAGNOSTICO_MAP.keys())[indice]}.csv")
+    if importancia is not None:
+        st.bar_chart(importancia.nlargest(15, "mean_abs_shap").set_index("feature"), horizontal=True)
+    else:
+        st.info("No se encontró el resumen SHAP de esta clase.")
 
 # --- Aplicación Principal ---
 def main():
@@ -991,7 +1234,7 @@ def main():
     if resources["error"]:
         st.sidebar.error(resources["error"])
         st.error(resources["error"])
-        st.warning("La aplicación no puede funcionar hasta que los archivos del modelo y scaler estén en la ubicación correcta (`models/`).")
+        st.warning("La aplicación no puede funcionar hasta que los archivos del modelo, scaler y manifiesto estén en la ubicación correcta (`models/`).")
         return
 
     st.sidebar.title("Navegación")
@@ -1008,7 +1251,7 @@ def main():
     elif selection == "Análisis de Resultados":
         display_analisis(resources)
     elif selection == "Dashboard de Métricas":
-        display_dashboard()
+        display_dashboard(resources)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
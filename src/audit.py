@@ -0,0 +1,335 @@
+# Registro de auditoría de predicciones
+"""
+Almacén local de solo-añadir (SQLite en modo WAL) con cada predicción de la app y del
+servicio HTTP. La escritura la hace un hilo en segundo plano que agrupa los registros en
+transacciones, de modo que quien predice solo encola. En la misma transacción se
+actualizan los agregados por día, distrito y diagnóstico (tabla resumen_diario), así que
+los conteos de meses de historial leen esos agregados en vez de recorrer las predicciones.
+
+Se configura con variables de entorno:
+    CDSS_AUDIT=0            desactiva el registro
+    CDSS_AUDIT_DB=ruta.db   base de datos (por defecto data/audit/predicciones.db)
+"""
+import argparse
+import atexit
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+
+from src.utils import BASE_PATH
+
+AUDIT_DB = BASE_PATH / "data" / "audit" / "predicciones.db"
+DEFAULT_BATCH_SIZE = 256
+DEFAULT_FLUSH_S = 0.5
+MAX_QUEUE = 10_000
+AGRUPACIONES = ('fecha', 'distrito', 'diagnostico')
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS predicciones (
+    id INTEGER PRIMARY KEY,
+    ts REAL NOT NULL,
+    fecha TEXT NOT NULL,
+    prediction_id TEXT,
+    model_version TEXT,
+    origen TEXT NOT NULL,
+    distrito TEXT,
+    diagnostico TEXT NOT NULL,
+    confianza REAL NOT NULL,
+    probabilidades TEXT NOT NULL,
+    n_alertas INTEGER NOT NULL,
+    entradas TEXT
+);
+CREATE TABLE IF NOT EXISTS resumen_diario (
+    fecha TEXT NOT NULL,
+    distrito TEXT NOT NULL,
+    diagnostico TEXT NOT NULL,
+    n INTEGER NOT NULL,
+    suma_confianza REAL NOT NULL,
+    n_con_alertas INTEGER NOT NULL,
+    PRIMARY KEY (fecha, distrito, diagnostico)
+) WITHOUT ROWID;
+CREATE TRIGGER IF NOT EXISTS predicciones_sin_update BEFORE UPDATE ON predicciones
+BEGIN SELECT RAISE(ABORT, 'el registro de auditoría es de solo-añadir'); END;
+CREATE TRIGGER IF NOT EXISTS predicciones_sin_delete BEFORE DELETE ON predicciones
+BEGIN SELECT RAISE(ABORT, 'el registro de auditoría es de solo-añadir'); END;
+"""
+
+_INSERT = """
+INSERT INTO predicciones (ts, fecha, prediction_id, model_version, origen, distrito, diagnostico,
+                          confianza, probabilidades, n_alertas, entradas)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+_UPSERT_RESUMEN = """
+INSERT INTO resumen_diario (fecha, distrito, diagnostico, n, suma_confianza, n_con_alertas)
+VALUES (?, ?, ?, ?, ?, ?)
+ON CONFLICT (fecha, distrito, diagnostico) DO UPDATE SET
+    n = n + excluded.n,
+    suma_confianza = suma_confianza + excluded.suma_confianza,
+    n_con_alertas = n_con_alertas + excluded.n_con_alertas
+"""
+
+SIN_DISTRITO = "(sin distrito)"
+
+
+def connect(path=AUDIT_DB):
+    """ Conexión con el esquema creado, WAL y synchronous=NORMAL (seguro con WAL y sin fsync por transacción). """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    conn = sqlite3.connect(path, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.executescript(_SCHEMA)
+    return conn
+
+
+def make_record(inputs, pred_proba, class_names, model_version=None, prediction_id=None, n_alertas=0,
+                origen="app", ts=None, store_inputs=True):
+    """ Fila de auditoría de una predicción: diagnóstico principal, probabilidades y entradas (distrito como código). """
+    ts = time.time() if ts is None else ts
+    principal = int(max(range(len(pred_proba)), key=lambda i: pred_proba[i]))
+    return (
+        ts,
+        datetime.fromtimestamp(ts).strftime("%Y-%m-%d"),
+        prediction_id,
+        model_version,
+        origen,
+        SIN_DISTRITO if inputs.get('distrito') is None else str(inputs['distrito']),
+        class_names[principal],
+        float(pred_proba[principal]),
+        json.dumps({class_names[i]: round(float(p), 6) for i, p in enumerate(pred_proba)}, ensure_ascii=False),
+        int(n_alertas),
+        json.dumps(inputs, ensure_ascii=False, default=_json_default) if store_inputs else None,
+    )
+
+
+def _json_default(valor):
+    if hasattr(valor, "item"):
+        return valor.item()
+    raise TypeError(f"Tipo no serializable: {type(valor).__name__}")
+
+
+def write_batch(conn, filas):
+    """ Inserta las filas y actualiza resumen_diario en una sola transacción. """
+    resumen = Counter()
+    confianza = Counter()
+    alertas = Counter()
+    for fila in filas:
+        clave = (fila[1], fila[5], fila[6])
+        resumen[clave] += 1
+        confianza[clave] += fila[7]
+        alertas[clave] += fila[9] > 0
+    with conn:
+        conn.executemany(_INSERT, filas)
+        conn.executemany(_UPSERT_RESUMEN, [(*clave, n, confianza[clave], alertas[clave]) for clave, n in resumen.items()])
+
+
+class AuditWriter:
+    """
+    Escritor en segundo plano: `record` encola sin bloquear y un hilo daemon escribe en
+    lotes de hasta `batch_size` filas o cada `flush_s` segundos. Si la cola se llena (disco
+    bloqueado), los registros se descartan y se cuentan en `dropped`.
+    """
+
+    def __init__(self, path=AUDIT_DB, batch_size=DEFAULT_BATCH_SIZE, flush_s=DEFAULT_FLUSH_S, max_queue=MAX_QUEUE):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_s = flush_s
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.written = 0
+        self.batches = 0
+        self.dropped = 0
+        self.errors = 0
+        self._closed = False
+        connect(path).close()  # errores de ruta o permisos al crear, no en el hilo
+        self._thread = threading.Thread(target=self._run, name="cdss-audit-writer", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def record(self, fila):
+        """ Encola una fila de make_record; nunca bloquea. """
+        try:
+            self.queue.put_nowait(fila)
+        except queue.Full:
+            self.dropped += 1
+
+    def flush(self):
+        """ Espera a que todo lo encolado esté escrito. """
+        self.queue.join()
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self.queue.put(None)
+        self._thread.join(timeout=10)
+
+    def _run(self):
+        conn = connect(self.path)
+        seguir = True
+        while seguir:
+            lote = [self.queue.get()]
+            limite = time.monotonic() + self.flush_s
+            while len(lote) < self.batch_size and lote[-1] is not None:
+                restante = limite - time.monotonic()
+                try:
+                    lote.append(self.queue.get(timeout=restante) if restante > 0 else self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            if lote[-1] is None:
+                seguir = False
+            filas = [fila for fila in lote if fila is not None]
+            try:
+                if filas:
+                    write_batch(conn, filas)
+                    self.written += len(filas)
+                    self.batches += 1
+            except sqlite3.Error as e:
+                self.errors += len(filas)
+                print(f"⚠️ No se pudo escribir el lote de auditoría ({len(filas)} predicciones): {e}")
+            finally:
+                for _ in lote:
+                    self.queue.task_done()
+        conn.close()
+
+
+def writer_from_env():
+    """ AuditWriter según CDSS_AUDIT / CDSS_AUDIT_DB, o None si está desactivado o no se puede abrir. """
+    if os.environ.get("CDSS_AUDIT", "1") in ("", "0"):
+        return None
+    try:
+        return AuditWriter(os.environ.get("CDSS_AUDIT_DB", AUDIT_DB))
+    except (OSError, sqlite3.Error) as e:
+        print(f"⚠️ Registro de auditoría no disponible: {e}")
+        return None
+
+
+# --- Consultas ---
+def counts(conn, desde=None, hasta=None, por=AGRUPACIONES):
+    """
+    Predicciones, confianza media y casos con alertas entre las fechas `desde` y `hasta`
+    (YYYY-MM-DD, inclusive), agrupadas por las columnas `por` de resumen_diario.
+    """
+    import pandas as pd
+
+    por = list(por)
+    if any(col not in AGRUPACIONES for col in por):
+        raise ValueError(f"Agrupación no válida: {por}; use columnas de {AGRUPACIONES}")
+    condiciones, params = [], []
+    if desde:
+        condiciones.append("fecha >= ?")
+        params.append(desde)
+    if hasta:
+        condiciones.append("fecha <= ?")
+        params.append(hasta)
+    where = f"WHERE {' AND '.join(condiciones)}" if condiciones else ""
+    columnas = ", ".join(por)
+    consulta = (f"SELECT {columnas + ', ' if por else ''}SUM(n) AS n, SUM(suma_confianza) / SUM(n) AS confianza_media, "
+                f"SUM(n_con_alertas) AS n_con_alertas FROM resumen_diario {where}"
+                + (f" GROUP BY {columnas} ORDER BY {columnas}" if por else ""))
+    return pd.read_sql_query(consulta, conn, params=params)
+
+
+def rebuild_rollups(conn):
+    """ Recalcula resumen_diario desde las predicciones (reparación o verificación). """
+    with conn:
+        conn.execute("DELETE FROM resumen_diario")
+        conn.execute("""
+            INSERT INTO resumen_diario (fecha, distrito, diagnostico, n, suma_confianza, n_con_alertas)
+            SELECT fecha, distrito, diagnostico, COUNT(*), SUM(confianza), SUM(n_alertas > 0)
+            FROM predicciones GROUP BY fecha, distrito, diagnostico
+        """)
+
+
+def bench_audit(n_dias=180, por_dia=2000, path=None):
+    """
+    Llena una base temporal con `n_dias` × `por_dia` predicciones sintéticas a través del
+    AuditWriter y compara el conteo por distrito y diagnóstico leyendo resumen_diario
+    frente a agrupar la tabla de predicciones. Devuelve un dict de tiempos.
+    """
+    import random
+    import tempfile
+
+    from src.preprocessing import DIAGNOSTICO_MAP
+
+    clases = [DIAGNOSTICO_MAP[i] for i in sorted(DIAGNOSTICO_MAP)]
+    distritos = list(range(10))  # códigos de distrito, como en el formulario
+    rng = random.Random(0)
+    tmp_dir = tempfile.mkdtemp(prefix="cdss_audit_")
+    path = path or os.path.join(tmp_dir, "bench.db")
+    writer = AuditWriter(path)
+    inicio_ts = time.time() - n_dias * 86400
+    entradas = {'distrito': None, 'edad': 40}
+
+    encolado = []
+    inicio = time.perf_counter()
+    for dia in range(n_dias):
+        for _ in range(por_dia):
+            entradas['distrito'] = rng.choice(distritos)
+            proba = [rng.random() for _ in clases]
+            total = sum(proba)
+            t = time.perf_counter()
+            writer.record(make_record(entradas, [p / total for p in proba], clases, "bench",
+                                      n_alertas=rng.random() < 0.2, ts=inicio_ts + dia * 86400 + rng.random() * 86000))
+            encolado.append(time.perf_counter() - t)
+    writer.flush()
+    escritura = time.perf_counter() - inicio
+    writer.close()
+
+    conn = connect(path)
+    t = time.perf_counter()
+    agregado = counts(conn, por=('distrito', 'diagnostico'))
+    lectura_resumen = time.perf_counter() - t
+    t = time.perf_counter()
+    crudo = conn.execute("SELECT distrito, diagnostico, COUNT(*) FROM predicciones GROUP BY distrito, diagnostico").fetchall()
+    lectura_cruda = time.perf_counter() - t
+    conn.close()
+    assert int(agregado['n'].sum()) == sum(n for _, _, n in crudo) == n_dias * por_dia
+    encolado.sort()
+    return {
+        "predicciones": n_dias * por_dia,
+        "escritura_s": escritura,
+        "filas_por_s": n_dias * por_dia / escritura,
+        "encolar_p50_us": encolado[len(encolado) // 2] * 1e6,
+        "encolar_p99_us": encolado[int(len(encolado) * 0.99)] * 1e6,
+        "lotes": writer.batches,
+        "conteo_resumen_ms": lectura_resumen * 1e3,
+        "conteo_tabla_ms": lectura_cruda * 1e3,
+        "db": path,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Registro de auditoría de predicciones (SQLite).")
+    parser.add_argument("--db", default=os.environ.get("CDSS_AUDIT_DB", str(AUDIT_DB)))
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    resumen = subparsers.add_parser("resumen", help="Conteos por día, distrito y diagnóstico desde los agregados.")
+    resumen.add_argument("--desde", default=None, help="Fecha inicial (YYYY-MM-DD).")
+    resumen.add_argument("--hasta", default=None, help="Fecha final (YYYY-MM-DD).")
+    resumen.add_argument("--por", nargs="*", default=['distrito', 'diagnostico'], choices=AGRUPACIONES)
+    subparsers.add_parser("rebuild", help="Recalcula los agregados desde las predicciones.")
+    bench = subparsers.add_parser("bench", help="Escritura en lotes y conteos sobre historial sintético.")
+    bench.add_argument("--dias", type=int, default=180)
+    bench.add_argument("--por-dia", type=int, default=2000)
+    args = parser.parse_args()
+
+    if args.command == "bench":
+        for clave, valor in bench_audit(args.dias, args.por_dia).items():
+            print(f"{clave}: {valor:.3f}" if isinstance(valor, float) else f"{clave}: {valor}")
+        return
+    conn = connect(args.db)
+    if args.command == "resumen":
+        print(counts(conn, args.desde, args.hasta, args.por).to_string(index=False, float_format="{:.3f}".format))
+    elif args.command == "rebuild":
+        rebuild_rollups(conn)
+        total = conn.execute("SELECT COUNT(*) FROM predicciones").fetchone()[0]
+        print(f"✅ Agregados recalculados a partir de {total} predicciones")
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+# Backends de inferencia para el clasificador XGBoost del modelo final
+import json
+
+import numpy as np
+
+
+def _as_float32(X):
+    """ Matriz contigua float32 en el orden de características del modelo. """
+    if hasattr(X, 'to_numpy'):
+        X = X.to_numpy()
+    return np.ascontiguousarray(X, dtype=np.float32)
+
+
+class SklearnBackend:
+    """ Referencia: predict_proba del wrapper XGBClassifier, como en la app original. """
+    name = 'sklearn'
+
+    def __init__(self, model):
+        self.classifier = model.named_steps['classifier']
+
+    def predict_proba(self, X):
+        return self.classifier.predict_proba(_as_float32(X))
+
+
+class BoosterBackend:
+    """ Booster nativo con inplace_predict, sin pasar por el wrapper de sklearn. """
+    name = 'booster'
+
+    def __init__(self, model):
+        self.booster = model.named_steps['classifier'].get_booster()
+
+    def predict_proba(self, X):
+        return self.booster.inplace_predict(_as_float32(X), validate_features=False)
+
+
+class NumpyTreeBackend:
+    """
+    Evaluador de árboles en NumPy puro. Los árboles del booster se aplanan en arreglos
+    globales (feature, umbral, hijos, default_left) y todas las filas avanzan un nivel
+    por iteración en todos los árboles a la vez.
+    """
+    name = 'numpy'
+
+    def __init__(self, model):
+        booster = model.named_steps['classifier'].get_booster()
+        learner = json.loads(booster.save_raw('json'))['learner']
+        if learner['objective']['name'] != 'multi:softprob':
+            raise ValueError(f"Objetivo no soportado: {learner['objective']['name']}")
+        arboles = learner['gradient_booster']['model']['trees']
+
+        self.n_classes = int(learner['learner_model_param']['num_class'])
+        self.base_score = np.float32(learner['learner_model_param']['base_score'])
+        self.tree_class = np.asarray(learner['gradient_booster']['model']['tree_info'], dtype=np.intp)
+
+        raices, features, umbrales, izquierdos, derechos, default_left = [], [], [], [], [], []
+        offset = 0
+        profundidad = 0
+        for arbol in arboles:
+            left = np.asarray(arbol['left_children'], dtype=np.int32)
+            right = np.asarray(arbol['right_children'], dtype=np.int32)
+            hoja = left == -1
+            # Las hojas apuntan a sí mismas para que el recorrido se detenga en ellas
+            nodos = np.arange(offset, offset + len(left), dtype=np.int32)
+            izquierdos.append(np.where(hoja, nodos, left + offset))
+            derechos.append(np.where(hoja, nodos, right + offset))
+            features.append(np.where(hoja, 0, arbol['split_indices']).astype(np.int32))
+            umbrales.append(np.asarray(arbol['split_conditions'], dtype=np.float32))
+            default_left.append(np.asarray(arbol['default_left'], dtype=bool))
+            raices.append(offset)
+            offset += len(left)
+            profundidad = max(profundidad, self._depth(left, right))
+
+        self.roots = np.asarray(raices, dtype=np.int32)
+        self.feature = np.concatenate(features)
+        self.threshold = np.concatenate(umbrales)
+        self.left = np.concatenate(izquierdos)
+        self.right = np.concatenate(derechos)
+        self.default_left = np.concatenate(default_left)
+        # En las hojas split_conditions guarda el valor de la hoja
+        self.leaf_value = self.threshold
+        self.max_depth = profundidad
+
+    @staticmethod
+    def _depth(left, right):
+        profundidad, nivel = 0, [0]
+        while nivel:
+            siguiente = [h for n in nivel for h in (left[n], right[n]) if h != -1]
+            if siguiente:
+                profundidad += 1
+            nivel = siguiente
+        return profundidad
+
+    def predict_margin(self, X):
+        X = _as_float32(X)
+        filas = np.arange(X.shape[0])[:, None]
+        nodos = np.broadcast_to(self.roots, (X.shape[0], len(self.roots))).copy()
+        for _ in range(self.max_depth):
+            valores = X[filas, self.feature[nodos]]
+            ir_izquierda = np.where(np.isnan(valores), self.default_left[nodos], valores < self.threshold[nodos])
+            nodos = np.where(ir_izquierda, self.left[nodos], self.right[nodos])
+        hojas = self.leaf_value[nodos]
+        margen = np.full((X.shape[0], self.n_classes), self.base_score, dtype=np.float32)
+        for k in range(self.n_classes):
+            margen[:, k] += hojas[:, self.tree_class == k].sum(axis=1, dtype=np.float32)
+        return margen
+
+    def predict_proba(self, X):
+        margen = self.predict_margin(X)
+        margen -= margen.max(axis=1, keepdims=True)
+        np.exp(margen, out=margen)
+        margen /= margen.sum(axis=1, keepdims=True)
+        return margen
+
+
+class OnnxBackend:
+    """ Exportación ONNX del clasificador ejecutada con onnxruntime en CPU (requiere onnxmltools y onnxruntime). """
+    name = 'onnx'
+
+    def __init__(self, model):
+        try:
+            import onnxruntime as ort
+            from onnxmltools.convert import convert_xgboost
+            from onnxmltools.convert.common.data_types import FloatTensorType
+        except ImportError as e:
+            raise ImportError("El backend 'onnx' requiere los paquetes opcionales onnxmltools y onnxruntime.") from e
+
+        classifier = model.named_steps['classifier']
+        n_features = len(model.feature_names_in_)
+        # El conversor espera features anónimas (f0, f1, ...): se convierte una copia del booster
+        booster = classifier.get_booster().copy()
+        booster.feature_names = None
+        booster.feature_types = None
+        onnx_model = convert_xgboost(booster, initial_types=[('input', FloatTensorType([None, n_features]))],
+                                     target_opset=15)
+
+        opciones = ort.SessionOptions()
+        opciones.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(onnx_model.SerializeToString(), opciones,
+                                            providers=['CPUExecutionProvider'])
+        self.input_name = self.session.get_inputs()[0].name
+        self.output_name = self.session.get_outputs()[1].name
+
+    def predict_proba(self, X):
+        return self.session.run([self.output_name], {self.input_name: _as_float32(X)})[0]
+
+
+BACKENDS = {
+    backend.name: backend
+    for backend in (SklearnBackend, BoosterBackend, NumpyTreeBackend, OnnxBackend)
+}
+
+
+def load_backend(name, model):
+    """ Instancia el backend `name` a partir del pipeline cargado de final_model.pkl. """
+    if name not in BACKENDS:
+        raise ValueError(f"Backend desconocido: '{name}'. Opciones: {sorted(BACKENDS)}")
+    return BACKENDS[name](model)
@@ -0,0 +1,724 @@
+# Mediciones de rendimiento de las rutas críticas del CDSS
+import argparse
+import asyncio
+import json
+import subprocess
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from src.backends import BACKENDS, load_backend
+from src.models import CompiledPredictor
+from src.preprocessing import (ANTECEDENTES, AREA_MAP, IMC_BINS, IMC_LABELS, NUMERICAL_COLS, SEXO_MAP, SINO_MAP,
+                               UNIDADES_FORMULARIO)
+from src.utils import BASE_PATH, load_artifacts, load_dataset, stable_hash
+from src.validation import RANGOS_CLINICOS, validate
+
+
+def sample_inputs(feature_names):
+    """ Entradas de ejemplo con los valores por defecto del formulario de predicción. """
+    inputs = {
+        'edad': 45, 'sexo': 'Femenino', 'area': 'Rural', 'distrito': 5, 'ocupacion': 8,
+        'tiempo_enfermedad': 7, 'imc': round(70.0 / 1.65 ** 2, 2),
+        'pas': 120, 'pad': 80, 'fc': 80, 'fr': 18, 'temp': 37.0, 'spo2': 98,
+        'glucosa': 100, 'hba1c': 5.7, 'creatinina': 1.0, 'colesterol': 180, 'leucocitos': 7500,
+    }
+    inputs.update({col: 'No' for col in ANTECEDENTES})
+    inputs.update({col: False for col in feature_names if col.startswith('sintoma_')})
+    inputs['sintoma_tos'] = True
+    inputs['sintoma_fiebre'] = True
+    return inputs
+
+
+def legacy_frame(inputs, model, scaler):
+    """ DataFrame procesado de una fila que construía display_prediccion: dict -> pd.cut -> scaler. """
+    input_data = {
+        'sexo': SEXO_MAP[inputs['sexo']],
+        'area': AREA_MAP[inputs['area']],
+        **{col: SINO_MAP[inputs[col]] for col in ANTECEDENTES},
+    }
+    for col in model.feature_names_in_:
+        if col.startswith('sintoma_'):
+            input_data[col] = 1 if inputs[col] else 0
+    for key in ['edad', 'distrito', 'ocupacion', 'imc', 'pas', 'pad', 'fc', 'fr', 'temp', 'spo2', 'glucosa', 'hba1c', 'creatinina', 'colesterol', 'leucocitos', 'tiempo_enfermedad']:
+        input_data[key] = inputs[key]
+    # Mismas unidades que CompiledPredictor (leucocitos del formulario a 10³/µL)
+    for key, factor in UNIDADES_FORMULARIO.items():
+        input_data[key] = input_data[key] * factor
+    input_data['presion_pulso'] = input_data['pas'] - input_data['pad']
+    input_data['imc_categoria'] = pd.cut([input_data['imc']], bins=IMC_BINS, labels=IMC_LABELS, right=False)[0]
+
+    df_input = pd.DataFrame([input_data])[model.feature_names_in_]
+    df_input[NUMERICAL_COLS] = scaler.transform(df_input[NUMERICAL_COLS])
+    return df_input
+
+
+def legacy_predict(inputs, model, scaler):
+    """ Ruta original de display_prediccion: DataFrame de legacy_frame -> pipeline. """
+    return model.predict_proba(legacy_frame(inputs, model, scaler))[0]
+
+
+def measure_latency(func, repeats=1000, warmup=20):
+    """ Ejecuta `func` repetidamente y devuelve un dict con percentiles de latencia en milisegundos. """
+    for _ in range(warmup):
+        func()
+    tiempos = np.empty(repeats)
+    for i in range(repeats):
+        inicio = time.perf_counter()
+        func()
+        tiempos[i] = time.perf_counter() - inicio
+    tiempos *= 1e3
+    return {
+        'p50_ms': float(np.percentile(tiempos, 50)),
+        'p99_ms': float(np.percentile(tiempos, 99)),
+        'mean_ms': float(tiempos.mean()),
+    }
+
+
+def bench_single_patient(model, scaler, repeats=1000):
+    """ Compara la ruta original de un paciente con CompiledPredictor. """
+    predictor = CompiledPredictor(model, scaler)
+    inputs = sample_inputs(predictor.feature_names)
+
+    esperado = legacy_predict(inputs, model, scaler)
+    obtenido = predictor.predict_proba(predictor.transform(inputs))[0]
+    if not np.allclose(esperado, obtenido, atol=1e-6):
+        raise AssertionError(f"Las probabilidades no coinciden: {esperado} vs {obtenido}")
+
+    return pd.DataFrame({
+        'antes (DataFrame)': measure_latency(lambda: legacy_predict(inputs, model, scaler), repeats),
+        'despues (CompiledPredictor)': measure_latency(lambda: predictor.predict_proba(predictor.transform(inputs)), repeats),
+    }).T
+
+
+def bench_backends(model, X, batch_sizes=(1, 64, 4000), backends=None, repeats=50):
+    """ Latencia y throughput (filas/s) de cada backend de inferencia por tamaño de lote. """
+    X = np.ascontiguousarray(X, dtype=np.float32)
+    filas = []
+    for name in backends or BACKENDS:
+        try:
+            backend = load_backend(name, model)
+        except ImportError as e:
+            print(f"⏭️ Backend '{name}' omitido: {e}")
+            continue
+        for batch in batch_sizes:
+            lote = X[:batch]
+            # Menos repeticiones para lotes grandes, con un mínimo de 5
+            n = max(5, repeats * 64 // max(batch, 64))
+            latencia = measure_latency(lambda: backend.predict_proba(lote), n, warmup=3)
+            filas.append({'backend': name, 'batch_size': len(lote), **latencia,
+                          'rows_per_s': len(lote) / (latencia['p50_ms'] / 1e3)})
+    return pd.DataFrame(filas)
+
+
+async def _load_client(host, port, cuerpo, n_requests):
+    reader, writer = await asyncio.open_connection(host, port)
+    peticion = (f"POST /predict HTTP/1.1\r\nHost: {host}\r\nContent-Type: application/json\r\n"
+                f"Content-Length: {len(cuerpo)}\r\n\r\n").encode("latin-1") + cuerpo
+    for _ in range(n_requests):
+        writer.write(peticion)
+        await writer.drain()
+        longitud = 0
+        while (linea := await reader.readline()) not in (b"\r\n", b""):
+            if linea.lower().startswith(b"content-length:"):
+                longitud = int(linea.split(b":")[1])
+        await reader.readexactly(longitud)
+    writer.close()
+
+
+def bench_service(model, scaler, concurrency=32, requests_per_client=50, batch_sizes=(1, 64), max_wait_ms=2.0):
+    """
+    Throughput de /predict del servicio HTTP con `concurrency` clientes simultáneos,
+    comparando llamadas de una fila (max_batch_size=1) con micro-batching.
+    """
+    from app.service import CDSSService, start_server
+
+    cuerpo = json.dumps(sample_inputs(model.feature_names_in_)).encode("utf-8")
+    filas = []
+    for max_batch_size in batch_sizes:
+        service = CDSSService(CompiledPredictor(model, scaler), None, max_batch_size, max_wait_ms)
+
+        async def run():
+            server = await start_server(service, "127.0.0.1", 0)
+            port = server.sockets[0].getsockname()[1]
+            inicio = time.perf_counter()
+            await asyncio.gather(*[_load_client("127.0.0.1", port, cuerpo, requests_per_client) for _ in range(concurrency)])
+            duracion = time.perf_counter() - inicio
+            server.close()
+            await server.wait_closed()
+            await service.stop()
+            return duracion
+
+        duracion = asyncio.run(run())
+        total = concurrency * requests_per_client
+        filas.append({'max_batch_size': max_batch_size, 'concurrency': concurrency, 'requests': total,
+                      'seconds': duracion, 'requests_per_s': total / duracion,
+                      'mean_batch': service.predict_batcher.rows / max(service.predict_batcher.batches, 1)})
+    return pd.DataFrame(filas)
+
+
+# --- Arranque en frío de la app ---
+HEAVY_MODULES = ['numpy', 'pandas', 'joblib', 'streamlit', 'sklearn', 'xgboost', 'imblearn', 'matplotlib.pyplot', 'shap', 'fpdf']
+APP_PAGES = ["Inicio", "Predicción de Diagnóstico", "Análisis de Resultados", "Dashboard de Métricas"]
+
+
+def _run_python(code):
+    """ Ejecuta `code` en un intérprete nuevo y devuelve la última línea de stdout como JSON. """
+    salida = subprocess.run([sys.executable, "-W", "ignore", "-c", code], cwd=BASE_PATH,
+                            capture_output=True, text=True, check=True)
+    return json.loads(salida.stdout.strip().splitlines()[-1])
+
+
+def bench_imports(modules=HEAVY_MODULES):
+    """ Tiempo de importación de cada módulo pesado en un proceso nuevo (sin caché de sys.modules). """
+    filas = []
+    for module in modules:
+        code = ("import json, time; t = time.perf_counter(); "
+                f"import {module}; print(json.dumps(time.perf_counter() - t))")
+        filas.append({'module': module, 'import_s': _run_python(code)})
+    return pd.DataFrame(filas)
+
+
+_COLD_START_WORKER = """
+import json, sys, time, warnings
+warnings.filterwarnings("ignore")
+from streamlit.testing.v1 import AppTest
+heavy = {heavy!r}
+pasos = []
+inicio = time.perf_counter()
+at = AppTest.from_file({app!r}, default_timeout=300)
+
+def medir(nombre, accion):
+    t = time.perf_counter()
+    accion()
+    pasos.append({{"step": nombre, "render_s": time.perf_counter() - t,
+                  "since_start_s": time.perf_counter() - inicio,
+                  "loaded": ",".join(m for m in heavy if m in sys.modules)}})
+
+medir("Inicio", at.run)
+medir("Predicción de Diagnóstico", lambda: at.sidebar.radio[0].set_value("Predicción de Diagnóstico").run())
+medir("Analizar Caso Clínico", lambda: at.button[0].click().run())
+medir("Análisis de Resultados", lambda: at.sidebar.radio[0].set_value("Análisis de Resultados").run())
+medir("Dashboard de Métricas", lambda: at.sidebar.radio[0].set_value("Dashboard de Métricas").run())
+print(json.dumps(pasos))
+"""
+
+
+def bench_cold_start():
+    """
+    Time-to-first-render de cada página en un proceso nuevo de Streamlit (AppTest),
+    en el orden en que un clínico recorre la app. `loaded` indica qué módulos pesados
+    ya estaban importados tras cada paso.
+    """
+    code = _COLD_START_WORKER.format(heavy=HEAVY_MODULES, app=str(BASE_PATH / "app" / "streamlit_app.py"))
+    return pd.DataFrame(_run_python(code))
+
+
+_SOAK_WORKER = """
+import gc, json, os, warnings
+warnings.filterwarnings("ignore")
+from streamlit.testing.v1 import AppTest
+
+def rss_mb():
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+
+at = AppTest.from_file({app!r}, default_timeout=300)
+at.run()
+at.sidebar.radio[0].set_value("Predicción de Diagnóstico").run()
+at.button[0].click().run()
+muestras = []
+for visita in range(1, {visits} + 1):
+    at.sidebar.radio[0].set_value("Análisis de Resultados").run()
+    at.sidebar.radio[0].set_value("Inicio").run()
+    if visita == 1 or visita % {sample_every} == 0:
+        gc.collect()
+        import matplotlib.pyplot as plt
+        muestras.append({{"visits": visita, "rss_mb": rss_mb(), "open_figures": len(plt.get_fignums())}})
+print(json.dumps(muestras))
+"""
+
+
+def bench_analysis_soak(visits=300, sample_every=50):
+    """
+    Prueba de resistencia de la página de análisis: cientos de visitas en una misma sesión
+    de AppTest, muestreando RSS y figuras de matplotlib abiertas. Con la caché de figuras y
+    el cierre explícito, ambas deben mantenerse planas.
+    """
+    code = _SOAK_WORKER.format(app=str(BASE_PATH / "app" / "streamlit_app.py"), visits=visits, sample_every=sample_every)
+    return pd.DataFrame(_run_python(code))
+
+
+# --- Memoria del estado de sesión con muchas sesiones concurrentes ---
+_SESSIONS_WORKER = """
+import gc, json, os, tracemalloc, warnings
+warnings.filterwarnings("ignore")
+import numpy as np
+from app.session import PredictionResult
+from src.benchmarks import legacy_frame, sample_inputs
+from src.explanations import create_explainer
+from src.models import CompiledPredictor, summarize_prediction
+from src.utils import load_artifacts, stable_hash
+from src.validation import validate
+
+def rss_mb():
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+
+model, scaler = load_artifacts()
+predictor = CompiledPredictor(model, scaler)
+feature_names = list(model.feature_names_in_)
+rng = np.random.default_rng(0)
+
+def legacy_state(inputs, alertas, explainer=create_explainer(model, 'tree')):
+    # Lo que guardaba display_prediccion antes del registro compacto: el DataFrame procesado
+    # de una fila, la salida de shap.TreeExplainer tal cual y el dict de resultados con las entradas
+    df_input = legacy_frame(inputs, model, scaler)
+    pred_proba = model.predict_proba(df_input)[0]
+    return {{
+        'shap_values': explainer.shap_values(df_input), 'feature_names': feature_names,
+        'df_input_processed': df_input,
+        'results': {{**summarize_prediction(pred_proba), 'alertas': alertas, 'inputs': inputs}},
+    }}
+
+def compact_state(inputs, alertas, explainer=create_explainer(model)):
+    x_input = predictor.transform(inputs)
+    pred_proba = predictor.predict_proba(x_input)[0]
+    return {{'resultado': PredictionResult.create(stable_hash(inputs), 'bench', pred_proba, x_input, feature_names,
+                                                  alertas, inputs, explainer.shap_values(x_input))}}
+
+def new_session(build):
+    inputs = sample_inputs(feature_names)
+    inputs.update(edad=int(rng.integers(1, 90)), pas=int(rng.integers(90, 200)), glucosa=int(rng.integers(60, 300)),
+                  temp=round(float(rng.uniform(35.5, 40)), 1), area=str(rng.choice(['Rural', 'Urbano'])))
+    return build(inputs, validate(inputs).messages(0, raw=inputs))
+
+build = {{'legacy': legacy_state, 'compact': compact_state}}[{layout!r}]
+[new_session(build) for _ in range(5)]
+gc.collect()
+rss_inicial = rss_mb()
+tracemalloc.start()
+sesiones = [new_session(build) for _ in range({sessions})]
+gc.collect()
+retenido = tracemalloc.get_traced_memory()[0]
+print(json.dumps({{"rss_mb": rss_mb() - rss_inicial, "retained_kb": retenido / 1024,
+                  "kb_per_session": retenido / 1024 / len(sesiones)}}))
+"""
+
+
+def bench_sessions(sessions=200, layouts=("legacy", "compact")):
+    """
+    Memoria de `sessions` sesiones concurrentes con un resultado de predicción cada una, en
+    un proceso nuevo por formato: 'legacy' (como la app anterior: DataFrame procesado de una
+    fila, salida de shap.TreeExplainer y dict de resultados con las entradas en bruto) frente
+    a 'compact' (app.session.PredictionResult con CompiledPredictor y BoosterExplainer).
+    Cada sesión pasa por el preprocesamiento, el modelo, SHAP y la validación reales.
+    """
+    filas = []
+    for layout in layouts:
+        resultado = _run_python(_SESSIONS_WORKER.format(layout=layout, sessions=sessions))
+        filas.append({'layout': layout, 'sessions': sessions, **resultado})
+    return pd.DataFrame(filas)
+
+
+# --- Carga de datos: CSV frente a formato columnar ---
+_DATA_LOADING_WORKER = """
+import json, os, time, warnings
+warnings.filterwarnings("ignore")
+import numpy as np, pandas as pd
+from src.utils import _source_path, load_arrays, load_dataset
+
+def rss_mb():
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+
+antes = rss_mb()
+t = time.perf_counter()
+{load}
+duracion = time.perf_counter() - t
+print(json.dumps({{"load_s": duracion, "rss_delta_mb": rss_mb() - antes}}))
+"""
+
+_DATA_LOADERS = {
+    'read_csv': "df = pd.read_csv(_source_path({name!r}))",
+    'load_dataset': "df = load_dataset({name!r})",
+    'load_arrays (mmap)': "cols = load_arrays({name!r}); total = sum(float(np.sum(c)) for c in cols.values())",
+}
+
+
+def bench_data_loading(datasets=("X_test", "dataset_clinico_huancayo_20k_processed")):
+    """
+    Tiempo de carga e incremento de RSS de cada dataset en un proceso nuevo: read_csv del
+    CSV, load_dataset (columnar a DataFrame) y load_arrays (memory-map recorriendo todas
+    las columnas). Requiere haber ejecutado `python -m src.utils convert`.
+    """
+    filas = []
+    for name in datasets:
+        for loader, code in _DATA_LOADERS.items():
+            resultado = _run_python(_DATA_LOADING_WORKER.format(load=code.format(name=name)))
+            filas.append({'dataset': name, 'loader': loader, **resultado})
+    return pd.DataFrame(filas)
+
+
+# --- Sobrecoste de la instrumentación por etapa ---
+def bench_telemetry_overhead(model, scaler, repeats=5000):
+    """
+    Latencia de transform + predict_proba de un paciente con los spans de src.telemetry
+    desactivados y activados, y coste de un span vacío en cada modo.
+    """
+    from src import telemetry
+
+    predictor = CompiledPredictor(model, scaler)
+    inputs = sample_inputs(predictor.feature_names)
+    estado = telemetry.METRICS.enabled
+    filas = {}
+    try:
+        for activado in (False, True):
+            telemetry.METRICS.enabled = activado
+            modo = 'activado' if activado else 'desactivado'
+
+            def span_vacio():
+                with telemetry.span("validacion"):
+                    pass
+
+            filas[f'span vacío ({modo})'] = measure_latency(span_vacio, repeats)
+            filas[f'un paciente ({modo})'] = measure_latency(lambda: predictor.predict_proba(predictor.transform(inputs)), repeats)
+    finally:
+        telemetry.METRICS.enabled = estado
+        telemetry.METRICS.reset()
+    return pd.DataFrame(filas).T
+
+
+# --- Validación de rangos clínicos ---
+def legacy_range_alerts(inputs):
+    """ Bucle original de display_prediccion sobre RANGOS_CLINICOS para un paciente. """
+    alertas = []
+    for key, (min_val, max_val) in RANGOS_CLINICOS.items():
+        if key in inputs and not (min_val <= inputs[key] <= max_val):
+            alertas.append(f"⚠️ **{key.upper()}** ({inputs[key]}) fuera del rango normal ({min_val} - {max_val}).")
+    return alertas
+
+
+def bench_validation(n_rows=100_000, repeats=10):
+    """
+    Validación de rangos de `n_rows` pacientes (el dataset de 20k replicado): bucle por
+    paciente frente al motor vectorizado de src.validation.
+    """
+    df = load_dataset("dataset_clinico_huancayo_20k_processed", columns=['edad', *RANGOS_CLINICOS])
+    df = pd.concat([df] * -(-n_rows // len(df)), ignore_index=True).iloc[:n_rows]
+    registros = df.to_dict('records')
+
+    inicio = time.perf_counter()
+    n_alertas = sum(len(legacy_range_alerts(r)) for r in registros)
+    bucle_ms = (time.perf_counter() - inicio) * 1e3
+    motor = measure_latency(lambda: validate(df), repeats, warmup=2)
+    return pd.DataFrame([
+        {'metodo': 'bucle por paciente', 'filas': n_rows, 'alertas': n_alertas, 'p50_ms': bucle_ms},
+        {'metodo': 'RangeValidator (vectorizado)', 'filas': n_rows, 'alertas': int(validate(df).n_alerts().sum()), 'p50_ms': motor['p50_ms']},
+    ])
+
+
+def bench_shap_engines(model, repeats=50, batch_repeats=3, interaction_rows=64):
+    """
+    Explicación de un paciente y de X_test completo (4000 filas) con shap.TreeExplainer y
+    con BoosterExplainer (pred_contribs), más las interacciones de `interaction_rows` filas.
+    """
+    from src.explanations import create_explainer
+
+    X = np.ascontiguousarray(load_dataset("X_test", columns=list(model.feature_names_in_)).to_numpy(), dtype=np.float32)
+    motores = {'TreeExplainer': create_explainer(model, "tree"), 'BoosterExplainer (pred_contribs)': create_explainer(model, "booster")}
+    filas = []
+    for nombre, explainer in motores.items():
+        for lote, n in ((X[:1], repeats), (X, batch_repeats)):
+            filas.append({'motor': nombre, 'filas': len(lote), **measure_latency(lambda: explainer.shap_values(lote), n, warmup=1)})
+    lote = X[:interaction_rows]
+    filas.append({'motor': 'TreeExplainer (interacciones)', 'filas': len(lote),
+                  **measure_latency(lambda: motores['TreeExplainer'].shap_interaction_values(lote), batch_repeats, warmup=1)})
+    filas.append({'motor': 'BoosterExplainer (interacciones)', 'filas': len(lote),
+                  **measure_latency(lambda: motores['BoosterExplainer (pred_contribs)'].shap_interaction_values(lote), batch_repeats, warmup=1)})
+    return pd.DataFrame(filas).set_index(['motor', 'filas'])
+
+
+# --- Suite de extremo a extremo con línea base ---
+BENCHMARKS_DIR = BASE_PATH / "reports" / "benchmarks"
+BASELINE_PATH = BENCHMARKS_DIR / "baseline.json"
+BATCH_SIZES = (1, 64, 1000, 4000)
+SHAP_BATCH_SIZES = (1, 64)
+REGRESSION_THRESHOLD = 0.25
+LIBRARIES = ["numpy", "pandas", "scikit-learn", "xgboost", "imbalanced-learn", "shap", "streamlit", "fpdf2"]
+
+_APP_COLD_START_WORKER = """
+import json, time, warnings
+warnings.filterwarnings("ignore")
+t = time.perf_counter()
+import streamlit.logger
+streamlit.logger.set_log_level("error")
+import app.streamlit_app as cdss_app
+importado = time.perf_counter() - t
+t = time.perf_counter()
+resources = cdss_app.load_resources()
+print(json.dumps({"import_app": importado, "load_resources": time.perf_counter() - t, "error": resources["error"]}))
+"""
+
+
+def import_app():
+    """
+    Importa app/streamlit_app.py sin servidor (modo bare de Streamlit) para medir sus
+    funciones puras; main() no se ejecuta porque solo corre como script.
+    """
+    import streamlit.logger
+    streamlit.logger.set_log_level("error")
+    import app.streamlit_app as cdss_app
+    return cdss_app
+
+
+def machine_info():
+    """ Entorno de la medición: sistema, CPU, memoria, versiones de librerías y commit. """
+    import os
+    import platform
+    from importlib import metadata
+
+    cpu = platform.processor()
+    memoria_gb = None
+    try:
+        with open("/proc/cpuinfo") as f:
+            cpu = next((linea.split(":", 1)[1].strip() for linea in f if linea.startswith("model name")), cpu)
+        with open("/proc/meminfo") as f:
+            memoria_gb = int(f.readline().split()[1]) / 2**20
+    except OSError:
+        pass
+    versiones = {}
+    for lib in LIBRARIES:
+        try:
+            versiones[lib] = metadata.version(lib)
+        except metadata.PackageNotFoundError:
+            versiones[lib] = None
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BASE_PATH,
+                                capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+        "cpu": cpu,
+        "cpu_count": os.cpu_count(),
+        "memory_gb": memoria_gb,
+        "libraries": versiones,
+        "git_commit": commit,
+    }
+
+
+def _fila(benchmark, case, n, latencia):
+    return {'benchmark': benchmark, 'case': case, 'n': n, **latencia}
+
+
+def run_suite(repeats=200, cold_runs=3, imports=True):
+    """
+    Suite de extremo a extremo sobre los artefactos servidos (registro o pickles) y X_test:
+    inferencia de un paciente (ruta de display_prediccion), predict_proba por lotes,
+    valores SHAP (TreeExplainer y pred_contribs), generate_medical_explanation, generate_pdf, arranque en frío
+    (import de la app + load_resources) e importación de módulos pesados.
+    Devuelve (filas, contexto) con una fila por medición y latencias en milisegundos.
+    """
+    from app.session import PredictionResult
+    from src.explanations import create_explainer, shap_values_by_class
+    from src.preprocessing import DIAGNOSTICO_MAP
+    from src.registry import load_serving_artifacts
+
+    model, scaler, manifest, origen = load_serving_artifacts()
+    cdss_app = import_app()
+    X_test = load_dataset("X_test", columns=list(model.feature_names_in_))
+    filas = []
+
+    print("· Inferencia de un paciente")
+    single = bench_single_patient(model, scaler, repeats * 5)
+    for case, latencia in single.iterrows():
+        filas.append(_fila('single_patient', case, 1, latencia.to_dict()))
+
+    print("· predict_proba por lotes")
+    predictor = CompiledPredictor(model, scaler)
+    X_np = np.ascontiguousarray(X_test.to_numpy(), dtype=np.float32)
+    for batch in BATCH_SIZES:
+        n = max(5, repeats * 64 // max(batch, 64))
+        lote_df, lote_np = X_test.iloc[:batch], X_np[:batch]
+        filas.append(_fila('batch_predict_proba', 'pipeline (DataFrame)', len(lote_df),
+                           measure_latency(lambda: model.predict_proba(lote_df), n, warmup=3)))
+        filas.append(_fila('batch_predict_proba', f'CompiledPredictor ({predictor.backend.name})', len(lote_np),
+                           measure_latency(lambda: predictor.predict_proba(lote_np), n, warmup=3)))
+
+    print("· Valores SHAP")
+    for engine, case in (("tree", 'TreeExplainer'), ("booster", 'BoosterExplainer (pred_contribs)')):
+        explainer = create_explainer(model, engine)
+        for batch in SHAP_BATCH_SIZES:
+            lote = X_np[:batch]
+            n = max(5, repeats // max(batch // 8, 1))
+            filas.append(_fila('shap_values', case, len(lote),
+                               measure_latency(lambda: shap_values_by_class(explainer, lote), n, warmup=3)))
+
+    print("· Explicación médica y reporte PDF")
+    # Caso con una alerta clínica para recorrer también esa sección del PDF
+    inputs = sample_inputs(model.feature_names_in_)
+    inputs['pas'] = 150
+    x_input = predictor.transform(inputs).copy()
+    proba = predictor.predict_proba(x_input)[0]
+    clase = int(np.argmax(proba))
+    shap_paciente = shap_values_by_class(explainer, x_input)[0, clase]
+    feature_names = list(model.feature_names_in_)
+    filas.append(_fila('medical_explanation', 'generate_medical_explanation', 1, measure_latency(
+        lambda: cdss_app.generate_medical_explanation(shap_paciente, feature_names, DIAGNOSTICO_MAP[clase], inputs), repeats)))
+
+    alertas = validate(inputs).messages(0, raw=inputs)
+    resultado = PredictionResult.create(stable_hash(inputs), manifest["model_version"], proba, x_input,
+                                        feature_names, alertas, inputs)
+    filas.append(_fila('pdf_report', 'generate_pdf', 1,
+                       measure_latency(lambda: cdss_app.generate_pdf(resultado), max(10, repeats // 4), warmup=2)))
+
+    print("· Arranque en frío de la app (proceso nuevo)")
+    arranques = [_run_python(_APP_COLD_START_WORKER) for _ in range(cold_runs)]
+    for paso in ('import_app', 'load_resources'):
+        tiempos = np.array([a[paso] for a in arranques]) * 1e3
+        filas.append(_fila('cold_start', paso, len(tiempos), {
+            'p50_ms': float(np.percentile(tiempos, 50)), 'p99_ms': float(np.percentile(tiempos, 99)),
+            'mean_ms': float(tiempos.mean())}))
+
+    if imports:
+        print("· Importación de módulos pesados (proceso nuevo)")
+        for _, fila in bench_imports().iterrows():
+            ms = fila['import_s'] * 1e3
+            filas.append(_fila('import', fila['module'], 1, {'p50_ms': ms, 'p99_ms': ms, 'mean_ms': ms}))
+
+    contexto = {"model_version": manifest["model_version"], "artifacts": origen, "n_test_rows": int(len(X_test))}
+    return filas, contexto
+
+
+def save_run(filas, contexto, out_dir=BENCHMARKS_DIR, baseline=False):
+    """
+    Guarda la ejecución como <timestamp>.json (máquina, contexto y resultados) y <timestamp>.csv.
+    Con baseline=True también la escribe como línea base (baseline.json). Devuelve el JSON escrito.
+    """
+    from datetime import datetime, timezone
+
+    out_dir.mkdir(parents=True, exist_ok=True)
+    ahora = datetime.now(timezone.utc)
+    run = {
+        "created_at": ahora.isoformat(timespec="seconds"),
+        "machine": machine_info(),
+        **contexto,
+        "results": filas,
+    }
+    path = out_dir / f"{ahora.strftime('%Y%m%dT%H%M%SZ')}.json"
+    texto = json.dumps(run, indent=2, ensure_ascii=False) + "\n"
+    path.write_text(texto, encoding="utf-8")
+    pd.DataFrame(filas).to_csv(path.with_suffix(".csv"), index=False)
+    if baseline:
+        (out_dir / BASELINE_PATH.name).write_text(texto, encoding="utf-8")
+    return path
+
+
+def compare_runs(actual, baseline, threshold=REGRESSION_THRESHOLD):
+    """
+    Compara la p50 de cada medición con la línea base. Es regresión si crece más de
+    `threshold` (fracción) y además supera la p99 de la línea base, para no marcar el
+    ruido de mediciones de milisegundos. Las mediciones nuevas o retiradas quedan con ratio NaN.
+    """
+    claves = ['benchmark', 'case', 'n']
+    actual_df = pd.DataFrame(actual["results"])[claves + ['p50_ms']]
+    base_df = pd.DataFrame(baseline["results"])[claves + ['p50_ms', 'p99_ms']]
+    comparacion = base_df.merge(actual_df, on=claves, how='outer', suffixes=('_baseline', '_actual'))
+    comparacion['ratio'] = comparacion['p50_ms_actual'] / comparacion['p50_ms_baseline']
+    comparacion['regression'] = (comparacion['ratio'] > 1 + threshold) & (comparacion['p50_ms_actual'] > comparacion['p99_ms'])
+    return comparacion.rename(columns={'p99_ms': 'p99_ms_baseline'})
+
+
+def _diferencias_de_entorno(actual, baseline):
+    """ Campos de máquina o modelo que difieren entre la ejecución y la línea base. """
+    diferencias = []
+    if actual.get('model_version') != baseline.get('model_version'):
+        diferencias.append(f"model_version: {baseline.get('model_version')} -> {actual.get('model_version')}")
+    for campo in ("cpu", "cpu_count", "python"):
+        antes, despues = baseline["machine"].get(campo), actual["machine"].get(campo)
+        if antes != despues:
+            diferencias.append(f"{campo}: {antes} -> {despues}")
+    for lib, version in actual["machine"]["libraries"].items():
+        if baseline["machine"]["libraries"].get(lib) != version:
+            diferencias.append(f"{lib}: {baseline['machine']['libraries'].get(lib)} -> {version}")
+    return diferencias
+
+
+def run_e2e(args):
+    filas, contexto = run_suite(repeats=max(args.repeats // 5, 20), imports=not args.no_imports)
+    path = save_run(filas, contexto, baseline=args.save_baseline)
+    print(pd.DataFrame(filas).to_string(index=False, float_format="{:.3f}".format))
+    print(f"Resultados guardados en {path} (y .csv)" + (f"; línea base: {BASELINE_PATH}" if args.save_baseline else ""))
+    if args.compare:
+        baseline = json.loads(open(args.compare, encoding="utf-8").read())
+        actual = json.loads(path.read_text(encoding="utf-8"))
+        for diferencia in _diferencias_de_entorno(actual, baseline):
+            print(f"⚠️ Entorno distinto a la línea base: {diferencia}")
+        comparacion = compare_runs(actual, baseline, args.threshold)
+        print(f"Comparación con {args.compare} (umbral +{args.threshold:.0%} en p50):")
+        print(comparacion.to_string(index=False, float_format="{:.3f}".format))
+        regresiones = comparacion[comparacion['regression']]
+        if len(regresiones):
+            print(f"❌ {len(regresiones)} regresiones: " + ", ".join(f"{b}/{c} (n={n})" for b, c, n in regresiones[['benchmark', 'case', 'n']].itertuples(index=False)))
+            sys.exit(1)
+        print("✅ Sin regresiones.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks de latencia del CDSS.")
+    parser.add_argument("--suite", nargs="+", choices=["single", "backends", "service", "startup", "soak", "data", "telemetry", "validation", "shap", "sessions", "e2e"], default=["single", "backends", "service", "startup"],
+                        help="Mediciones a ejecutar ('e2e' guarda los resultados en reports/benchmarks).")
+    parser.add_argument("--repeats", type=int, default=1000, help="Repeticiones por medición.")
+    parser.add_argument("--save-baseline", action="store_true", help="e2e: guarda la ejecución como línea base.")
+    parser.add_argument("--compare", nargs="?", const=str(BASELINE_PATH), default=None,
+                        help="e2e: compara con una línea base (por defecto reports/benchmarks/baseline.json) y sale con código 1 si hay regresiones.")
+    parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD, help="e2e: aumento relativo de la p50 considerado regresión.")
+    parser.add_argument("--no-imports", action="store_true", help="e2e: omite la importación de módulos en procesos nuevos.")
+    args = parser.parse_args()
+
+    if "e2e" in args.suite:
+        run_e2e(args)
+        return
+
+    model, scaler = load_artifacts()
+    if "single" in args.suite:
+        print(f"Inferencia de un paciente ({args.repeats} repeticiones):")
+        print(bench_single_patient(model, scaler, args.repeats).to_string(float_format="{:.3f}".format))
+    if "backends" in args.suite:
+        X_test = load_dataset("X_test")
+        print("Backends de inferencia sobre X_test:")
+        print(bench_backends(model, X_test).to_string(index=False, float_format="{:.3f}".format))
+    if "service" in args.suite:
+        print("Servicio HTTP /predict con clientes concurrentes:")
+        print(bench_service(model, scaler).to_string(index=False, float_format="{:.3f}".format))
+    if "startup" in args.suite:
+        print("Tiempo de importación por módulo (proceso nuevo):")
+        print(bench_imports().to_string(index=False, float_format="{:.3f}".format))
+        print("Arranque en frío de la app (time-to-first-render por página):")
+        print(bench_cold_start().to_string(index=False, float_format="{:.3f}".format))
+    if "soak" in args.suite:
+        print("Visitas repetidas a 'Análisis de Resultados' (RSS y figuras abiertas):")
+        print(bench_analysis_soak().to_string(index=False, float_format="{:.1f}".format))
+    if "sessions" in args.suite:
+        print("Estado de sesión con 200 sesiones concurrentes (formato anterior frente a app.session):")
+        print(bench_sessions().to_string(index=False, float_format="{:.2f}".format))
+    if "data" in args.suite:
+        print("Carga de datos procesados (CSV frente a formato columnar):")
+        print(bench_data_loading().to_string(index=False, float_format="{:.3f}".format))
+    if "validation" in args.suite:
+        print("Validación de rangos clínicos de 100k pacientes:")
+        print(bench_validation().to_string(index=False, float_format="{:.3f}".format))
+    if "shap" in args.suite:
+        print("Motores SHAP: un paciente y X_test completo (src.explanations):")
+        print(bench_shap_engines(model, args.repeats).to_string(float_format="{:.3f}".format))
+    if "telemetry" in args.suite:
+        print("Sobrecoste de los spans por etapa (src.telemetry):")
+        print(bench_telemetry_overhead(model, scaler, args.repeats).to_string(float_format="{:.4f}".format))
+
+
+if __name__ == "__main__":
+    main()
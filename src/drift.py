@@ -0,0 +1,347 @@
+# Monitor de deriva de las entradas frente a las estadísticas de entrenamiento
+"""
+Acumula, a medida que se predice, estadísticas por característica en memoria constante
+(media y varianza de Welford e histogramas de bins fijos) sobre la matriz que recibe el
+modelo, sin guardar filas de pacientes. Cada `check_every` predicciones las compara con
+la referencia de reports/metrics:
+    estadisticas_escalado_X_train.csv   media y desviación de las columnas escaladas
+    descriptive_stats.csv               cuartiles, mínimo, máximo y proporciones (binarias)
+con el PSI, una distancia tipo KS entre las distribuciones acumuladas por bin y la
+diferencia de medias estandarizada. Se alerta cuando una métrica cruza su umbral.
+Las ventanas son consecutivas (`window` predicciones) para detectar cambios por temporada.
+"""
+import argparse
+import threading
+import time
+from collections import deque
+
+import numpy as np
+import pandas as pd
+
+from src.preprocessing import NUMERICAL_COLS
+from src.utils import METRICS_DIR
+
+REFERENCIA_ESCALADO = METRICS_DIR / "estadisticas_escalado_X_train.csv"
+REFERENCIA_DESCRIPTIVA = METRICS_DIR / "descriptive_stats.csv"
+
+N_BINS = 6  # fuera de soporte (bajo), cuatro cuartiles, fuera de soporte (alto)
+PSI_EPS = 1e-4
+UMBRALES = {'psi': 0.25, 'ks': 0.15, 'smd': 0.5, 'var_ratio': 2.0}  # var_ratio: factor en cualquier sentido
+DEFAULT_WINDOW = 500
+DEFAULT_MIN_SAMPLES = 200
+KS_ALPHA_COEF = 1.63     # valor crítico de KS al 1 %: el umbral efectivo nunca baja de 1.63 / sqrt(n)
+MAX_VALORES_DISCRETOS = 15  # con tan pocos valores enteros los cuartiles empatan y el histograma no sirve
+DEFAULT_CHECK_EVERY = 50
+MAX_ALERTAS = 200
+
+
+class DriftReference:
+    """
+    Referencia por característica en el espacio de entrada del modelo: media y desviación,
+    límites de los bins y proporción esperada en cada uno. Las características discretas
+    (spo2, distrito, ocupación) solo se comparan por sus momentos (`histogram` False) y las
+    que no tienen referencia (por ejemplo, imc_categoria) no se vigilan.
+    """
+
+    def __init__(self, features, mean, std, edges, expected, histogram):
+        self.features = [str(f) for f in features]
+        self.mean = np.asarray(mean, dtype=np.float64)
+        self.std = np.asarray(std, dtype=np.float64)
+        self.edges = np.asarray(edges, dtype=np.float64)        # (f, N_BINS - 1)
+        self.expected = np.asarray(expected, dtype=np.float64)  # (f, N_BINS)
+        self.histogram = np.asarray(histogram, dtype=bool)
+        # En las binarias la varianza queda fijada por la proporción: no se compara aparte
+        self.binary = self.histogram & np.isinf(self.edges[:, 1])
+
+    @classmethod
+    def from_reports(cls, feature_names, scaler_mean, scaler_scale,
+                     escalado_path=REFERENCIA_ESCALADO, descriptiva_path=REFERENCIA_DESCRIPTIVA):
+        """
+        Construye la referencia para `feature_names` (orden del modelo). Los cuartiles de
+        descriptive_stats.csv se llevan al espacio escalado con los parámetros del scaler
+        (`scaler_mean` y `scaler_scale` en el orden de NUMERICAL_COLS); si una columna
+        escalada no tiene cuartiles se usan los de una normal con su media y desviación.
+        """
+        escalado = pd.read_csv(escalado_path, index_col=0)
+        descriptiva = pd.read_csv(descriptiva_path, index_col=0)
+        centro = dict(zip(NUMERICAL_COLS, scaler_mean))
+        escala = dict(zip(NUMERICAL_COLS, scaler_scale))
+        cuartiles_normales = np.array([-0.6745, 0.0, 0.6745])
+
+        sin_bins = (np.full(N_BINS - 1, np.inf), [1.0] + [0.0] * (N_BINS - 1))
+        features, mean, std, edges, expected, histogram = [], [], [], [], [], []
+        for f in feature_names:
+            con_bins = True
+            if f in NUMERICAL_COLS and f in escalado.index:
+                m, s = escalado.loc[f, 'mean'], escalado.loc[f, 'std']
+                if f in descriptiva.columns and _es_discreta(descriptiva[f]):
+                    con_bins = False
+                    bordes, esperado = sin_bins
+                elif f in descriptiva.columns:
+                    q = (descriptiva.loc[['min', '25%', '50%', '75%', 'max'], f].to_numpy() - centro[f]) / escala[f]
+                else:
+                    q = np.concatenate([[-np.inf], m + s * cuartiles_normales, [np.inf]])
+                if con_bins:
+                    # El máximo entra en el último cuartil: solo lo que lo supera queda fuera de soporte
+                    bordes = np.array([q[0], q[1], q[2], q[3], np.nextafter(q[4], np.inf)])
+                    esperado = [0.0, 0.25, 0.25, 0.25, 0.25, 0.0]
+            elif f in descriptiva.columns and descriptiva.loc['min', f] == 0 and descriptiva.loc['max', f] == 1:
+                # Binarias (sexo, área, antecedentes, síntomas): proporción de unos
+                p = descriptiva.loc['mean', f]
+                m, s = p, np.sqrt(p * (1 - p))
+                bordes = np.array([0.5, np.inf, np.inf, np.inf, np.inf])
+                esperado = [1 - p, p, 0.0, 0.0, 0.0, 0.0]
+            elif f in descriptiva.columns:
+                # Códigos sin escalar (distrito, ocupación): solo momentos
+                m, s = descriptiva.loc['mean', f], descriptiva.loc['std', f]
+                bordes, esperado = sin_bins
+                con_bins = False
+            else:
+                continue
+            features.append(f)
+            mean.append(m)
+            std.append(s)
+            edges.append(bordes)
+            expected.append(esperado)
+            histogram.append(con_bins)
+        return cls(features, mean, std, edges, expected, histogram)
+
+
+def _es_discreta(stats):
+    """ Variable entera con pocos valores posibles según describe() (p. ej. spo2 de 88 a 99). """
+    q = stats[['min', '25%', '50%', '75%', 'max']].to_numpy()
+    return bool(np.all(q == np.round(q)) and q[-1] - q[0] <= MAX_VALORES_DISCRETOS)
+
+
+class _Accumulator:
+    """
+    Filas vistas y, por característica, conteo de valores finitos, media y M2 de Welford,
+    histograma y valores no finitos (NaN/inf), que no entran en los momentos (memoria constante).
+    """
+
+    def __init__(self, n_features):
+        self.rows = 0
+        self.n = np.zeros(n_features, dtype=np.int64)
+        self.mean = np.zeros(n_features)
+        self.m2 = np.zeros(n_features)
+        self.counts = np.zeros((n_features, N_BINS), dtype=np.int64)
+        self.missing = np.zeros(n_features, dtype=np.int64)
+
+    def merge(self, rows_b, n_b, mean_b, m2_b, counts_b, missing_b):
+        """ Combinación de Chan et al. de los momentos de un bloque con los acumulados, por característica. """
+        total = self.n + n_b
+        peso = np.divide(n_b, total, out=np.zeros(len(total)), where=total > 0)
+        delta = mean_b - self.mean
+        self.mean += delta * peso
+        self.m2 += m2_b + delta * delta * self.n * peso
+        self.n = total
+        self.rows += rows_b
+        self.counts += counts_b
+        self.missing += missing_b
+
+    @property
+    def var(self):
+        return self.m2 / np.maximum(self.n - 1, 1)
+
+
+def _block_stats(X, edges, offsets):
+    """
+    Filas, valores finitos, media, M2, histograma (f, N_BINS) y no finitos por característica
+    de un bloque; los NaN/inf se cuentan aparte y no alteran momentos ni histograma.
+    """
+    finitos = np.isfinite(X)
+    if not finitos.all():
+        n_b = finitos.sum(axis=0)
+        Xf = np.where(finitos, X, 0.0)
+        mean_b = Xf.sum(axis=0) / np.maximum(n_b, 1)
+        m2_b = (np.where(finitos, X - mean_b, 0.0) ** 2).sum(axis=0)
+        celdas = ((Xf[:, :, None] >= edges).sum(axis=2) + offsets)[finitos]
+    elif len(X) == 1:
+        fila = X[0]
+        n_b = np.ones(len(fila), dtype=np.int64)
+        mean_b, m2_b = fila.copy(), np.zeros_like(fila)
+        celdas = offsets + (fila[:, None] >= edges).sum(axis=1)
+    else:
+        n_b = np.full(X.shape[1], len(X), dtype=np.int64)
+        mean_b = X.mean(axis=0)
+        m2_b = ((X - mean_b) ** 2).sum(axis=0)
+        celdas = ((X[:, :, None] >= edges).sum(axis=2) + offsets).ravel()
+    counts = np.bincount(celdas, minlength=len(offsets) * N_BINS).reshape(len(offsets), N_BINS)
+    return len(X), n_b, mean_b, m2_b, counts, len(X) - n_b
+
+
+def drift_scores(acumulado, referencia):
+    """
+    PSI, distancia tipo KS, diferencia de medias estandarizada y cociente de varianzas por
+    característica, sobre sus valores finitos; PSI y KS son NaN en las que solo se comparan
+    por momentos y `faltantes` cuenta los valores NaN/inf recibidos.
+    """
+    observado = acumulado.counts / np.maximum(acumulado.n, 1)[:, None]
+    esperado = referencia.expected
+    o, e = np.maximum(observado, PSI_EPS), np.maximum(esperado, PSI_EPS)
+    sin_bins = ~referencia.histogram
+    std_ref = np.where(referencia.std > 0, referencia.std, 1.0)
+    psi = ((o - e) * np.log(o / e)).sum(axis=1)
+    ks = np.abs(np.cumsum(observado, axis=1) - np.cumsum(esperado, axis=1)).max(axis=1)
+    fuera = (observado * (esperado == 0)).sum(axis=1)
+    var_ratio = acumulado.var / std_ref ** 2
+    psi[sin_bins] = ks[sin_bins] = fuera[sin_bins] = np.nan
+    var_ratio[referencia.binary] = np.nan
+    return pd.DataFrame({
+        'n': acumulado.n,
+        'mean': acumulado.mean,
+        'std': np.sqrt(acumulado.var),
+        'psi': psi,
+        'ks': ks,
+        'smd': (acumulado.mean - referencia.mean) / std_ref,
+        'var_ratio': var_ratio,
+        'fuera_soporte': fuera,
+        'faltantes': acumulado.missing,
+    }, index=pd.Index(referencia.features, name='feature'))
+
+
+class DriftMonitor:
+    """
+    Monitor compartido (entre sesiones o peticiones) de la deriva de las entradas. `update`
+    recibe filas ya procesadas en el orden del modelo (la salida de CompiledPredictor.transform
+    o ChunkedPreprocessor.transform) y devuelve las alertas nuevas; `on_alert` se llama con
+    cada una (por defecto se imprime).
+    """
+
+    def __init__(self, reference, feature_names, window=DEFAULT_WINDOW, min_samples=DEFAULT_MIN_SAMPLES,
+                 check_every=DEFAULT_CHECK_EVERY, thresholds=None, model_version=None, on_alert=None):
+        self.reference = reference
+        self.columns = np.array([list(feature_names).index(f) for f in reference.features], dtype=np.intp)
+        self.window = window
+        self.min_samples = min_samples
+        self.check_every = check_every
+        self.thresholds = {**UMBRALES, **(thresholds or {})}
+        self.model_version = model_version
+        self.on_alert = on_alert or _print_alert
+        self.total = _Accumulator(len(self.columns))
+        self.current = _Accumulator(len(self.columns))
+        self.last_window = None
+        self.windows_completed = 0
+        self.alerts = deque(maxlen=MAX_ALERTAS)
+        self._activas = set()
+        self._ultimo_chequeo = 0
+        self._offsets = np.arange(len(self.columns)) * N_BINS
+        self._lock = threading.RLock()
+
+    @classmethod
+    def from_artifacts(cls, model, scaler, **kwargs):
+        """ Monitor con la referencia de reports/metrics para el pipeline y scaler servidos. """
+        from src.preprocessing import ChunkedPreprocessor
+
+        mean, scale = ChunkedPreprocessor.from_artifacts(model, scaler).scaler_params()
+        feature_names = list(model.feature_names_in_)
+        return cls(DriftReference.from_reports(feature_names, mean, scale), feature_names, **kwargs)
+
+    def update(self, X):
+        """ Añade filas procesadas (n, n_features) y devuelve la lista de alertas nuevas. """
+        X = np.atleast_2d(np.asarray(X, dtype=np.float64))[:, self.columns]
+        nuevas = []
+        with self._lock:
+            inicio = 0
+            while inicio < len(X):
+                cabe = self.window - self.current.rows if self.window else len(X)
+                bloque = X[inicio:inicio + cabe]
+                inicio += len(bloque)
+                stats = _block_stats(bloque, self.reference.edges, self._offsets)
+                self.current.merge(*stats)
+                self.total.merge(*stats)
+                if self.window and self.current.rows >= self.window:
+                    nuevas += self._check()
+                    self.last_window = drift_scores(self.current, self.reference)
+                    self.windows_completed += 1
+                    self.current = _Accumulator(len(self.columns))
+                    self._ultimo_chequeo = 0
+                elif self.current.rows >= self.min_samples and self.current.rows - self._ultimo_chequeo >= self.check_every:
+                    nuevas += self._check()
+        for alerta in nuevas:
+            self.on_alert(alerta)
+        return nuevas
+
+    def _check(self):
+        """ Compara la ventana actual con los umbrales; solo alerta de los cruces nuevos. """
+        self._ultimo_chequeo = self.current.rows
+        scores = drift_scores(self.current, self.reference)
+        # Características con menos de min_samples valores finitos en la ventana: no se evalúan
+        pocos = scores['n'] < self.min_samples
+        superadas = {}
+        for metrica, umbral in self.thresholds.items():
+            valores, limite = scores[metrica].abs().mask(pocos), umbral
+            if metrica == 'ks':
+                limite = np.maximum(umbral, KS_ALPHA_COEF / np.sqrt(np.maximum(scores['n'], 1)))
+            elif metrica == 'var_ratio':
+                valores, limite = np.abs(np.log(np.maximum(valores, 1e-12))), np.log(umbral)
+            for feature in valores.index[valores > limite]:
+                superadas[(feature, metrica)] = (float(scores.at[feature, metrica]), umbral)
+        nuevas = [{
+            'ts': time.time(), 'feature': feature, 'metric': metrica, 'value': valor, 'threshold': umbral,
+            'n': int(self.current.rows), 'window': self.windows_completed, 'model_version': self.model_version,
+        } for (feature, metrica), (valor, umbral) in superadas.items() if (feature, metrica) not in self._activas]
+        self._activas = set(superadas)
+        self.alerts.extend(nuevas)
+        return nuevas
+
+    def report(self, scope='window'):
+        """ Métricas por característica de la ventana en curso ('window'), la última completa ('last') o el total. """
+        with self._lock:
+            if scope == 'last':
+                return self.last_window
+            return drift_scores(self.total if scope == 'total' else self.current, self.reference)
+
+    def status(self):
+        """ Resumen serializable para /drift: tamaños, métricas de la ventana, alertas activas y recientes. """
+        with self._lock:
+            # Con menos de min_samples pacientes las métricas son ruido: no se publican
+            scores = drift_scores(self.current, self.reference)
+            if self.current.rows < self.min_samples:
+                scores = scores.iloc[:0]
+            return {
+                'model_version': self.model_version,
+                'n_total': int(self.total.rows),
+                'n_window': int(self.current.rows),
+                'window': self.window,
+                'min_samples': self.min_samples,
+                'windows_completed': self.windows_completed,
+                'active': sorted(f"{feature}:{metrica}" for feature, metrica in self._activas),
+                'recent_alerts': list(self.alerts)[-20:],
+                'scores': {feature: {metrica: (None if np.isnan(valor) else round(float(valor), 6)) for metrica, valor in fila.items()}
+                           for feature, fila in scores.iterrows()},
+            }
+
+
+def _print_alert(alerta):
+    print(f"⚠️ Deriva en '{alerta['feature']}': {alerta['metric']}={alerta['value']:.3f} "
+          f"(umbral {alerta['threshold']}, {alerta['n']} pacientes en la ventana {alerta['window']})")
+
+
+def main():
+    from src.utils import load_artifacts, load_dataset
+
+    parser = argparse.ArgumentParser(description="Deriva de un dataset procesado frente a las estadísticas de entrenamiento.")
+    parser.add_argument("--input", default="X_test", help="Dataset de data/processed o CSV ya procesado (escalado).")
+    parser.add_argument("--query", default=None, help="Filtro de pandas para simular una subpoblación, p. ej. 'distrito == 3'.")
+    parser.add_argument("--window", type=int, default=DEFAULT_WINDOW, help="Pacientes por ventana.")
+    parser.add_argument("--batch-size", type=int, default=1, help="Filas por actualización (1 = paciente a paciente).")
+    args = parser.parse_args()
+
+    model, scaler = load_artifacts()
+    columnas = list(model.feature_names_in_)
+    X = pd.read_csv(args.input, usecols=columnas)[columnas] if args.input.endswith(".csv") else load_dataset(args.input, columns=columnas)
+    if args.query:
+        X = X.query(args.query)
+    monitor = DriftMonitor.from_artifacts(model, scaler, window=args.window)
+    filas = X.to_numpy(dtype=np.float64)
+    inicio = time.perf_counter()
+    for i in range(0, len(filas), args.batch_size):
+        monitor.update(filas[i:i + args.batch_size])
+    duracion = time.perf_counter() - inicio
+    print(f"{len(X)} pacientes en {duracion * 1000:.1f} ms ({duracion / max(len(X), 1) * 1e6:.1f} µs por actualización de {args.batch_size})")
+    print(monitor.report('total').sort_values('psi', ascending=False).head(15).to_string(float_format="{:.3f}".format))
+
+
+if __name__ == "__main__":
+    main()
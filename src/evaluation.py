@@ -1 +1,611 @@
-# Métricas y visualizaciones de evaluación
\ No newline at end of file
+# Métricas y visualizaciones de evaluación
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from src.backends import BACKENDS, load_backend
+from src.utils import METRICS_DIR, REPORTS_DIR, dataset_hash, load_artifacts, load_dataset, stable_hash
+
+# Tolerancia máxima en probabilidad frente al pickle de referencia
+PARITY_ATOL = 1e-5
+
+
+def check_backend_parity(model, X, backends=None, atol=PARITY_ATOL):
+    """
+    Compara las probabilidades de cada backend con model.predict_proba sobre X.
+    Devuelve un DataFrame con la diferencia máxima, la concordancia del diagnóstico
+    (argmax) y si el backend pasa la verificación. Los backends cuyas dependencias
+    opcionales no están instaladas se marcan como omitidos.
+    """
+    referencia = model.predict_proba(X)
+    filas = []
+    for name in backends or BACKENDS:
+        try:
+            backend = load_backend(name, model)
+        except ImportError as e:
+            filas.append({'backend': name, 'max_abs_diff': np.nan, 'argmax_agreement': np.nan, 'status': f'omitido: {e}'})
+            continue
+        proba = backend.predict_proba(X)
+        max_diff = float(np.abs(proba - referencia).max())
+        concordancia = float((proba.argmax(axis=1) == referencia.argmax(axis=1)).mean())
+        ok = max_diff <= atol and concordancia == 1.0
+        filas.append({'backend': name, 'max_abs_diff': max_diff, 'argmax_agreement': concordancia,
+                      'status': 'ok' if ok else 'fallo'})
+    return pd.DataFrame(filas)
+
+
+def run_parity(args):
+    model, _ = load_artifacts()
+    X_test = load_dataset("X_test")
+    resultados = check_backend_parity(model, X_test, args.backends, args.atol)
+    print(resultados.to_string(index=False))
+
+    METRICS_DIR.mkdir(parents=True, exist_ok=True)
+    resultados.to_csv(METRICS_DIR / "backend_parity.csv", index=False)
+    if (resultados['status'] == 'fallo').any():
+        sys.exit(1)
+
+
+# --- Validación cruzada con folds en caché ---
+# Misma configuración que 03_Modeling.ipynb: StratifiedKFold(10, shuffle=True, random_state=42)
+# y SMOTE(random_state=42) dentro de cada fold.
+CV_CACHE_DIR = REPORTS_DIR / "cv_cache"
+CV_N_SPLITS = 10
+CV_SEED = 42
+CV_SCORING = ['accuracy', 'balanced_accuracy', 'f1_weighted', 'precision_weighted', 'recall_weighted', 'roc_auc_ovr']
+
+ENSEMBLE = 'Ensemble (Voting)'
+ENSEMBLE_MEMBERS = ['Logistic Regression', 'Random Forest', 'XGBoost']
+
+
+def _cv_classifier(name):
+    """ Clasificador de cada pipeline del notebook (sin SMOTE: los folds ya vienen remuestreados). """
+    if name == 'Logistic Regression':
+        from sklearn.linear_model import LogisticRegression
+        # Con lbfgs la regresión ya es multinomial
+        return LogisticRegression(solver='lbfgs', max_iter=1000, random_state=42)
+    if name == 'Random Forest':
+        from sklearn.ensemble import RandomForestClassifier
+        return RandomForestClassifier(random_state=42)
+    if name == 'XGBoost':
+        import xgboost as xgb
+        # Un hilo por trabajo: el paralelismo lo da el pool de procesos
+        return xgb.XGBClassifier(eval_metric='mlogloss', random_state=42, n_jobs=1)
+    if name == 'SVM':
+        from sklearn.svm import SVC
+        return SVC(probability=True, random_state=42)
+    raise ValueError(f"Modelo desconocido: '{name}'")
+
+
+CV_MODELS = ['Logistic Regression', 'Random Forest', 'XGBoost', 'SVM', ENSEMBLE]
+
+
+def _slug(name):
+    """ Nombre de archivo usado por el notebook: 'Ensemble (Voting)' -> 'ensemble_(voting)'. """
+    return name.lower().replace(' ', '_')
+
+
+def _save_atomic(path, save):
+    """ Escribe en un temporal y renombra, para que una ejecución interrumpida no deje archivos a medias. """
+    tmp = path.with_name(".tmp_" + path.name)
+    save(tmp)
+    os.replace(tmp, path)
+
+
+def fold_metrics(y_true, y_pred, proba):
+    """ Métricas de CV_SCORING calculadas como los scorers de cross_validate. """
+    from sklearn.metrics import (accuracy_score, balanced_accuracy_score, f1_score, precision_score, recall_score,
+                                 roc_auc_score)
+    return {
+        'accuracy': accuracy_score(y_true, y_pred),
+        'balanced_accuracy': balanced_accuracy_score(y_true, y_pred),
+        'f1_weighted': f1_score(y_true, y_pred, average='weighted'),
+        'precision_weighted': precision_score(y_true, y_pred, average='weighted', zero_division=0),
+        'recall_weighted': recall_score(y_true, y_pred, average='weighted'),
+        'roc_auc_ovr': roc_auc_score(y_true, proba, multi_class='ovr'),
+    }
+
+
+class FoldCache:
+    """
+    Folds de validación cruzada remuestreados con SMOTE, calculados una sola vez y
+    guardados en reports/cv_cache/<clave>/ como .npy (se abren con memory-map en los
+    procesos del pool). La clave combina el hash de X e y, el número de folds y las
+    semillas, así que cambiar los datos o la semilla crea una caché nueva. También guarda
+    las predicciones de cada modelo × fold para reanudar una ejecución interrumpida.
+    """
+
+    def __init__(self, X, y, data_version, n_splits=CV_N_SPLITS, seed=CV_SEED, cache_dir=CV_CACHE_DIR):
+        from sklearn.model_selection import StratifiedKFold
+
+        self.n_splits = n_splits
+        self.seed = seed
+        self.key = stable_hash({'data': data_version, 'n_splits': n_splits, 'seed': seed})[:16]
+        self.dir = cache_dir / self.key
+        (self.dir / "results").mkdir(parents=True, exist_ok=True)
+
+        if not (self.dir / "X.npy").exists():
+            _save_atomic(self.dir / "X.npy", lambda p: np.save(p, np.asarray(X, dtype=np.float64)))
+            _save_atomic(self.dir / "y.npy", lambda p: np.save(p, np.asarray(y, dtype=np.int64)))
+            _save_atomic(self.dir / "columns.json", lambda p: p.write_text(json.dumps(list(X.columns))))
+        kfold = StratifiedKFold(n_splits=n_splits, shuffle=True, random_state=seed)
+        self.splits = list(kfold.split(np.zeros(len(y)), y))
+
+    def fold_path(self, k):
+        return self.dir / f"fold_{k}_X.npy"
+
+    def has_fold(self, k):
+        return self.fold_path(k).exists() and (self.dir / f"fold_{k}_y.npy").exists()
+
+    def result_path(self, name, k):
+        return self.dir / "results" / f"{_slug(name)}_fold{k}.npz"
+
+    def has_result(self, name, k):
+        return self.result_path(name, k).exists()
+
+    def load_result(self, name, k):
+        with np.load(self.result_path(name, k)) as datos:
+            return {key: datos[key] for key in datos.files}
+
+
+def _data_version(X, y):
+    """ Hash del contenido de X e y, para cuando no se conoce el de los archivos de origen. """
+    digest = hashlib.sha256(np.ascontiguousarray(X, dtype=np.float64).tobytes())
+    digest.update(np.ascontiguousarray(y, dtype=np.int64).tobytes())
+    return [digest.hexdigest(), list(X.columns)]
+
+
+def _resample_fold(cache_dir, k, train_idx, seed):
+    """ Trabajo del pool: SMOTE sobre el entrenamiento del fold k, guardado en la caché. """
+    from imblearn.over_sampling import SMOTE
+
+    X = np.load(cache_dir / "X.npy", mmap_mode="r")
+    y = np.load(cache_dir / "y.npy", mmap_mode="r")
+    inicio = time.perf_counter()
+    X_res, y_res = SMOTE(random_state=seed).fit_resample(X[train_idx], y[train_idx])
+    _save_atomic(cache_dir / f"fold_{k}_X.npy", lambda p: np.save(p, X_res))
+    _save_atomic(cache_dir / f"fold_{k}_y.npy", lambda p: np.save(p, y_res))
+    return time.perf_counter() - inicio
+
+
+def _fit_fold(cache_dir, name, k, val_idx):
+    """ Trabajo del pool: entrena `name` con el fold k en caché y guarda predicciones y tiempos. """
+    import pandas as pd
+
+    columnas = json.loads((cache_dir / "columns.json").read_text())
+    X = np.load(cache_dir / "X.npy", mmap_mode="r")
+    X_res = pd.DataFrame(np.load(cache_dir / f"fold_{k}_X.npy", mmap_mode="r"), columns=columnas)
+    y_res = np.load(cache_dir / f"fold_{k}_y.npy", mmap_mode="r")
+    X_val = pd.DataFrame(X[val_idx], columns=columnas)
+
+    clf = _cv_classifier(name)
+    inicio = time.perf_counter()
+    clf.fit(X_res, y_res)
+    fit_time = time.perf_counter() - inicio
+    inicio = time.perf_counter()
+    y_pred = clf.predict(X_val)
+    proba = clf.predict_proba(X_val)
+    score_time = time.perf_counter() - inicio
+
+    path = cache_dir / "results" / f"{_slug(name)}_fold{k}.npz"
+    _save_atomic(path, lambda p: np.savez(p, y_pred=y_pred, proba=proba,
+                                          fit_time=fit_time, score_time=score_time))
+    return fit_time + score_time
+
+
+def _ensemble_fold(cache, k):
+    """
+    Votación suave del ensamble a partir de las probabilidades ya guardadas de sus miembros:
+    VotingClassifier(voting='soft') entrena los mismos clasificadores sobre el mismo fold y
+    promedia sus predict_proba, así que no hace falta volver a entrenarlos.
+    """
+    inicio = time.perf_counter()
+    miembros = [cache.load_result(name, k) for name in ENSEMBLE_MEMBERS]
+    proba = np.mean([m['proba'] for m in miembros], axis=0)
+    score_time = time.perf_counter() - inicio
+    _save_atomic(cache.result_path(ENSEMBLE, k), lambda p: np.savez(
+        p, y_pred=proba.argmax(axis=1), proba=proba,
+        fit_time=sum(float(m['fit_time']) for m in miembros),
+        score_time=score_time + sum(float(m['score_time']) for m in miembros)))
+
+
+def run_cached_cv(X, y, models=CV_MODELS, data_version=None, n_splits=CV_N_SPLITS, seed=CV_SEED,
+                  n_workers=None, cache_dir=CV_CACHE_DIR):
+    """
+    Validación cruzada de `models` con folds SMOTE calculados una vez y compartidos por
+    todos los modelos. Los trabajos (fold y modelo × fold) se reparten en un pool de
+    procesos del tamaño de la CPU; los que ya están en la caché se omiten, de modo que
+    una ejecución interrumpida continúa donde quedó.
+    Devuelve {modelo: DataFrame por fold con métricas y tiempos de entrenamiento y predicción}.
+    """
+    cache = FoldCache(X, y, data_version or _data_version(X, y), n_splits, seed, cache_dir)
+    entrenables = [m for m in dict.fromkeys(
+        [m for name in models for m in (ENSEMBLE_MEMBERS if name == ENSEMBLE else [])] + list(models)) if m != ENSEMBLE]
+    n_workers = n_workers or os.cpu_count() or 1
+    print(f"Caché de folds: {cache.dir} ({n_workers} procesos)")
+
+    with ProcessPoolExecutor(max_workers=n_workers) as pool:
+        pendientes = {}
+        for k, (train_idx, _) in enumerate(cache.splits):
+            if not cache.has_fold(k):
+                pendientes[pool.submit(_resample_fold, cache.dir, k, train_idx, seed)] = ('fold', None, k)
+
+        def submit_models(k):
+            for name in entrenables:
+                if not cache.has_result(name, k):
+                    pendientes[pool.submit(_fit_fold, cache.dir, name, k, cache.splits[k][1])] = ('model', name, k)
+
+        for k in range(n_splits):
+            if cache.has_fold(k):
+                submit_models(k)
+        while pendientes:
+            hechos, _ = wait(pendientes, return_when=FIRST_COMPLETED)
+            for futuro in hechos:
+                tipo, _, k = pendientes.pop(futuro)
+                futuro.result()
+                if tipo == 'fold':
+                    submit_models(k)
+
+    if ENSEMBLE in models:
+        for k in range(n_splits):
+            if not cache.has_result(ENSEMBLE, k):
+                _ensemble_fold(cache, k)
+
+    y = np.asarray(y)
+    resultados = {}
+    for name in models:
+        filas = []
+        for k, (_, val_idx) in enumerate(cache.splits):
+            r = cache.load_result(name, k)
+            filas.append({**fold_metrics(y[val_idx], r['y_pred'], r['proba']),
+                          'fit_time_s': float(r['fit_time']), 'score_time_s': float(r['score_time'])})
+        resultados[name] = pd.DataFrame(filas)
+    return resultados
+
+
+def cv_summary(resultados):
+    """
+    Tabla resumen como cv_results_summary.csv, con el tiempo de cada modelo junto a sus
+    métricas. Los tiempos se guardan en la caché, así que no dependen de reanudaciones;
+    el del ensamble es el de entrenar sus miembros.
+    """
+    filas = {}
+    for name, df in resultados.items():
+        filas[name] = {f'mean_{m}': df[m].mean() for m in CV_SCORING}
+        filas[name]['std_balanced_accuracy'] = df['balanced_accuracy'].std(ddof=0)
+        filas[name]['fit_time_s'] = df['fit_time_s'].sum()
+        filas[name]['score_time_s'] = df['score_time_s'].sum()
+        filas[name]['total_time_s'] = filas[name]['fit_time_s'] + filas[name]['score_time_s']
+    return pd.DataFrame(filas).T.sort_values('mean_balanced_accuracy', ascending=False)
+
+
+def run_cv(args):
+    X = load_dataset(args.x)
+    y = load_dataset(args.y)['diagnostico'].to_numpy()
+    inicio = time.perf_counter()
+    resultados = run_cached_cv(X, y, args.models, data_version=[dataset_hash(args.x), dataset_hash(args.y)],
+                                      n_splits=args.n_splits, seed=args.seed, n_workers=args.workers)
+    out_dir = args.out_dir
+    out_dir.mkdir(parents=True, exist_ok=True)
+    for name, df in resultados.items():
+        df.to_csv(out_dir / f"cv_results_{_slug(name)}.csv", index=False)
+    resumen = cv_summary(resultados)
+    resumen.to_csv(out_dir / "cv_results_summary.csv")
+    print(resumen[['mean_balanced_accuracy', 'std_balanced_accuracy', 'total_time_s']]
+          .to_string(float_format="{:.4f}".format))
+    print(f"Validación cruzada completada en {time.perf_counter() - inicio:.1f} s -> {out_dir}")
+
+
+# --- Búsqueda de hiperparámetros de XGBoost (successive halving) ---
+# Cada candidato empieza con pocos folds y pocos árboles; solo el mejor 1/eta de cada
+# ronda pasa a la siguiente con más folds y más árboles. Todas las rondas reutilizan los
+# folds SMOTE de FoldCache.
+SEARCH_SPACE = {
+    'max_depth': [2, 3, 4, 5, 6, 8],
+    'eta': [0.05, 0.1, 0.2, 0.3],
+    'min_child_weight': [1, 3, 5],
+    'subsample': [0.7, 0.85, 1.0],
+    'colsample_bytree': [0.5, 0.75, 1.0],
+    'max_bin': [64, 128, 256],
+}
+SEARCH_CANDIDATES = 27
+SEARCH_ETA = 3
+SEARCH_FOLDS = [2, 5, 10]
+SEARCH_ROUNDS = [100, 300, 1000]
+SEARCH_EARLY_STOPPING = 20
+# Fracción del fold de entrenamiento (ya con SMOTE) reservada para la parada temprana: el
+# fold de validación solo se usa para puntuar
+SEARCH_EARLY_STOPPING_FRACTION = 0.1
+SEARCH_BUDGET_S = 600
+# Candidatos con balanced accuracy a menos de esta distancia del mejor se consideran empatados
+# y se ordenan por latencia y tamaño
+SEARCH_TOLERANCE = 0.001
+
+
+def sample_configs(n, seed=CV_SEED, space=SEARCH_SPACE):
+    """ `n` configuraciones distintas muestreadas al azar de `space` (incluye los valores por defecto de XGBoost). """
+    rng = np.random.default_rng(seed)
+    configs = [{'max_depth': 6, 'eta': 0.3, 'min_child_weight': 1, 'subsample': 1.0, 'colsample_bytree': 1.0, 'max_bin': 256}]
+    vistos = {stable_hash(configs[0])}
+    total = int(np.prod([len(v) for v in space.values()]))
+    while len(configs) < min(n, total):
+        config = {name: valores[rng.integers(len(valores))] for name, valores in space.items()}
+        config = {k: v.item() if hasattr(v, 'item') else v for k, v in config.items()}
+        if stable_hash(config) not in vistos:
+            vistos.add(stable_hash(config))
+            configs.append(config)
+    return configs
+
+
+def booster_latency_ms(booster, x_row, repeats=200):
+    """ Mediana de inplace_predict para un paciente, como en la app. """
+    x_row = np.ascontiguousarray(x_row, dtype=np.float32).reshape(1, -1)
+    tiempos = []
+    for _ in range(repeats):
+        inicio = time.perf_counter()
+        booster.inplace_predict(x_row, validate_features=False)
+        tiempos.append(time.perf_counter() - inicio)
+    return float(np.median(tiempos) * 1000)
+
+
+def _fit_search_fold(cache, k, config, max_rounds, early_stopping_rounds, n_classes):
+    """
+    Entrena un candidato en el fold k (hist + parada temprana sobre una parte reservada del
+    entrenamiento) y mide calidad en el fold de validación, tamaño y latencia.
+    """
+    import xgboost as xgb
+    from sklearn.metrics import balanced_accuracy_score, log_loss
+    from sklearn.model_selection import train_test_split
+
+    X = np.load(cache.dir / "X.npy", mmap_mode="r")
+    y = np.load(cache.dir / "y.npy", mmap_mode="r")
+    val_idx = cache.splits[k][1]
+    X_res = np.load(cache.fold_path(k), mmap_mode="r")
+    y_res = np.load(cache.dir / f"fold_{k}_y.npy", mmap_mode="r")
+    fit_idx, stop_idx = train_test_split(np.arange(len(y_res)), test_size=SEARCH_EARLY_STOPPING_FRACTION,
+                                         stratify=y_res, random_state=cache.seed + k)
+    dfit = xgb.DMatrix(X_res[fit_idx], label=y_res[fit_idx])
+    dstop = xgb.DMatrix(X_res[stop_idx], label=y_res[stop_idx])
+    X_val, y_val = X[val_idx], y[val_idx]
+    dval = xgb.DMatrix(X_val, label=y_val)
+    params = {**config, 'objective': 'multi:softprob', 'num_class': n_classes, 'tree_method': 'hist',
+              'eval_metric': 'mlogloss', 'seed': cache.seed, 'nthread': os.cpu_count() or 1}
+
+    inicio = time.perf_counter()
+    booster = xgb.train(params, dfit, num_boost_round=max_rounds, evals=[(dstop, 'stop')],
+                        early_stopping_rounds=early_stopping_rounds, verbose_eval=False)
+    fit_time = time.perf_counter() - inicio
+    booster = booster[:booster.best_iteration + 1]
+    proba = booster.predict(dval)
+    return {
+        'balanced_accuracy': balanced_accuracy_score(y_val, proba.argmax(axis=1)),
+        'mlogloss': log_loss(y_val, proba, labels=np.arange(n_classes)),
+        'rounds': booster.num_boosted_rounds(),
+        'model_kb': len(booster.save_raw('ubj')) / 1024,
+        'latency_ms': booster_latency_ms(booster, X_val[0]),
+        'fit_time_s': fit_time,
+    }
+
+
+def rank_candidates(df, tolerance=SEARCH_TOLERANCE):
+    """
+    Ordena candidatos por balanced accuracy; los que quedan a menos de `tolerance` del
+    mejor se ordenan por latencia de un paciente y luego por tamaño del modelo. Marca
+    además los candidatos no dominados (Pareto) en precisión, latencia y tamaño.
+    """
+    df = df.copy()
+    empatado = df['mean_balanced_accuracy'] >= df['mean_balanced_accuracy'].max() - tolerance
+    df['_fuera'] = ~empatado
+    df['_precision'] = np.where(empatado, 0.0, -df['mean_balanced_accuracy'])
+    df = df.sort_values(['_fuera', '_precision', 'latency_ms', 'model_kb']).drop(columns=['_fuera', '_precision'])
+    valores = df[['mean_balanced_accuracy', 'latency_ms', 'model_kb']].to_numpy() * [-1, 1, 1]
+    df['pareto'] = [not ((valores <= v).all(axis=1) & (valores < v).any(axis=1)).any() for v in valores]
+    df.insert(0, 'rank', np.arange(1, len(df) + 1))
+    return df
+
+
+def successive_halving(X, y, n_candidates=SEARCH_CANDIDATES, eta=SEARCH_ETA, folds=SEARCH_FOLDS, rounds=SEARCH_ROUNDS,
+                       budget_s=SEARCH_BUDGET_S, tolerance=SEARCH_TOLERANCE, data_version=None, seed=CV_SEED,
+                       cache_dir=CV_CACHE_DIR):
+    """
+    Búsqueda por successive halving: en la ronda r cada candidato vivo se evalúa en los
+    primeros folds[r] folds con hasta rounds[r] árboles (parada temprana sobre una parte
+    reservada del entrenamiento; el fold de validación solo puntúa) y se conserva el mejor
+    1/eta según rank_candidates. Se detiene al agotar `budget_s` segundos de reloj, siempre
+    después de evaluar al menos un candidato; los candidatos quedan con la última ronda
+    completada. Devuelve el leaderboard (un registro por candidato).
+    """
+    cache = FoldCache(X, y, data_version or _data_version(X, y), max(folds), seed, cache_dir)
+    n_classes = int(np.max(y)) + 1
+    configs = sample_configs(n_candidates, seed)
+    resultados = {}
+    vivos = list(range(len(configs)))
+    inicio = time.perf_counter()
+    agotado = False
+
+    for ronda, (n_folds, max_rounds) in enumerate(zip(folds, rounds)):
+        print(f"Ronda {ronda}: {len(vivos)} candidatos, {n_folds} folds, hasta {max_rounds} árboles")
+        for k in range(n_folds):
+            if not cache.has_fold(k):
+                _resample_fold(cache.dir, k, cache.splits[k][0], seed)
+        for i in vivos:
+            if resultados and time.perf_counter() - inicio > budget_s:
+                agotado = True
+                break
+            por_fold = pd.DataFrame([_fit_search_fold(cache, k, configs[i], max_rounds, SEARCH_EARLY_STOPPING, n_classes)
+                                     for k in range(n_folds)])
+            resultados[i] = {
+                'candidate': i, **configs[i], 'rung': ronda, 'n_folds': n_folds, 'max_rounds': max_rounds,
+                'mean_balanced_accuracy': por_fold['balanced_accuracy'].mean(),
+                'std_balanced_accuracy': por_fold['balanced_accuracy'].std(ddof=0),
+                'mean_mlogloss': por_fold['mlogloss'].mean(),
+                'rounds': int(round(por_fold['rounds'].mean())),
+                'latency_ms': por_fold['latency_ms'].median(),
+                'model_kb': por_fold['model_kb'].mean(),
+                'fit_time_s': por_fold['fit_time_s'].sum(),
+            }
+        if agotado:
+            print(f"⏱️ Presupuesto de {budget_s:.0f} s agotado en la ronda {ronda}.")
+            break
+        ranking = rank_candidates(pd.DataFrame([resultados[i] for i in vivos]), tolerance)
+        vivos = ranking['candidate'].head(max(1, len(vivos) // eta)).tolist()
+
+    leaderboard = pd.DataFrame(list(resultados.values()))
+    # Los candidatos que llegaron más lejos encabezan el leaderboard
+    partes = [rank_candidates(grupo, tolerance) for _, grupo in leaderboard.groupby('rung', sort=False)]
+    leaderboard = pd.concat(sorted(partes, key=lambda g: -g['rung'].iloc[0]), ignore_index=True)
+    leaderboard['rank'] = np.arange(1, len(leaderboard) + 1)
+    return leaderboard, time.perf_counter() - inicio
+
+
+def run_search(args):
+    X = load_dataset(args.x)
+    y = load_dataset(args.y)['diagnostico'].to_numpy()
+    leaderboard, duracion = successive_halving(
+        X, y, args.candidates, args.eta, args.folds, args.rounds, args.budget, args.tolerance,
+        data_version=[dataset_hash(args.x), dataset_hash(args.y)])
+    METRICS_DIR.mkdir(parents=True, exist_ok=True)
+    path = METRICS_DIR / "xgboost_search_leaderboard.csv"
+    leaderboard.to_csv(path, index=False)
+    columnas = ['rank', 'candidate', *SEARCH_SPACE, 'rung', 'rounds', 'mean_balanced_accuracy', 'latency_ms', 'model_kb', 'pareto']
+    print(leaderboard[columnas].head(10).to_string(index=False, float_format="{:.4f}".format))
+    print(f"Búsqueda completada en {duracion:.1f} s -> {path}")
+
+
+# --- Curvas ROC y de calibración del modelo servido ---
+# Se calculan una vez por versión del modelo sobre X_test/y_test y se guardan en
+# reports/curves/<model_version>.npz; el dashboard solo las lee.
+CURVES_DIR = REPORTS_DIR / "curves"
+CALIBRATION_BINS = 10
+
+
+def compute_curves(model, X, y, class_names, n_bins=CALIBRATION_BINS):
+    """ ROC (uno contra el resto), AUC, curva de calibración y Brier por clase. """
+    from sklearn.calibration import calibration_curve
+    from sklearn.metrics import auc, brier_score_loss, roc_curve
+
+    proba = model.predict_proba(X)
+    curvas = {"classes": list(class_names), "roc": {}, "auc": {}, "calibration": {}, "brier": {}}
+    for k, nombre in enumerate(class_names):
+        positivo = (y == k).astype(np.int8)
+        fpr, tpr, _ = roc_curve(positivo, proba[:, k])
+        prob_true, prob_pred = calibration_curve(positivo, proba[:, k], n_bins=n_bins)
+        curvas["roc"][nombre] = (fpr, tpr)
+        curvas["auc"][nombre] = float(auc(fpr, tpr))
+        curvas["calibration"][nombre] = (prob_pred, prob_true)
+        curvas["brier"][nombre] = float(brier_score_loss(positivo, proba[:, k]))
+    return curvas
+
+
+def _save_curves(path, curvas, data_version):
+    arrays = {"classes": np.array(curvas["classes"]), "data_version": np.array(data_version),
+              "auc": np.array([curvas["auc"][c] for c in curvas["classes"]]),
+              "brier": np.array([curvas["brier"][c] for c in curvas["classes"]])}
+    for k, nombre in enumerate(curvas["classes"]):
+        arrays[f"fpr_{k}"], arrays[f"tpr_{k}"] = curvas["roc"][nombre]
+        arrays[f"cal_pred_{k}"], arrays[f"cal_true_{k}"] = curvas["calibration"][nombre]
+    with open(path, "wb") as f:
+        np.savez(f, **arrays)
+
+
+def _load_curves(path):
+    with np.load(path) as data:
+        clases = [str(c) for c in data["classes"]]
+        return {
+            "classes": clases,
+            "roc": {c: (data[f"fpr_{k}"], data[f"tpr_{k}"]) for k, c in enumerate(clases)},
+            "auc": dict(zip(clases, data["auc"].tolist())),
+            "calibration": {c: (data[f"cal_pred_{k}"], data[f"cal_true_{k}"]) for k, c in enumerate(clases)},
+            "brier": dict(zip(clases, data["brier"].tolist())),
+            "data_version": str(data["data_version"]),
+        }
+
+
+def load_or_compute_curves(model, model_version, x_name="X_test", y_name="y_test", curves_dir=CURVES_DIR, force=False):
+    """
+    Curvas de la versión `model_version`: las lee de curves_dir si se calcularon con los
+    mismos datos de prueba y, si no, las calcula con el modelo y las guarda.
+    """
+    from src.preprocessing import DIAGNOSTICO_MAP
+
+    path = curves_dir / f"{model_version}.npz"
+    try:
+        data_version = stable_hash([dataset_hash(x_name), dataset_hash(y_name)])
+    except FileNotFoundError:
+        data_version = None  # sin los datos de prueba solo sirven las curvas ya guardadas
+    if path.exists() and not force:
+        curvas = _load_curves(path)
+        if data_version is None or curvas["data_version"] == data_version:
+            return curvas
+    X = load_dataset(x_name, columns=list(model.feature_names_in_))
+    y = load_dataset(y_name)['diagnostico'].to_numpy()
+    curvas = compute_curves(model, X, y, [DIAGNOSTICO_MAP[i] for i in sorted(DIAGNOSTICO_MAP)])
+    curves_dir.mkdir(parents=True, exist_ok=True)
+    _save_atomic(path, lambda tmp: _save_curves(tmp, curvas, data_version))
+    curvas["data_version"] = data_version
+    return curvas
+
+
+def run_curves(args):
+    from src.registry import load_serving_artifacts
+
+    model, _, manifest, origen = load_serving_artifacts(args.model_version)
+    inicio = time.perf_counter()
+    curvas = load_or_compute_curves(model, manifest["model_version"], args.x, args.y, force=True)
+    print(f"Modelo {manifest['model_version']} ({origen}), curvas en {time.perf_counter() - inicio:.2f} s "
+          f"-> {CURVES_DIR / (manifest['model_version'] + '.npz')}")
+    for clase in curvas["classes"]:
+        print(f"  {clase}: AUC {curvas['auc'][clase]:.4f}  Brier {curvas['brier'][clase]:.5f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Evaluación del modelo final.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    parity = subparsers.add_parser("parity", help="Paridad de probabilidades de los backends de inferencia sobre X_test.")
+    parity.add_argument("--backends", nargs="+", choices=sorted(BACKENDS), help="Backends a verificar (por defecto, todos).")
+    parity.add_argument("--atol", type=float, default=PARITY_ATOL, help="Diferencia máxima de probabilidad permitida.")
+    parity.set_defaults(func=run_parity)
+
+    cv = subparsers.add_parser("cv", help="Validación cruzada de los pipelines del notebook con folds SMOTE en caché.")
+    cv.add_argument("--x", default="X_train", help="Dataset de data/processed o ruta a un CSV con X ya escalada.")
+    cv.add_argument("--y", default="y_train", help="Dataset de data/processed o ruta a un CSV con la columna 'diagnostico'.")
+    cv.add_argument("--models", nargs="+", choices=CV_MODELS, default=CV_MODELS, help="Modelos a evaluar.")
+    cv.add_argument("--n-splits", type=int, default=CV_N_SPLITS)
+    cv.add_argument("--seed", type=int, default=CV_SEED, help="Semilla de StratifiedKFold y SMOTE.")
+    cv.add_argument("--workers", type=int, default=None, help="Procesos del pool (por defecto, uno por núcleo).")
+    cv.add_argument("--out-dir", type=Path, default=METRICS_DIR, help="Directorio de los cv_results_*.csv.")
+    cv.set_defaults(func=run_cv)
+
+    search = subparsers.add_parser("search", help="Búsqueda de hiperparámetros de XGBoost con successive halving y presupuesto de tiempo.")
+    search.add_argument("--x", default="X_train", help="Dataset de data/processed o ruta a un CSV con X ya escalada.")
+    search.add_argument("--y", default="y_train", help="Dataset de data/processed o ruta a un CSV con la columna 'diagnostico'.")
+    search.add_argument("--candidates", type=int, default=SEARCH_CANDIDATES, help="Configuraciones iniciales.")
+    search.add_argument("--eta", type=int, default=SEARCH_ETA, help="Factor de descarte entre rondas.")
+    search.add_argument("--folds", type=int, nargs="+", default=SEARCH_FOLDS, help="Folds por ronda.")
+    search.add_argument("--rounds", type=int, nargs="+", default=SEARCH_ROUNDS, help="Máximo de árboles por ronda.")
+    search.add_argument("--budget", type=float, default=SEARCH_BUDGET_S, help="Presupuesto de reloj en segundos.")
+    search.add_argument("--tolerance", type=float, default=SEARCH_TOLERANCE,
+                        help="Diferencia de balanced accuracy bajo la cual se prefiere el modelo más rápido y pequeño.")
+    search.set_defaults(func=run_search)
+
+    curves = subparsers.add_parser("curves", help="Calcula y guarda las curvas ROC y de calibración de la versión servida.")
+    curves.add_argument("--x", default="X_test", help="Dataset de data/processed con X ya escalada.")
+    curves.add_argument("--y", default="y_test", help="Dataset de data/processed con la columna 'diagnostico'.")
+    curves.add_argument("--model-version", default=None, help="Versión del registro (por defecto, la activa).")
+    curves.set_defaults(func=run_curves)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,301 @@
+# Explicaciones SHAP del modelo final
+import argparse
+import hashlib
+import json
+import time
+
+import numpy as np
+import pandas as pd
+
+from src.preprocessing import DIAGNOSTICO_MAP
+from src.telemetry import span
+from src.utils import MODEL_PATH, REPORTS_DIR, BoundedLRUCache, file_digest, load_artifacts, load_dataset
+
+DEFAULT_SHAP_CACHE_MB = 32
+SHAP_STORE_DIR = REPORTS_DIR / "shap"
+SHAP_ENGINES = ("booster", "tree")
+DEFAULT_SHAP_ENGINE = "booster"
+SHAP_PARITY_ATOL = 1e-4
+
+
+class BoosterExplainer:
+    """
+    TreeSHAP exacto calculado por el propio booster de XGBoost (pred_contribs y
+    pred_interactions, en C++ multihilo), sin importar shap. Las salidas tienen siempre
+    la forma por clase:
+        contributions(X)                  (n, n_clases, n_features + 1), sesgo en la última columna
+        contributions(X, interactions)    (n, n_clases, n_features + 1, n_features + 1)
+        shap_values(X)                    (n, n_clases, n_features)
+    El sesgo es el valor esperado del margen de cada clase (expected_value).
+    """
+
+    def __init__(self, classifier):
+        self.booster = classifier.get_booster()
+        self.feature_names = list(self.booster.feature_names or classifier.feature_names_in_)
+        self._expected = None
+
+    def contributions(self, X, interactions=False):
+        import xgboost as xgb
+
+        datos = X.to_numpy(dtype=np.float32) if isinstance(X, pd.DataFrame) else np.asarray(X, dtype=np.float32)
+        # Sin nombres en la DMatrix: el orden de columnas es el del modelo y se evita validarlos en cada llamada
+        salida = self.booster.predict(xgb.DMatrix(np.atleast_2d(datos)), pred_contribs=not interactions,
+                                      pred_interactions=interactions, validate_features=False)
+        # Con una sola salida (binario) XGBoost omite el eje de clases
+        return salida[:, None] if salida.ndim == (3 if interactions else 2) else salida
+
+    def shap_values(self, X):
+        return self.contributions(X)[..., :-1]
+
+    def shap_interaction_values(self, X):
+        return self.contributions(X, interactions=True)[..., :-1, :-1]
+
+    @property
+    def expected_value(self):
+        if self._expected is None:
+            fila = np.zeros((1, len(self.feature_names)), dtype=np.float32)
+            self._expected = self.contributions(fila)[0, :, -1].astype(np.float64)
+        return self._expected
+
+
+def create_explainer(model, engine=DEFAULT_SHAP_ENGINE):
+    """ Explainer del clasificador XGBoost del pipeline: 'booster' (pred_contribs) o 'tree' (shap.TreeExplainer). """
+    if engine == "booster":
+        return BoosterExplainer(model.named_steps['classifier'])
+    if engine == "tree":
+        import shap
+        return shap.TreeExplainer(model.named_steps['classifier'])
+    raise ValueError(f"Motor SHAP desconocido: {engine}; use uno de {SHAP_ENGINES}")
+
+
+def normalize_shap_values(shap_values, n_samples):
+    """
+    Lleva la salida de TreeExplainer.shap_values a un arreglo (n, n_clases, n_features).
+    Según la versión de shap, la salida multiclase es una lista de (n, f) por clase
+    o un arreglo (n, f, n_clases).
+    """
+    if isinstance(shap_values, (list, tuple)):
+        return np.stack([np.asarray(sv) for sv in shap_values], axis=1)
+    sv = np.asarray(shap_values)
+    if sv.ndim == 2:
+        return sv[:, None, :]
+    if sv.shape[0] == n_samples:
+        return np.transpose(sv, (0, 2, 1))
+    # (n_clases, n, f)
+    return np.transpose(sv, (1, 0, 2))
+
+
+def _by_class(explainer, X):
+    if isinstance(explainer, BoosterExplainer):
+        return explainer.shap_values(X)
+    return normalize_shap_values(explainer.shap_values(X), len(X))
+
+
+def shap_values_by_class(explainer, X):
+    """ Valores SHAP de X como arreglo (n, n_clases, n_features), con cualquier motor. """
+    if isinstance(explainer, CachedExplainer):
+        return explainer.shap_values(X)
+    with span("shap"):
+        return _by_class(explainer, X)
+
+
+def expected_values(explainer):
+    """ Valor base por clase como arreglo 1-D. """
+    return np.atleast_1d(np.asarray(explainer.expected_value, dtype=np.float64))
+
+
+def _read_only(value):
+    """ Marca los arreglos como de solo lectura: los valores en caché se comparten entre sesiones. """
+    if isinstance(value, (list, tuple)):
+        return type(value)(_read_only(v) for v in value)
+    value = np.asarray(value)
+    value.flags.writeable = False
+    return value
+
+
+class CachedExplainer:
+    """
+    Envuelve un explainer y memoriza sus valores SHAP, ya como (n, n_clases, n_features), por
+    hash del vector de características procesado y la versión del modelo. La caché es un
+    BoundedLRUCache con presupuesto de memoria, por lo que repetir un caso (o volver a la
+    página de análisis) no ejecuta TreeSHAP.
+    """
+
+    def __init__(self, explainer, model_version, max_mb=DEFAULT_SHAP_CACHE_MB):
+        self.explainer = explainer
+        self.model_version = model_version
+        self.cache = BoundedLRUCache(int(max_mb * 1024 * 1024))
+
+    @property
+    def expected_value(self):
+        return self.explainer.expected_value
+
+    def cache_key(self, X):
+        X = np.ascontiguousarray(np.asarray(X, dtype=np.float32))
+        digest = hashlib.blake2b(X.tobytes(), digest_size=16)
+        digest.update(repr(X.shape).encode())
+        digest.update(str(self.model_version).encode())
+        return digest.hexdigest()
+
+    def shap_values(self, X):
+        with span("shap"):
+            return self.cache.get_or_compute(self.cache_key(X), lambda: _read_only(_by_class(self.explainer, X)))
+
+    def stats(self):
+        return {"model_version": self.model_version, **self.cache.stats()}
+
+
+# --- Almacén poblacional de valores SHAP ---
+def build_population_store(model, X, out_dir=SHAP_STORE_DIR, model_version=None, engine=DEFAULT_SHAP_ENGINE):
+    """
+    Calcula SHAP para toda la población X (por defecto X_test) y guarda en `out_dir`:
+      - shap_values.npy   (n, n_clases, n_features) float32
+      - shap_sorted.npy   (n_clases, n_features, n) float32, ordenado en el último eje
+      - expected_value.npy (n_clases,)
+      - metadata.json     nombres de características, clases y versión del modelo
+    Los .npy se abren luego con memory-map, sin parseo.
+    """
+    out_dir.mkdir(parents=True, exist_ok=True)
+    explainer = create_explainer(model, engine)
+    valores = shap_values_by_class(explainer, X).astype(np.float32)
+
+    np.save(out_dir / "shap_values.npy", valores)
+    np.save(out_dir / "shap_sorted.npy", np.sort(np.transpose(valores, (1, 2, 0)), axis=-1))
+    np.save(out_dir / "expected_value.npy", expected_values(explainer))
+    metadata = {
+        "feature_names": list(model.feature_names_in_),
+        "classes": [DIAGNOSTICO_MAP[i] for i in sorted(DIAGNOSTICO_MAP)],
+        "n_samples": int(valores.shape[0]),
+        "model_version": model_version,
+    }
+    (out_dir / "metadata.json").write_text(json.dumps(metadata, indent=2, ensure_ascii=False), encoding="utf-8")
+    return metadata
+
+
+class PopulationShapStore:
+    """
+    Acceso de solo lectura al almacén poblacional. Los arreglos se abren con memory-map
+    en el primer uso; los percentiles se resuelven con searchsorted sobre los valores
+    ya ordenados por clase y característica.
+    """
+
+    def __init__(self, store_dir=SHAP_STORE_DIR):
+        self.store_dir = store_dir
+        metadata = json.loads((store_dir / "metadata.json").read_text(encoding="utf-8"))
+        self.feature_names = metadata["feature_names"]
+        self.classes = metadata["classes"]
+        self.n_samples = metadata["n_samples"]
+        self.model_version = metadata.get("model_version")
+        self._values = None
+        self._sorted = None
+        self._expected = None
+
+    @classmethod
+    def open(cls, store_dir=SHAP_STORE_DIR):
+        """ Devuelve el almacén o None si todavía no se construyó. """
+        if not (store_dir / "metadata.json").exists():
+            return None
+        return cls(store_dir)
+
+    @property
+    def values(self):
+        if self._values is None:
+            self._values = np.load(self.store_dir / "shap_values.npy", mmap_mode="r")
+        return self._values
+
+    @property
+    def sorted_values(self):
+        if self._sorted is None:
+            self._sorted = np.load(self.store_dir / "shap_sorted.npy", mmap_mode="r")
+        return self._sorted
+
+    @property
+    def expected_value(self):
+        if self._expected is None:
+            self._expected = np.load(self.store_dir / "expected_value.npy", mmap_mode="r")
+        return self._expected
+
+    def percentiles(self, class_index, contributions):
+        """ Percentil (0-100) de cada contribución del paciente dentro de la población, por característica. """
+        ordenados = self.sorted_values[class_index]
+        contribuciones = np.asarray(contributions, dtype=np.float32)
+        posiciones = np.fromiter(
+            (np.searchsorted(ordenados[j], contribuciones[j], side="right") for j in range(len(contribuciones))),
+            dtype=np.float64, count=len(contribuciones),
+        )
+        return posiciones / self.n_samples * 100
+
+    def quantiles(self, class_index, q=(0.05, 0.5, 0.95)):
+        """ Cuantiles poblacionales por característica leídos directamente de los arreglos ordenados. """
+        ordenados = self.sorted_values[class_index]
+        indices = np.minimum((np.asarray(q) * self.n_samples).astype(int), self.n_samples - 1)
+        return np.asarray(ordenados[:, indices])
+
+    def compare(self, class_index, contributions, top=10):
+        """ Tabla de las `top` contribuciones del paciente con su percentil y el rango poblacional (p5-p95). """
+        contribuciones = np.asarray(contributions, dtype=np.float64)
+        orden = np.argsort(-np.abs(contribuciones))[:top]
+        percentiles = self.percentiles(class_index, contribuciones)
+        p5, p50, p95 = self.quantiles(class_index).T
+        return pd.DataFrame({
+            "feature": [self.feature_names[j] for j in orden],
+            "shap_paciente": contribuciones[orden],
+            "percentil_poblacion": percentiles[orden],
+            "p5": p5[orden],
+            "mediana": p50[orden],
+            "p95": p95[orden],
+        })
+
+
+# --- Paridad de los motores SHAP ---
+def check_shap_parity(model, X, atol=SHAP_PARITY_ATOL, n_interactions=200):
+    """
+    Compara BoosterExplainer con shap.TreeExplainer sobre X (valores SHAP y valor base) y
+    comprueba la aditividad: contribuciones + sesgo = margen del booster, y las
+    interacciones de las primeras `n_interactions` filas suman las contribuciones.
+    Devuelve un DataFrame con la diferencia absoluta máxima de cada comprobación.
+    """
+    booster_explainer = create_explainer(model, "booster")
+    tree_explainer = create_explainer(model, "tree")
+    contribuciones = booster_explainer.contributions(X)
+    margen = booster_explainer.booster.inplace_predict(np.asarray(X, dtype=np.float32), predict_type="margin",
+                                                       validate_features=False)
+    interacciones = booster_explainer.contributions(X[:n_interactions], interactions=True)
+    diferencias = {
+        'shap_values vs TreeExplainer': np.abs(contribuciones[..., :-1] - _by_class(tree_explainer, X)).max(),
+        'expected_value vs TreeExplainer': np.abs(booster_explainer.expected_value - expected_values(tree_explainer)).max(),
+        'aditividad (suma = margen)': np.abs(contribuciones.sum(axis=-1) - margen.reshape(contribuciones.shape[:2])).max(),
+        'interacciones (suma = contribuciones)': np.abs(interacciones.sum(axis=-1) - contribuciones[:n_interactions]).max(),
+    }
+    return pd.DataFrame({'check': list(diferencias), 'max_abs_diff': [float(d) for d in diferencias.values()],
+                         'ok': [bool(d <= atol) for d in diferencias.values()]})
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Explicaciones SHAP del modelo final.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    build = subparsers.add_parser("build-store", help="Precalcula SHAP de X_test en reports/shap para la página de análisis.")
+    build.add_argument("--input", default="X_test", help="Dataset de data/processed o ruta a un CSV ya procesado (escalado).")
+    build.add_argument("--engine", default=DEFAULT_SHAP_ENGINE, choices=SHAP_ENGINES, help="Motor SHAP.")
+    parity = subparsers.add_parser("parity", help="Paridad de BoosterExplainer (pred_contribs) con shap.TreeExplainer.")
+    parity.add_argument("--input", default="X_test", help="Dataset de data/processed o ruta a un CSV ya procesado (escalado).")
+    parity.add_argument("--atol", type=float, default=SHAP_PARITY_ATOL, help="Diferencia máxima permitida (espacio de margen).")
+    args = parser.parse_args()
+
+    model, _ = load_artifacts()
+    X = load_dataset(args.input, columns=list(model.feature_names_in_))
+    if args.command == "parity":
+        resultado = check_shap_parity(model, X.to_numpy(dtype=np.float32), args.atol)
+        print(resultado.to_string(index=False, float_format="{:.2e}".format))
+        if not resultado['ok'].all():
+            raise SystemExit(f"❌ Los motores SHAP difieren más de {args.atol}")
+        print(f"✅ Paridad en {len(X)} filas (atol {args.atol})")
+        return
+    inicio = time.perf_counter()
+    metadata = build_population_store(model, X, model_version=file_digest(MODEL_PATH), engine=args.engine)
+    print(f"Almacén SHAP de {metadata['n_samples']} pacientes guardado en {SHAP_STORE_DIR} "
+          f"({time.perf_counter() - inicio:.1f} s)")
+
+
+if __name__ == "__main__":
+    main()
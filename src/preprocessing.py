@@ -1 +1,226 @@
-# Funciones para el preprocesamiento de datos
\ No newline at end of file
+# Funciones para el preprocesamiento de datos
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+# --- Mapeos y Definiciones ---
+DIAGNOSTICO_MAP = {0: 'DM2', 1: 'EDA', 2: 'HTA', 3: 'IRA'}
+SEXO_MAP = {'Femenino': 0, 'Masculino': 1}
+AREA_MAP = {'Rural': 0, 'Urbano': 1}
+SINO_MAP = {'No': 0, 'Sí': 1}
+
+ANTECEDENTES = ['tabaquismo', 'alcoholismo', 'sedentarismo', 'ant_familiar_dm', 'ant_familiar_hta']
+
+# Columnas estandarizadas con el scaler (mismo orden que en 02_Preprocessing.ipynb)
+NUMERICAL_COLS = ['edad', 'imc', 'pas', 'pad', 'fc', 'fr', 'temp', 'spo2', 'glucosa', 'hba1c', 'creatinina', 'colesterol', 'leucocitos', 'tiempo_enfermedad', 'presion_pulso']
+
+# El formulario (app y servicio HTTP) recoge los leucocitos en células/µL, mientras que el
+# dataset, el scaler y el modelo los usan en 10³/µL: factor que se aplica al codificar el formulario
+UNIDADES_FORMULARIO = {'leucocitos': 1e-3}
+
+# Categorías de IMC: 0 Bajo peso, 1 Normal, 2 Sobrepeso, 3 Obesidad (intervalos cerrados a la izquierda)
+IMC_BINS = [0, 18.5, 24.9, 29.9, np.inf]
+IMC_LABELS = [0, 1, 2, 3]
+
+
+def _encode_column(values, mapping):
+    """ Codifica una columna con `mapping` si viene como texto; si ya es numérica la deja igual. """
+    if values.dtype == bool:
+        return values.astype(np.int8)
+    if values.dtype == object:
+        encoded = values.map(mapping)
+        if encoded.isna().any():
+            invalidos = sorted(set(values[encoded.isna()].astype(str)))
+            raise ValueError(f"Valores no reconocidos en '{values.name}': {invalidos}")
+        return encoded.astype(np.int8)
+    return values
+
+
+def encode_inputs(df, sintomas):
+    """
+    Aplica la codificación de SEXO_MAP, AREA_MAP y SINO_MAP a un bloque de pacientes.
+    Acepta tanto valores en texto ('Femenino', 'Sí', ...) como ya codificados.
+    """
+    faltantes = [col for col in ['sexo', 'area'] + ANTECEDENTES + list(sintomas) if col not in df.columns]
+    if faltantes:
+        raise ValueError(f"Faltan columnas en los datos de entrada: {faltantes}")
+
+    df = df.copy()
+    df['sexo'] = _encode_column(df['sexo'], SEXO_MAP)
+    df['area'] = _encode_column(df['area'], AREA_MAP)
+    for col in ANTECEDENTES + list(sintomas):
+        df[col] = _encode_column(df[col], SINO_MAP)
+    return df
+
+
+def imc_categoria(imc):
+    """ Versión vectorizada de pd.cut(imc, IMC_BINS, labels=IMC_LABELS, right=False). """
+    return np.digitize(np.asarray(imc, dtype=np.float64), IMC_BINS[1:-1]).astype(np.int8)
+
+
+def add_engineered_features(df):
+    """ Deriva `presion_pulso` e `imc_categoria` sobre todo el bloque a la vez. """
+    df['presion_pulso'] = df['pas'] - df['pad']
+    df['imc_categoria'] = imc_categoria(df['imc'].to_numpy())
+    return df
+
+
+def transform_chunk(df, scaler, feature_order):
+    """
+    Convierte un bloque de pacientes en bruto a la matriz que espera el modelo:
+    codificación, ingeniería de características, orden de columnas y escalado.
+    """
+    return ChunkedPreprocessor(feature_order, scaler).transform(df)
+
+
+# --- Preprocesamiento por bloques (fuera de memoria) ---
+# Columnas del dataset en bruto que no son características (mismo criterio que 02_Preprocessing.ipynb)
+COLUMNAS_EXCLUIDAS = ['id', 'diagnostico', 'diagnostico_str', 'sexo_str', 'area_str']
+DERIVADAS = ['presion_pulso', 'imc_categoria']
+TARGET_COL = 'diagnostico'
+DEFAULT_CHUNKSIZE = 100_000
+
+
+def feature_order_from_columns(columns):
+    """ Orden de características del modelo a partir de las columnas del dataset en bruto. """
+    return [col for col in columns if col not in COLUMNAS_EXCLUIDAS and col not in DERIVADAS] + DERIVADAS
+
+
+class ChunkedPreprocessor:
+    """
+    Transformador único del proyecto: codificación, `presion_pulso`, `imc_categoria`,
+    orden de columnas y StandardScaler. Se ajusta recorriendo el CSV por bloques
+    (StandardScaler.partial_fit acumula media y varianza de forma incremental), por lo que
+    la memoria depende de `chunksize` y no del tamaño del extracto. La app
+    (CompiledPredictor), la predicción por lotes y la reconstrucción de X/y lo comparten.
+    """
+
+    def __init__(self, feature_order=None, scaler=None):
+        self.feature_order = list(feature_order) if feature_order is not None else None
+        self.scaler = scaler
+
+    @classmethod
+    def from_artifacts(cls, model, scaler):
+        """ Transformador ya ajustado a partir del pipeline y el scaler guardados. """
+        return cls(model.feature_names_in_, scaler)
+
+    @property
+    def sintomas(self):
+        return [col for col in self.feature_order if col.startswith('sintoma_')]
+
+    def scaler_params(self):
+        """ Media y escala del scaler como vectores float64 en el orden de NUMERICAL_COLS. """
+        orden_scaler = list(getattr(self.scaler, 'feature_names_in_', NUMERICAL_COLS))
+        cols_scaler = [orden_scaler.index(col) for col in NUMERICAL_COLS]
+        mean = np.asarray(self.scaler.mean_, dtype=np.float64)[cols_scaler]
+        scale = np.asarray(self.scaler.scale_, dtype=np.float64)[cols_scaler]
+        return mean, scale
+
+    def features(self, df):
+        """ Codifica y deriva características sin escalar, en el orden del modelo. """
+        df = add_engineered_features(encode_inputs(df, self.sintomas))
+        X = df.reindex(columns=self.feature_order)
+        if X.isna().any().any():
+            faltantes = X.columns[X.isna().any()].tolist()
+            raise ValueError(f"Valores faltantes en columnas requeridas por el modelo: {faltantes}")
+        return X
+
+    def transform(self, df):
+        """ Bloque de pacientes en bruto -> matriz escalada que espera el modelo. """
+        X = self.features(df)
+        X[NUMERICAL_COLS] = self.scaler.transform(X[NUMERICAL_COLS])
+        return X
+
+    def split_mask(self, source, test_size=0.2, random_state=42, chunksize=DEFAULT_CHUNKSIZE, target=TARGET_COL):
+        """
+        Máscara booleana (True = prueba) de la división estratificada por `target`. Solo se
+        leen las etiquetas (un byte por fila); con los mismos parámetros que el notebook se
+        obtiene la misma partición que train_test_split(..., stratify=y).
+        """
+        from sklearn.model_selection import train_test_split
+
+        y = np.concatenate([
+            chunk[target].to_numpy(dtype=np.int8)
+            for chunk in pd.read_csv(source, usecols=[target], chunksize=chunksize)
+        ])
+        _, idx_test = train_test_split(np.arange(len(y)), test_size=test_size, random_state=random_state, stratify=y)
+        mask = np.zeros(len(y), dtype=bool)
+        mask[idx_test] = True
+        return mask
+
+    def fit(self, source, test_mask=None, chunksize=DEFAULT_CHUNKSIZE):
+        """ Ajusta el scaler en streaming sobre las filas de entrenamiento (test_mask False) de `source`. """
+        from sklearn.preprocessing import StandardScaler
+
+        self.scaler = StandardScaler()
+        inicio = 0
+        for chunk in pd.read_csv(source, chunksize=chunksize):
+            if self.feature_order is None:
+                self.feature_order = feature_order_from_columns(chunk.columns)
+            X = self.features(chunk)
+            if test_mask is not None:
+                X = X[~test_mask[inicio:inicio + len(chunk)]]
+            if len(X):
+                self.scaler.partial_fit(X[NUMERICAL_COLS])
+            inicio += len(chunk)
+        return self
+
+    def build_datasets(self, source, out_dir, test_size=0.2, random_state=42, chunksize=DEFAULT_CHUNKSIZE,
+                       target=TARGET_COL):
+        """
+        Reconstruye X_train, X_test, y_train e y_test desde el dataset en bruto en tres
+        pasadas por bloques: etiquetas para la división estratificada, ajuste del scaler con
+        las filas de entrenamiento y escritura incremental de los CSV ya escalados.
+        Las filas se escriben en el orden del archivo de origen. Devuelve los tamaños.
+        """
+        out_dir = Path(out_dir)
+        out_dir.mkdir(parents=True, exist_ok=True)
+        test_mask = self.split_mask(source, test_size, random_state, chunksize, target)
+        self.fit(source, test_mask, chunksize)
+
+        salidas = {name: out_dir / f"{name}.csv" for name in ['X_train', 'X_test', 'y_train', 'y_test']}
+        tamanos = {'train': 0, 'test': 0}
+        inicio = 0
+        for i, chunk in enumerate(pd.read_csv(source, chunksize=chunksize)):
+            X = self.transform(chunk)
+            y = chunk[[target]]
+            es_test = test_mask[inicio:inicio + len(chunk)]
+            inicio += len(chunk)
+            for parte, filas in (('train', ~es_test), ('test', es_test)):
+                X[filas].to_csv(salidas[f'X_{parte}'], mode='w' if i == 0 else 'a', header=i == 0, index=False)
+                y[filas].to_csv(salidas[f'y_{parte}'], mode='w' if i == 0 else 'a', header=i == 0, index=False)
+                tamanos[parte] += int(filas.sum())
+        return tamanos
+
+
+def main():
+    import argparse
+    import time
+
+    import joblib
+
+    from src.utils import DATA_DIR, SCALER_PATH
+
+    parser = argparse.ArgumentParser(description="Preprocesamiento por bloques del dataset clínico.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    build = subparsers.add_parser("build", help="Reconstruye X/y de entrenamiento y prueba y el scaler desde el dataset en bruto.")
+    build.add_argument("input", nargs="?", default=str(DATA_DIR / "dataset_clinico_huancayo_20k_processed.csv"),
+                       help="CSV en bruto con la columna 'diagnostico'.")
+    build.add_argument("--out-dir", default=str(DATA_DIR), help="Directorio de salida de X_train/X_test/y_train/y_test.")
+    build.add_argument("--scaler-out", default=str(SCALER_PATH), help="Ruta donde guardar el scaler ajustado.")
+    build.add_argument("--chunksize", type=int, default=DEFAULT_CHUNKSIZE, help="Filas por bloque.")
+    build.add_argument("--test-size", type=float, default=0.2)
+    build.add_argument("--random-state", type=int, default=42)
+    args = parser.parse_args()
+
+    inicio = time.perf_counter()
+    preprocessor = ChunkedPreprocessor()
+    tamanos = preprocessor.build_datasets(args.input, args.out_dir, args.test_size, args.random_state, args.chunksize)
+    joblib.dump(preprocessor.scaler, args.scaler_out)
+    print(f"✅ {tamanos['train']} filas de entrenamiento y {tamanos['test']} de prueba en {args.out_dir} "
+          f"({time.perf_counter() - inicio:.1f} s); scaler guardado en {args.scaler_out}")
+
+
+if __name__ == "__main__":
+    main()
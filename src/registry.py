@@ -0,0 +1,228 @@
+# Registro versionado de modelos con artefactos nativos
+"""
+Cada versión vive en models/registry/vNNNN/:
+    booster.ubj         booster de XGBoost en su formato binario nativo (UBJSON)
+    scaler_mean.npy     parámetros del StandardScaler como arreglos crudos
+    scaler_scale.npy
+    scaler_var.npy
+    manifest.json       orden de características, clases, versión y checksums de los archivos
+models/registry/CURRENT indica la versión activa. A diferencia de los pickles, los
+artefactos no dependen de la versión exacta de scikit-learn/imblearn. Los parámetros del
+scaler se abren con memory-map y los procesos comparten sus páginas; el booster, en
+cambio, XGBoost lo carga en memoria propia de cada proceso (es un archivo pequeño).
+"""
+import argparse
+import json
+import os
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+
+from src.preprocessing import DIAGNOSTICO_MAP, NUMERICAL_COLS
+from src.utils import BASE_PATH, MODEL_PATH, MODELS_DIR, SCALER_PATH, file_digest, load_artifacts
+
+REGISTRY_DIR = MODELS_DIR / "registry"
+REGISTRY_FORMAT_VERSION = 1
+BOOSTER_FILE = "booster.ubj"
+SCALER_FILES = {"mean_": "scaler_mean.npy", "scale_": "scaler_scale.npy", "var_": "scaler_var.npy"}
+
+
+def list_versions(registry_dir=REGISTRY_DIR):
+    """ Versiones publicadas, de la más antigua a la más reciente. """
+    if not registry_dir.exists():
+        return []
+    return sorted(p.name for p in registry_dir.iterdir() if p.is_dir() and p.name.startswith("v") and p.name[1:].isdigit())
+
+
+def current_version(registry_dir=REGISTRY_DIR):
+    """ Versión activa según CURRENT, o None si el registro está vacío. """
+    path = registry_dir / "CURRENT"
+    return path.read_text(encoding="utf-8").strip() if path.exists() else None
+
+
+def set_current(version, registry_dir=REGISTRY_DIR):
+    if version not in list_versions(registry_dir):
+        raise ValueError(f"La versión {version} no existe en {registry_dir}")
+    tmp = registry_dir / ".CURRENT.tmp"
+    tmp.write_text(version + "\n", encoding="utf-8")
+    os.replace(tmp, registry_dir / "CURRENT")
+
+
+def publish(model, scaler, registry_dir=REGISTRY_DIR, model_version=None, source=None, activate=True):
+    """
+    Publica el pipeline y el scaler como una nueva versión numerada. `model_version`
+    conserva la identidad del modelo (por defecto, el hash del booster): al publicar el
+    mismo final_model.pkl se mantiene su versión para que las cachés SHAP sigan valiendo.
+    Devuelve el nombre de la versión creada.
+    """
+    versiones = list_versions(registry_dir)
+    version = f"v{int(versiones[-1][1:]) + 1 if versiones else 1:04d}"
+    tmp_dir = registry_dir / f".tmp_{version}_{os.getpid()}"
+    tmp_dir.mkdir(parents=True)
+
+    booster = model.named_steps['classifier'].get_booster()
+    booster.save_model(tmp_dir / BOOSTER_FILE)
+    for attr, name in SCALER_FILES.items():
+        np.save(tmp_dir / name, np.ascontiguousarray(getattr(scaler, attr), dtype=np.float64))
+
+    archivos = [BOOSTER_FILE, *SCALER_FILES.values()]
+    manifest = {
+        "format_version": REGISTRY_FORMAT_VERSION,
+        "version": version,
+        "model_version": model_version or file_digest(tmp_dir / BOOSTER_FILE),
+        "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "source": source,
+        "feature_names": [str(f) for f in model.feature_names_in_],
+        "numerical_cols": [str(f) for f in getattr(scaler, "feature_names_in_", NUMERICAL_COLS)],
+        "n_samples_seen": int(np.max(scaler.n_samples_seen_)),
+        "classes": {str(k): v for k, v in DIAGNOSTICO_MAP.items()},
+        "artifacts": {
+            name: {"sha256": file_digest(tmp_dir / name, length=64), "bytes": (tmp_dir / name).stat().st_size}
+            for name in archivos
+        },
+    }
+    (tmp_dir / "manifest.json").write_text(json.dumps(manifest, indent=2, ensure_ascii=False) + "\n", encoding="utf-8")
+    os.replace(tmp_dir, registry_dir / version)
+    if activate:
+        set_current(version, registry_dir)
+    return version
+
+
+def load_version(version=None, registry_dir=REGISTRY_DIR, verify=True):
+    """
+    Carga una versión (por defecto la activa) y devuelve (model, scaler, manifest), con
+    model y scaler intercambiables con los de load_artifacts: un Pipeline con el paso
+    'classifier' (XGBClassifier) y un StandardScaler cuyos parámetros son memory-maps.
+    Con verify=True comprueba los checksums y lanza ValueError si no coinciden.
+    """
+    import xgboost as xgb
+    # Para inferir no hace falta SMOTE: basta el Pipeline de scikit-learn (no se importa imblearn)
+    from sklearn.pipeline import Pipeline
+    from sklearn.preprocessing import StandardScaler
+
+    version = version or current_version(registry_dir)
+    if version is None:
+        raise FileNotFoundError(f"No hay versiones publicadas en {registry_dir}")
+    version_dir = registry_dir / version
+    manifest = json.loads((version_dir / "manifest.json").read_text(encoding="utf-8"))
+    if manifest.get("format_version") != REGISTRY_FORMAT_VERSION:
+        raise ValueError(f"Formato de registro no soportado: {manifest.get('format_version')}")
+    if verify:
+        for name, info in manifest["artifacts"].items():
+            if file_digest(version_dir / name, length=64) != info["sha256"]:
+                raise ValueError(f"El artefacto {version}/{name} no coincide con su manifiesto.")
+
+    classifier = xgb.XGBClassifier()
+    classifier.load_model(str(version_dir / BOOSTER_FILE))
+    model = Pipeline([('classifier', classifier)])
+
+    scaler = StandardScaler()
+    for attr, name in SCALER_FILES.items():
+        setattr(scaler, attr, np.load(version_dir / name, mmap_mode="r"))
+    scaler.feature_names_in_ = np.asarray(manifest["numerical_cols"], dtype=object)
+    scaler.n_features_in_ = len(manifest["numerical_cols"])
+    scaler.n_samples_seen_ = manifest["n_samples_seen"]
+    return model, scaler, manifest
+
+
+def load_serving_artifacts(version=None):
+    """
+    Artefactos para servir predicciones: la versión `version` (o la activa) del registro
+    si existe y, si no, los pickles con models/manifest.json. Devuelve (model, scaler, manifest, origen).
+    """
+    version = version or current_version()
+    if version is not None:
+        model, scaler, manifest = load_version(version)
+        return model, scaler, manifest, f"registro {version}"
+    from src.models import load_manifest
+
+    model, scaler = load_artifacts()
+    return model, scaler, load_manifest(), "pickles"
+
+
+# --- Comparación con los pickles ---
+_LOAD_WORKER = """
+import json, os, time, warnings
+warnings.filterwarnings("ignore")
+import numpy as np
+
+def memoria_mb():
+    campos = {{}}
+    with open("/proc/self/smaps_rollup") as f:
+        for linea in f:
+            partes = linea.split()
+            if partes[0] in ("Rss:", "Pss:", "Private_Clean:", "Private_Dirty:"):
+                campos[partes[0][:-1]] = int(partes[1]) / 1024
+    return campos
+
+antes = memoria_mb()
+t = time.perf_counter()
+{load}
+duracion = time.perf_counter() - t
+despues = memoria_mb()
+print(json.dumps({{"load_s": duracion, **{{f"{{k.lower()}}_delta_mb": despues[k] - antes[k] for k in despues}}}}))
+"""
+
+_LOADERS = {
+    "pickles (joblib)": "from src.utils import load_artifacts; model, scaler = load_artifacts()",
+    "registro (booster nativo, scaler mmap)": "from src.registry import load_version; model, scaler, _ = load_version()",
+}
+
+
+def bench_loading(repeats=3):
+    """
+    Tiempo de carga y memoria añadida (RSS, PSS y privada, de /proc/self/smaps_rollup) en
+    un proceso nuevo, con los pickles y con la versión activa del registro. Se mide desde
+    un intérprete con solo NumPy importado, así que incluye las librerías que cada formato
+    necesita (los pickles arrastran imblearn y el SMOTE ajustado con los datos de entrenamiento).
+    """
+    import subprocess
+    import sys
+
+    import pandas as pd
+
+    filas = []
+    for nombre, load in _LOADERS.items():
+        for _ in range(repeats):
+            salida = subprocess.run([sys.executable, "-W", "ignore", "-c", _LOAD_WORKER.format(load=load)],
+                                    cwd=BASE_PATH, capture_output=True, text=True, check=True)
+            filas.append({"loader": nombre, **json.loads(salida.stdout.strip().splitlines()[-1])})
+    return pd.DataFrame(filas).groupby("loader", sort=False).median()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Registro versionado de modelos (models/registry).")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    pub = subparsers.add_parser("publish", help="Publica un pipeline y scaler en pickle como nueva versión.")
+    pub.add_argument("--model", default=str(MODEL_PATH), help="Pickle del pipeline (por ejemplo, de models/versions/).")
+    pub.add_argument("--scaler", default=str(SCALER_PATH))
+    pub.add_argument("--no-activate", action="store_true", help="No marcarla como versión activa.")
+    subparsers.add_parser("list", help="Lista las versiones publicadas.")
+    activate = subparsers.add_parser("activate", help="Marca una versión como activa.")
+    activate.add_argument("version")
+    subparsers.add_parser("bench", help="Compara tiempo de carga y memoria del registro frente a los pickles.")
+    args = parser.parse_args()
+
+    if args.command == "publish":
+        model, scaler = load_artifacts(args.model, args.scaler)
+        version = publish(model, scaler, model_version=file_digest(args.model), source=os.path.basename(args.model),
+                          activate=not args.no_activate)
+        print(f"✅ Versión {version} publicada en {REGISTRY_DIR / version}")
+    elif args.command == "list":
+        activa = current_version()
+        for version in list_versions():
+            manifest = json.loads((REGISTRY_DIR / version / "manifest.json").read_text(encoding="utf-8"))
+            marca = "*" if version == activa else " "
+            print(f"{marca} {version}  {manifest['model_version']}  {manifest['created_at']}  {manifest.get('source') or ''}")
+    elif args.command == "activate":
+        set_current(args.version)
+        print(f"Versión activa: {args.version}")
+    elif args.command == "bench":
+        inicio = time.perf_counter()
+        print(bench_loading().to_string(float_format="{:.3f}".format))
+        print(f"({time.perf_counter() - inicio:.1f} s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,337 @@
+# Búsqueda de casos históricos similares
+"""
+Índice de vecinos más cercanos sobre los casos de dataset_clinico_huancayo_20k_processed.csv
+en el espacio escalado del modelo. Es un índice de listas invertidas (IVF): k-means agrupa
+los casos de cada diagnóstico y cada grupo se guarda contiguo, así que una consulta solo
+recorre los `nprobe` grupos de centroides más cercanos (del diagnóstico pedido, si se filtra
+por él) y calcula distancias exactas sobre ellos; con nprobe >= n_listas la búsqueda es
+exacta. Se construye offline en data/processed/similarity/ (arreglos .npy que se abren con
+memory-map) y admite filtros por diagnóstico, área y edad.
+
+    python -m src.similarity build
+    python -m src.similarity bench --rows 1000000
+"""
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from src.preprocessing import AREA_MAP, DIAGNOSTICO_MAP, ChunkedPreprocessor
+from src.utils import DATA_DIR, MODEL_PATH, dataset_hash, file_digest, load_artifacts, load_dataset
+
+SIMILARITY_DIR = DATA_DIR / "similarity"
+SOURCE_DATASET = "dataset_clinico_huancayo_20k_processed"
+INDEX_FORMAT_VERSION = 1
+DEFAULT_K = 5
+DEFAULT_NPROBE = 8
+# Si los filtros dejan como mucho estas filas, se recorren todas (búsqueda exacta): con
+# filtros selectivos los vecinos que los cumplen suelen caer fuera de los grupos más cercanos
+MAX_FILAS_EXACTA = 50_000
+# Códigos sin escalar (distrito, ocupación) y la categoría derivada del IMC no entran en la
+# distancia: una diferencia de códigos no mide parecido clínico
+PESOS_POR_DEFECTO = {'distrito': 0.0, 'ocupacion': 0.0, 'imc_categoria': 0.0}
+# Columnas en bruto que se guardan para mostrar cada caso recuperado
+COLUMNAS_CASO = ['edad', 'sexo', 'area', 'pas', 'pad', 'temp', 'spo2', 'glucosa', 'hba1c', 'leucocitos']
+# Tramos de edad [desde, hasta) para el filtro de edad de la app
+TRAMOS_EDAD = [(0, 12), (12, 18), (18, 40), (40, 65), (65, np.inf)]
+_ARREGLOS = ("vectors", "norms", "ids", "diagnostico", "area", "edad", "casos", "offsets", "centroids", "list_diagnostico")
+
+
+def age_band(edad):
+    """ Tramo de TRAMOS_EDAD que contiene `edad`. """
+    return next((tramo for tramo in TRAMOS_EDAD if tramo[0] <= edad < tramo[1]), TRAMOS_EDAD[-1])
+
+
+def _n_listas(n):
+    """ Número de listas: del orden de sqrt(n), entre 16 y 4096. """
+    return int(np.clip(2 ** round(np.log2(max(np.sqrt(n), 1))), 16, 4096))
+
+
+def build_index(df, model, scaler, out_dir=SIMILARITY_DIR, weights=None, n_lists=None, model_version=None, source=None, seed=42):
+    """
+    Construye el índice a partir de casos ya codificados (como el dataset procesado), con
+    las columnas de características, 'id' y 'diagnostico'. Cada diagnóstico se agrupa por
+    separado con k-means (grupos en proporción a sus casos) y las filas se guardan como
+    float32 ordenadas por diagnóstico y grupo. Devuelve los metadatos escritos.
+    """
+    from sklearn.cluster import MiniBatchKMeans
+
+    preprocessor = ChunkedPreprocessor.from_artifacts(model, scaler)
+    feature_names = list(preprocessor.feature_order)
+    pesos = np.array([{**PESOS_POR_DEFECTO, **(weights or {})}.get(f, 1.0) for f in feature_names])
+    columnas = np.flatnonzero(pesos > 0)
+    X = preprocessor.transform(df).to_numpy(dtype=np.float64)[:, columnas]
+    vectores = np.ascontiguousarray(X * pesos[columnas], dtype=np.float32)
+
+    n_lists = n_lists or _n_listas(len(vectores))
+    diagnostico = df['diagnostico'].to_numpy(dtype=np.int8)
+    grupo = np.empty(len(vectores), dtype=np.int64)
+    centroides, list_diagnostico = [], []
+    for codigo in np.unique(diagnostico):
+        filas = np.flatnonzero(diagnostico == codigo)
+        n_grupos = int(np.clip(round(n_lists * len(filas) / len(vectores)), 1, len(filas)))
+        kmeans = MiniBatchKMeans(n_clusters=n_grupos, batch_size=4096, n_init=3, random_state=seed).fit(vectores[filas])
+        grupo[filas] = len(list_diagnostico) + kmeans.predict(vectores[filas])
+        centroides.append(kmeans.cluster_centers_)
+        list_diagnostico += [codigo] * n_grupos
+    n_lists = len(list_diagnostico)
+    orden = np.argsort(grupo, kind='stable')
+    offsets = np.concatenate([[0], np.cumsum(np.bincount(grupo, minlength=n_lists))])
+
+    tmp_dir = out_dir.with_name(f".tmp_{out_dir.name}_{os.getpid()}")
+    tmp_dir.mkdir(parents=True, exist_ok=True)
+    arreglos = {
+        "vectors": vectores[orden],
+        "norms": np.einsum('ij,ij->i', vectores, vectores)[orden],
+        "ids": df['id'].to_numpy(dtype=np.int64)[orden],
+        "diagnostico": diagnostico[orden],
+        "area": df['area'].to_numpy(dtype=np.int8)[orden],
+        "edad": df['edad'].to_numpy(dtype=np.float32)[orden],
+        "casos": df[COLUMNAS_CASO].to_numpy(dtype=np.float32)[orden],
+        "offsets": offsets.astype(np.int64),
+        "centroids": np.concatenate(centroides).astype(np.float32),
+        "list_diagnostico": np.array(list_diagnostico, dtype=np.int8),
+    }
+    for nombre, valores in arreglos.items():
+        np.save(tmp_dir / f"{nombre}.npy", valores)
+    metadata = {
+        "format_version": INDEX_FORMAT_VERSION,
+        "feature_names": feature_names,
+        "columns": [feature_names[j] for j in columnas],
+        "weights": pesos[columnas].tolist(),
+        "case_columns": COLUMNAS_CASO,
+        "n_rows": int(len(vectores)),
+        "n_lists": int(n_lists),
+        "model_version": model_version,
+        "source": source,
+    }
+    (tmp_dir / "metadata.json").write_text(json.dumps(metadata, indent=2, ensure_ascii=False) + "\n", encoding="utf-8")
+    if out_dir.exists():
+        import shutil
+        shutil.rmtree(out_dir)
+    os.replace(tmp_dir, out_dir)
+    return metadata
+
+
+class SimilarityIndex:
+    """
+    Índice abierto en modo lectura; los arreglos se mapean en memoria en el primer uso.
+    `search` recibe filas procesadas en el orden del modelo (la salida de
+    CompiledPredictor.transform) y devuelve los k casos más cercanos.
+    """
+
+    def __init__(self, index_dir=SIMILARITY_DIR):
+        self.index_dir = index_dir
+        self.metadata = json.loads((index_dir / "metadata.json").read_text(encoding="utf-8"))
+        if self.metadata.get("format_version") != INDEX_FORMAT_VERSION:
+            raise ValueError(f"Formato de índice no soportado: {self.metadata.get('format_version')}")
+        feature_names = self.metadata["feature_names"]
+        self.columns = np.array([feature_names.index(c) for c in self.metadata["columns"]], dtype=np.intp)
+        self.weights = np.asarray(self.metadata["weights"], dtype=np.float32)
+        self.n_rows = self.metadata["n_rows"]
+        self.n_lists = self.metadata["n_lists"]
+        self.model_version = self.metadata.get("model_version")
+        self._arrays = {}
+
+    @classmethod
+    def open(cls, index_dir=SIMILARITY_DIR):
+        """ Devuelve el índice o None si todavía no se construyó. """
+        if not (index_dir / "metadata.json").exists():
+            return None
+        return cls(index_dir)
+
+    def __getattr__(self, nombre):
+        if nombre not in _ARREGLOS:
+            raise AttributeError(nombre)
+        if nombre not in self._arrays:
+            self._arrays[nombre] = np.load(self.index_dir / f"{nombre}.npy", mmap_mode="r")
+        return self._arrays[nombre]
+
+    def embed(self, X):
+        """ Filas procesadas (n, n_features) -> vectores ponderados de las columnas del índice. """
+        X = np.atleast_2d(np.asarray(X, dtype=np.float32))[:, self.columns]
+        return X * self.weights
+
+    def _mask(self, area, edad, inicio, fin):
+        """ Máscara de las filas [inicio, fin) que cumplen los filtros de área y edad. """
+        mascara = np.ones(fin - inicio, dtype=bool)
+        if area is not None:
+            mascara &= self.area[inicio:fin] == area
+        if edad is not None:
+            edades = self.edad[inicio:fin]
+            mascara &= (edades >= edad[0]) & (edades < edad[1])
+        return mascara
+
+    def _distances(self, q, filas=None, inicio=0, fin=None):
+        """ Distancias euclídeas al cuadrado como |v|² - 2·v·q + |q|², sin temporales (n, d). """
+        if filas is None:
+            return self.norms[inicio:fin] - 2 * (self.vectors[inicio:fin] @ q) + q @ q
+        return self.norms[filas] - 2 * (self.vectors[filas] @ q) + q @ q
+
+    def search(self, x, k=DEFAULT_K, diagnostico=None, area=None, edad=None, nprobe=DEFAULT_NPROBE):
+        """
+        Los k casos más cercanos a la fila procesada `x`. Filtros opcionales: `diagnostico`
+        (código o lista de códigos de DIAGNOSTICO_MAP), `area` (código o 'Rural'/'Urbano') y
+        `edad` como intervalo [min, max). Si los filtros dejan pocas filas (MAX_FILAS_EXACTA)
+        la búsqueda es exacta sobre ellas; si no, se recorren los `nprobe` grupos más cercanos
+        (más cuanto más selectivos son los filtros de área y edad) y los siguientes hasta
+        reunir k casos. Devuelve un DataFrame.
+        """
+        if isinstance(area, str):
+            area = AREA_MAP[area]
+        q = self.embed(x)[0]
+        offsets = self.offsets
+        listas = np.arange(self.n_lists)
+        if diagnostico is not None:
+            listas = np.flatnonzero(np.isin(self.list_diagnostico, np.atleast_1d(diagnostico)))
+        # Las listas de un diagnóstico son contiguas: los filtros de área y edad solo se
+        # evalúan sobre esos tramos de filas
+        cortes = np.flatnonzero(np.diff(listas) != 1) + 1
+        tramos = [(int(offsets[t[0]]), int(offsets[t[-1] + 1])) for t in np.split(listas, cortes) if len(t)]
+        mascara = None
+        if area is not None or edad is not None:
+            mascara = np.zeros(self.n_rows, dtype=bool)
+            for inicio, fin in tramos:
+                mascara[inicio:fin] = self._mask(area, edad, inicio, fin)
+            n_candidatas = np.count_nonzero(mascara)
+        else:
+            n_candidatas = sum(fin - inicio for inicio, fin in tramos)
+
+        filtrado = diagnostico is not None or mascara is not None
+        if (filtrado and n_candidatas <= MAX_FILAS_EXACTA) or nprobe >= len(listas):
+            if mascara is None:
+                mejores_d = np.concatenate([self._distances(q, inicio=i, fin=f) for i, f in tramos])
+                mejores_i = np.concatenate([np.arange(i, f) for i, f in tramos])
+            else:
+                mejores_i = np.flatnonzero(mascara)
+                mejores_d = self._distances(q, mejores_i)
+            orden_listas = []
+        else:
+            mejores_d = np.empty(0, dtype=np.float32)
+            mejores_i = np.empty(0, dtype=np.int64)
+            orden_listas = listas[np.argsort(((self.centroids[listas] - q) ** 2).sum(axis=1))]
+            if mascara is not None:
+                # Con filtros cada lista aporta menos candidatos: se visitan proporcionalmente más
+                nprobe = int(np.ceil(nprobe * sum(f - i for i, f in tramos) / max(n_candidatas, 1)))
+        for n_visitadas, lista in enumerate(orden_listas, start=1):
+            inicio, fin = int(offsets[lista]), int(offsets[lista + 1])
+            if mascara is None:
+                filas, d = np.arange(inicio, fin), self._distances(q, inicio=inicio, fin=fin)
+            else:
+                filas = inicio + np.flatnonzero(mascara[inicio:fin])
+                d = self._distances(q, filas)
+            mejores_d = np.concatenate([mejores_d, d])
+            mejores_i = np.concatenate([mejores_i, filas])
+            if len(mejores_d) > k:
+                top = np.argpartition(mejores_d, k)[:k]
+                mejores_d, mejores_i = mejores_d[top], mejores_i[top]
+            if n_visitadas >= nprobe and len(mejores_d) >= k:
+                break
+        if len(mejores_d) > k:
+            top = np.argpartition(mejores_d, k)[:k]
+            mejores_d, mejores_i = mejores_d[top], mejores_i[top]
+        orden = np.argsort(mejores_d, kind='stable')
+        filas = mejores_i[orden]
+        casos = pd.DataFrame(np.asarray(self.casos[filas]), columns=self.metadata["case_columns"])
+        casos.insert(0, 'distancia', np.sqrt(np.maximum(mejores_d[orden], 0)))
+        casos.insert(0, 'diagnostico', [DIAGNOSTICO_MAP[int(c)] for c in self.diagnostico[filas]])
+        casos.insert(0, 'id', np.asarray(self.ids[filas]))
+        return casos
+
+
+def recall_at_k(index, queries, k=DEFAULT_K, nprobe=DEFAULT_NPROBE, **filtros):
+    """ Fracción de los k vecinos exactos que recupera la búsqueda con `nprobe` grupos. """
+    aciertos = 0
+    for x in queries:
+        exactos = set(index.search(x, k, nprobe=index.n_lists, **filtros)['id'])
+        aciertos += len(exactos & set(index.search(x, k, nprobe=nprobe, **filtros)['id']))
+    return aciertos / (k * len(queries))
+
+
+def bench_similarity(model, scaler, n_rows=None, n_queries=200, k=DEFAULT_K, nprobes=(4, DEFAULT_NPROBE, 32)):
+    """
+    Construye un índice temporal (el dataset replicado con ruido hasta `n_rows` filas si se
+    indica) y mide la latencia por consulta y el recall@k frente a la búsqueda exacta, sin
+    filtros y con filtro de diagnóstico y edad. Las consultas son pacientes de X_test con ruido.
+    """
+    import tempfile
+    from pathlib import Path
+
+    df = load_dataset(SOURCE_DATASET)
+    rng = np.random.default_rng(0)
+    if n_rows and n_rows > len(df):
+        df = pd.concat([df] * -(-n_rows // len(df)), ignore_index=True).iloc[:n_rows].copy()
+        for col in ['edad', 'imc', 'pas', 'pad', 'fc', 'glucosa', 'colesterol']:
+            df[col] = df[col] + rng.normal(0, df[col].std() * 0.05, len(df))
+        df['id'] = np.arange(1, len(df) + 1)
+    out_dir = Path(tempfile.mkdtemp(prefix="cdss_similarity_")) / "index"
+    inicio = time.perf_counter()
+    build_index(df, model, scaler, out_dir)
+    construccion = time.perf_counter() - inicio
+    index = SimilarityIndex(out_dir)
+
+    X_test = load_dataset("X_test", columns=list(model.feature_names_in_)).to_numpy(dtype=np.float32)
+    queries = X_test[rng.choice(len(X_test), n_queries, replace=False)]
+    queries = queries + rng.normal(0, 0.1, queries.shape).astype(np.float32)
+    filas = []
+    casos = {'sin filtros': {}, 'diagnóstico HTA, 40-65 años': {'diagnostico': 2, 'edad': (40, 65)}}
+    for nombre, filtros in casos.items():
+        for nprobe in (*nprobes, index.n_lists):
+            tiempos = []
+            for x in queries:
+                t = time.perf_counter()
+                index.search(x, k, nprobe=nprobe, **filtros)
+                tiempos.append(time.perf_counter() - t)
+            filas.append({
+                'filtro': nombre, 'nprobe': nprobe if nprobe < index.n_lists else f"{nprobe} (exacta)",
+                'p50_ms': np.percentile(tiempos, 50) * 1e3, 'p99_ms': np.percentile(tiempos, 99) * 1e3,
+                f'recall@{k}': recall_at_k(index, queries[:50], k, nprobe, **filtros),
+            })
+    return pd.DataFrame(filas), {'filas': index.n_rows, 'listas': index.n_lists, 'construccion_s': construccion}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Índice de casos históricos similares.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    build = subparsers.add_parser("build", help=f"Construye el índice en {SIMILARITY_DIR}.")
+    build.add_argument("--input", default=SOURCE_DATASET, help="Dataset de data/processed con casos codificados.")
+    build.add_argument("--n-lists", type=int, default=None, help="Grupos de k-means (por defecto, ~sqrt(n)).")
+    query = subparsers.add_parser("query", help="Casos similares a una fila de X_test.")
+    query.add_argument("--row", type=int, default=0)
+    query.add_argument("--k", type=int, default=DEFAULT_K)
+    query.add_argument("--diagnostico", type=int, default=None, choices=sorted(DIAGNOSTICO_MAP))
+    query.add_argument("--area", default=None, choices=sorted(AREA_MAP))
+    query.add_argument("--edad", type=float, nargs=2, default=None, metavar=("MIN", "MAX"))
+    query.add_argument("--nprobe", type=int, default=DEFAULT_NPROBE)
+    bench = subparsers.add_parser("bench", help="Latencia y recall@k frente a la búsqueda exacta.")
+    bench.add_argument("--rows", type=int, default=None, help="Replicar el dataset con ruido hasta este número de filas.")
+    bench.add_argument("--queries", type=int, default=200)
+    args = parser.parse_args()
+
+    model, scaler = load_artifacts()
+    if args.command == "build":
+        inicio = time.perf_counter()
+        metadata = build_index(load_dataset(args.input), model, scaler, n_lists=args.n_lists, model_version=file_digest(MODEL_PATH),
+                               source={"dataset": args.input, "sha256": dataset_hash(args.input)})
+        print(f"✅ Índice de {metadata['n_rows']} casos ({metadata['n_lists']} grupos, {len(metadata['columns'])} dimensiones) "
+              f"en {SIMILARITY_DIR} ({time.perf_counter() - inicio:.1f} s)")
+    elif args.command == "query":
+        index = SimilarityIndex.open()
+        if index is None:
+            raise SystemExit("❌ No hay índice: ejecute `python -m src.similarity build`.")
+        x = load_dataset("X_test", columns=list(model.feature_names_in_)).iloc[[args.row]].to_numpy()
+        inicio = time.perf_counter()
+        casos = index.search(x, args.k, args.diagnostico, args.area, tuple(args.edad) if args.edad else None, args.nprobe)
+        print(f"{len(casos)} casos en {(time.perf_counter() - inicio) * 1e3:.2f} ms")
+        print(casos.to_string(index=False, float_format="{:.2f}".format))
+    elif args.command == "bench":
+        resultados, info = bench_similarity(model, scaler, args.rows, args.queries)
+        print(f"{info['filas']} casos, {info['listas']} grupos, construcción en {info['construccion_s']:.1f} s")
+        print(resultados.to_string(index=False, float_format="{:.3f}".format))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,241 @@
+# Instrumentación de latencia por etapa del flujo de predicción
+"""
+Spans con nombre alrededor de cada etapa (validación de rangos, codificación, ingeniería
+de características, escalado, predict_proba, SHAP, PDF y gráficos) que alimentan
+histogramas de latencia etiquetados por etapa y versión del modelo. Las etapas que producen
+un artefacto (el PDF) registran además su tamaño en bytes con record_size().
+
+Se configura con variables de entorno (desactivado por defecto):
+    CDSS_METRICS=1                    activa los spans
+    CDSS_METRICS_FILE=cdss.prom       vuelca los histogramas en formato de texto de Prometheus
+                                      cada CDSS_METRICS_FLUSH_S segundos y al salir
+    CDSS_METRICS_LOG=spans.jsonl      una línea JSON por span ("-" escribe en stderr)
+    CDSS_METRICS_PORT=9102            endpoint HTTP /metrics (la app de Streamlit; el servicio
+                                      HTTP expone GET /metrics en su propio puerto)
+Desactivado, span() devuelve un contexto nulo compartido: el coste es una llamada y una
+comprobación de atributo por etapa.
+"""
+import atexit
+import json
+import os
+import sys
+import threading
+import time
+from bisect import bisect_left
+from contextlib import nullcontext
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+STAGES = ("validacion", "codificacion", "ingenieria_caracteristicas", "escalado", "predict_proba", "shap", "pdf", "graficos")
+LATENCY_BUCKETS_S = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+SIZE_BUCKETS_BYTES = (1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+METRIC_NAME = "cdss_stage_latency_seconds"
+SIZE_METRIC_NAME = "cdss_stage_output_bytes"
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+DEFAULT_FLUSH_S = 10.0
+
+_NULL_SPAN = nullcontext()
+
+
+class LatencyHistogram:
+    """ Histograma de buckets fijos (límites superiores, en segundos o en bytes) con suma y conteo. """
+
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets=LATENCY_BUCKETS_S):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # el último es +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, seconds):
+        self.counts[bisect_left(self.buckets, seconds)] += 1
+        self.sum += seconds
+        self.count += 1
+
+    def quantile(self, q):
+        """ Cuantil aproximado: límite superior del primer bucket que acumula la fracción q. """
+        objetivo, acumulado = q * self.count, 0
+        for limite, n in zip((*self.buckets, float("inf")), self.counts):
+            acumulado += n
+            if acumulado >= objetivo and acumulado > 0:
+                return limite
+        return float("nan")
+
+
+class _Span:
+    __slots__ = ("metrics", "stage", "model_version", "inicio")
+
+    def __init__(self, metrics, stage, model_version):
+        self.metrics = metrics
+        self.stage = stage
+        self.model_version = model_version
+
+    def __enter__(self):
+        self.inicio = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.observe(self.stage, time.perf_counter() - self.inicio, self.model_version)
+        return False
+
+
+class StageMetrics:
+    """
+    Registro de histogramas por (etapa, versión del modelo), seguro entre hilos para
+    compartirlo entre sesiones de Streamlit y los hilos del servicio.
+    """
+
+    def __init__(self, enabled=False, model_version=None, log_path=None, buckets=LATENCY_BUCKETS_S):
+        self.enabled = enabled
+        self.model_version = model_version
+        self.buckets = buckets
+        self._histograms = {}
+        self._sizes = {}
+        self._lock = threading.Lock()
+        self._log = None
+        if log_path:
+            self._log = sys.stderr if log_path == "-" else open(log_path, "a", encoding="utf-8", buffering=1)
+
+    @classmethod
+    def from_env(cls):
+        return cls(enabled=os.environ.get("CDSS_METRICS", "") not in ("", "0"),
+                   log_path=os.environ.get("CDSS_METRICS_LOG"))
+
+    def observe(self, stage, seconds, model_version=None):
+        version = model_version or self.model_version or "desconocida"
+        with self._lock:
+            histograma = self._histograms.get((stage, version))
+            if histograma is None:
+                histograma = self._histograms[(stage, version)] = LatencyHistogram(self.buckets)
+            histograma.observe(seconds)
+            if self._log is not None:
+                self._log.write(json.dumps({
+                    "ts": round(time.time(), 6), "event": "span", "stage": stage,
+                    "duration_ms": round(seconds * 1e3, 4), "model_version": version,
+                }) + "\n")
+
+    def observe_size(self, stage, nbytes, model_version=None):
+        version = model_version or self.model_version or "desconocida"
+        with self._lock:
+            histograma = self._sizes.get((stage, version))
+            if histograma is None:
+                histograma = self._sizes[(stage, version)] = LatencyHistogram(SIZE_BUCKETS_BYTES)
+            histograma.observe(nbytes)
+            if self._log is not None:
+                self._log.write(json.dumps({
+                    "ts": round(time.time(), 6), "event": "size", "stage": stage,
+                    "bytes": int(nbytes), "model_version": version,
+                }) + "\n")
+
+    def summary(self):
+        """ Conteo, media y p50/p99 aproximados por etapa y versión, como lista de dicts. """
+        with self._lock:
+            return [{
+                "stage": stage, "model_version": version, "count": h.count,
+                "mean_ms": h.sum / h.count * 1e3 if h.count else float("nan"),
+                "p50_ms": h.quantile(0.5) * 1e3, "p99_ms": h.quantile(0.99) * 1e3,
+            } for (stage, version), h in sorted(self._histograms.items())]
+
+    def render_prometheus(self):
+        """ Histogramas en el formato de texto de Prometheus (buckets acumulados, _sum y _count). """
+        with self._lock:
+            lineas = _render_family(METRIC_NAME, "Latencia por etapa del flujo de predicción del CDSS.", self._histograms)
+            if self._sizes:
+                lineas += _render_family(SIZE_METRIC_NAME, "Tamaño en bytes de lo que genera cada etapa (reporte PDF).", self._sizes)
+        return "\n".join(lineas) + "\n"
+
+    def write_prometheus(self, path):
+        """ Escritura atómica del archivo .prom (apto para el textfile collector de node_exporter). """
+        tmp = f"{path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(self.render_prometheus())
+        os.replace(tmp, path)
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+            self._sizes.clear()
+
+
+def _render_family(name, ayuda, histogramas):
+    lineas = [f"# HELP {name} {ayuda}", f"# TYPE {name} histogram"]
+    for (stage, version), h in sorted(histogramas.items()):
+        etiquetas = f'stage="{stage}",model_version="{version}"'
+        acumulado = 0
+        for limite, n in zip(h.buckets, h.counts):
+            acumulado += n
+            lineas.append(f'{name}_bucket{{{etiquetas},le="{limite}"}} {acumulado}')
+        lineas.append(f'{name}_bucket{{{etiquetas},le="+Inf"}} {h.count}')
+        lineas.append(f"{name}_sum{{{etiquetas}}} {h.sum!r}")
+        lineas.append(f"{name}_count{{{etiquetas}}} {h.count}")
+    return lineas
+
+
+METRICS = StageMetrics.from_env()
+_exporters_started = False
+_exporters_lock = threading.Lock()
+
+
+def span(stage, model_version=None):
+    """ Contexto que mide la etapa `stage`; sin efecto si las métricas están desactivadas. """
+    if not METRICS.enabled:
+        return _NULL_SPAN
+    return _Span(METRICS, stage, model_version)
+
+
+def record_size(stage, nbytes, model_version=None):
+    """ Registra el tamaño en bytes de lo que produjo `stage`; sin efecto si las métricas están desactivadas. """
+    if METRICS.enabled:
+        METRICS.observe_size(stage, nbytes, model_version)
+
+
+def set_model_version(model_version):
+    """ Versión del modelo con la que se etiquetan los spans que no indican otra. """
+    METRICS.model_version = model_version
+
+
+def start_file_exporter(path, interval_s=DEFAULT_FLUSH_S, metrics=METRICS):
+    """ Vuelca las métricas a `path` cada `interval_s` segundos en un hilo daemon y al salir. """
+    def run():
+        while True:
+            time.sleep(interval_s)
+            metrics.write_prometheus(path)
+
+    threading.Thread(target=run, name="cdss-metrics-file", daemon=True).start()
+    atexit.register(metrics.write_prometheus, path)
+
+
+def start_http_exporter(port, host="127.0.0.1", metrics=METRICS):
+    """ Sirve GET /metrics en un hilo daemon; devuelve el servidor. """
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?", 1)[0] != "/metrics":
+                self.send_error(404)
+                return
+            cuerpo = metrics.render_prometheus().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", PROMETHEUS_CONTENT_TYPE)
+            self.send_header("Content-Length", str(len(cuerpo)))
+            self.end_headers()
+            self.wfile.write(cuerpo)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, name="cdss-metrics-http", daemon=True).start()
+    return server
+
+
+def start_exporters_from_env():
+    """ Arranca los exportadores indicados en CDSS_METRICS_FILE y CDSS_METRICS_PORT (una vez por proceso). """
+    global _exporters_started
+    with _exporters_lock:
+        if not METRICS.enabled or _exporters_started:
+            return
+        _exporters_started = True
+    if os.environ.get("CDSS_METRICS_FILE"):
+        start_file_exporter(os.environ["CDSS_METRICS_FILE"], float(os.environ.get("CDSS_METRICS_FLUSH_S", DEFAULT_FLUSH_S)))
+    if os.environ.get("CDSS_METRICS_PORT"):
+        start_http_exporter(int(os.environ["CDSS_METRICS_PORT"]))
@@ -1 +1,269 @@
-# Utilidades generales
\ No newline at end of file
+# Utilidades generales
+import argparse
+import hashlib
+import json
+import sys
+import threading
+import warnings
+from collections import OrderedDict
+from pathlib import Path
+
+import joblib
+import numpy as np
+import pandas as pd
+
+# --- Rutas del Proyecto ---
+BASE_PATH = Path(__file__).resolve().parent.parent
+MODELS_DIR = BASE_PATH / "models"
+DATA_DIR = BASE_PATH / "data" / "processed"
+REPORTS_DIR = BASE_PATH / "reports"
+METRICS_DIR = REPORTS_DIR / "metrics"
+
+MODEL_PATH = MODELS_DIR / "final_model.pkl"
+SCALER_PATH = MODELS_DIR / "scaler.pkl"
+MANIFEST_PATH = MODELS_DIR / "manifest.json"
+
+
+def load_artifacts(model_path=MODEL_PATH, scaler_path=SCALER_PATH):
+    """ Carga el pipeline del modelo final y el scaler desde disco. """
+    model = joblib.load(model_path)
+    scaler = joblib.load(scaler_path)
+    return model, scaler
+
+
+def file_digest(path, length=12):
+    """ Hash SHA-256 (abreviado) del contenido de un archivo; sirve como versión de un artefacto. """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for bloque in iter(lambda: f.read(1 << 20), b""):
+            digest.update(bloque)
+    return digest.hexdigest()[:length]
+
+
+def stable_hash(obj):
+    """ Hash estable de un objeto serializable a JSON (dicts de resultados, entradas, ...). """
+    datos = json.dumps(obj, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(datos.encode("utf-8")).hexdigest()
+
+
+def _nbytes(value):
+    """ Tamaño aproximado en bytes de arreglos, bytes o listas/tuplas de ellos. """
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return len(value)
+    if isinstance(value, (list, tuple)):
+        return sum(_nbytes(v) for v in value)
+    if hasattr(value, "nbytes"):
+        return int(value.nbytes)
+    return sys.getsizeof(value)
+
+
+class BoundedLRUCache:
+    """
+    Caché LRU con presupuesto de memoria en bytes, segura entre hilos para compartirla
+    entre sesiones de Streamlit. Al superar `max_bytes` se descartan las entradas menos
+    usadas recientemente. Lleva contadores de aciertos y fallos.
+    """
+
+    def __init__(self, max_bytes, sizeof=_nbytes):
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key][0]
+            self.misses += 1
+            return default
+
+    def put(self, key, value):
+        size = self.sizeof(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._data:
+                self.current_bytes -= self._data.pop(key)[1]
+            self._data[key] = (value, size)
+            self.current_bytes += size
+            while self.current_bytes > self.max_bytes:
+                _, (_, evicted_size) = self._data.popitem(last=False)
+                self.current_bytes -= evicted_size
+                self.evictions += 1
+
+    def get_or_compute(self, key, compute):
+        """ Devuelve el valor en caché o lo calcula con `compute()` y lo guarda. """
+        sentinel = object()
+        value = self.get(key, sentinel)
+        if value is sentinel:
+            value = compute()
+            self.put(key, value)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.current_bytes = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._data),
+            "bytes": self.current_bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+
+# --- Capa de datos columnar ---
+# Cada CSV de data/processed se convierte una vez en data/processed/columnar/<nombre>/ con un
+# .npy por columna (tipos compactos explícitos) y un schema.json con el hash del CSV de origen.
+COLUMNAR_DIR = DATA_DIR / "columnar"
+COLUMNAR_FORMAT_VERSION = 1
+DATASETS = ["X_train", "X_test", "y_train", "y_test", "dataset_clinico_huancayo_20k_processed"]
+
+
+def _compact_dtype(values, float_dtype):
+    """ Tipo más pequeño que representa la columna sin pérdida (enteros) o `float_dtype` (reales). """
+    if np.issubdtype(values.dtype, np.integer) or np.issubdtype(values.dtype, np.bool_):
+        if len(values) == 0:
+            return np.dtype(np.int8)
+        return np.result_type(np.min_scalar_type(int(values.min())), np.min_scalar_type(int(values.max())))
+    return np.dtype(float_dtype)
+
+
+def _source_path(name):
+    return Path(name) if str(name).endswith(".csv") else DATA_DIR / f"{name}.csv"
+
+
+def convert_to_columnar(name, float_dtype="float64", out_dir=None):
+    """
+    Convierte un CSV (nombre de DATASETS o ruta) al formato columnar. Los enteros se reducen
+    al tipo mínimo (los 30 síntomas binarios pasan de int64 a uint8); los reales se guardan
+    como `float_dtype` (float64 por defecto para no alterar umbrales como los del IMC).
+    Devuelve el esquema escrito.
+    """
+    source = _source_path(name)
+    out_dir = Path(out_dir) if out_dir else COLUMNAR_DIR / source.stem
+    df = pd.read_csv(source)
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    columnas = {}
+    for col in df.columns:
+        valores = df[col].to_numpy()
+        dtype = _compact_dtype(valores, float_dtype)
+        np.save(out_dir / f"{col}.npy", valores.astype(dtype))
+        columnas[col] = str(dtype)
+
+    stat = source.stat()
+    schema = {
+        "format_version": COLUMNAR_FORMAT_VERSION,
+        "source": source.name,
+        "source_sha256": file_digest(source, length=64),
+        "source_size": stat.st_size,
+        "source_mtime_ns": stat.st_mtime_ns,
+        "n_rows": int(len(df)),
+        "columns": columnas,
+    }
+    (out_dir / "schema.json").write_text(json.dumps(schema, indent=2), encoding="utf-8")
+    return schema
+
+
+_AVISOS_EMITIDOS = set()
+
+
+def _warn_once(mensaje):
+    """ warnings.warn una sola vez por mensaje y proceso (pandas reinicia el registro de warnings). """
+    if mensaje not in _AVISOS_EMITIDOS:
+        _AVISOS_EMITIDOS.add(mensaje)
+        warnings.warn(mensaje, stacklevel=3)
+
+
+def _columnar_schema(name):
+    """ Esquema columnar vigente de `name`, o None si no existe o el CSV de origen cambió. """
+    source = _source_path(name)
+    schema_path = COLUMNAR_DIR / source.stem / "schema.json"
+    # Solo los CSV de data/processed tienen copia columnar
+    if source.resolve().parent != DATA_DIR.resolve() or not schema_path.exists():
+        return None
+    schema = json.loads(schema_path.read_text(encoding="utf-8"))
+    if schema.get("format_version") != COLUMNAR_FORMAT_VERSION:
+        return None
+    if source.exists():
+        stat = source.stat()
+        # Solo se vuelve a calcular el hash si el CSV parece haber cambiado
+        if (stat.st_size, stat.st_mtime_ns) != (schema["source_size"], schema["source_mtime_ns"]):
+            if file_digest(source, length=64) != schema["source_sha256"]:
+                _warn_once(f"{source.name} cambió desde la conversión columnar; se usará el CSV.")
+                return None
+    return schema
+
+
+def dataset_hash(name):
+    """ Hash de contenido del dataset (SHA-256 del CSV de origen), útil como clave de caché. """
+    schema = _columnar_schema(name)
+    return schema["source_sha256"] if schema else file_digest(_source_path(name), length=64)
+
+
+def load_arrays(name, columns=None):
+    """
+    Columnas del dataset como dict de arreglos NumPy memory-mapped (sin copia), o None si
+    no hay versión columnar vigente.
+    """
+    schema = _columnar_schema(name)
+    if schema is None:
+        return None
+    directorio = COLUMNAR_DIR / _source_path(name).stem
+    columnas = list(schema["columns"]) if columns is None else list(columns)
+    faltantes = [c for c in columnas if c not in schema["columns"]]
+    if faltantes:
+        raise KeyError(f"Columnas inexistentes en {name}: {faltantes}")
+    return {col: np.load(directorio / f"{col}.npy", mmap_mode="r") for col in columnas}
+
+
+def load_dataset(name, columns=None):
+    """
+    Carga un dataset de data/processed como DataFrame, leyendo solo `columns` si se indican.
+    Usa la versión columnar si está vigente y, si no, el CSV (con proyección de columnas).
+    Con la versión columnar, cada columna es un bloque de solo lectura sobre el memory-map
+    de load_arrays (sin copia): para modificar el DataFrame en el sitio, use df.copy().
+    """
+    arrays = load_arrays(name, columns)
+    if arrays is not None:
+        return pd.DataFrame({col: np.asarray(values) for col, values in arrays.items()}, copy=False)
+    _warn_once(f"Sin versión columnar vigente de {_source_path(name).name}; leyendo el CSV "
+               f"(ejecute `python -m src.utils convert`).")
+    df = pd.read_csv(_source_path(name), usecols=columns)
+    return df[list(columns)] if columns is not None else df
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Utilidades de datos del proyecto.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    convert = subparsers.add_parser("convert", help="Convierte los CSV de data/processed al formato columnar.")
+    convert.add_argument("datasets", nargs="*", default=DATASETS, help="Datasets a convertir (por defecto, todos los existentes).")
+    convert.add_argument("--float-dtype", default="float64", choices=["float32", "float64"], help="Tipo de las columnas reales.")
+    args = parser.parse_args()
+
+    for name in args.datasets:
+        if not _source_path(name).exists():
+            print(f"⏭️ {_source_path(name).name} no existe, omitiendo...")
+            continue
+        schema = convert_to_columnar(name, args.float_dtype)
+        print(f"✅ {schema['source']}: {schema['n_rows']} filas, {len(schema['columns'])} columnas -> {COLUMNAR_DIR / _source_path(name).stem}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,247 @@
+# Validación vectorizada de rangos clínicos
+"""
+Evalúa todos los rangos de referencia sobre una matriz N×k (pacientes × campos) a la vez:
+matriz booleana de alertas, severidad por valor y resúmenes por campo y grupo de edad.
+La usan la app y el servicio HTTP (alertas de un paciente) y la CLI de este módulo (un CSV
+de consultas). Por defecto se aplica la tabla única RANGOS_CLINICOS; las tablas por grupo
+de edad solo se cargan de una configuración explícita (RangeValidator.from_json, --rangos).
+"""
+import argparse
+import json
+import time
+
+import numpy as np
+import pandas as pd
+
+# Rangos clínicos para validación (ejemplos, se pueden ajustar)
+RANGOS_CLINICOS = {
+    'pas': (90, 180), 'pad': (60, 120), 'fc': (60, 100), 'fr': (12, 20),
+    'temp': (36.0, 38.5), 'spo2': (92, 100), 'glucosa': (70, 180),
+    'hba1c': (4.0, 10.0), 'creatinina': (0.6, 1.3), 'colesterol': (125, 240),
+    'leucocitos': (4000, 11000)
+}
+
+# Sin tabla por edades, un único grupo que cubre todas las edades
+GRUPO_UNICO = [(0, 'todos', {})]
+
+# La severidad depende de la distancia al rango, relativa a su amplitud:
+# leve hasta un 10 %, moderada hasta un 25 % y crítica por encima
+SEVERIDADES = ['normal', 'leve', 'moderada', 'critica']
+UMBRALES_SEVERIDAD = (0.10, 0.25)
+
+# Pacientes por bloque: los temporales (k × BLOQUE float64) caben en caché y se reutilizan
+BLOQUE = 4096
+
+
+class ValidationResult:
+    """
+    Resultado de validar N pacientes. Internamente los arreglos son (k, N), con cada campo
+    contiguo; `alerts`, `severity`, `bajo`, `alto` y `values` se exponen como vistas (N, k).
+    """
+
+    def __init__(self, validator, values, grupo, bajo, alto, severity):
+        self.fields = validator.fields
+        self.group_names = validator.group_names
+        self._lower_tab, self._upper_tab = validator.lower, validator.upper
+        self._limites = validator.limites
+        self.grupo = grupo
+        self._values, self._bajo, self._alto, self._severity = values, bajo, alto, severity
+
+    values = property(lambda self: self._values.T)
+    bajo = property(lambda self: self._bajo.T)
+    alto = property(lambda self: self._alto.T)
+    alerts = property(lambda self: (self._severity > 0).T, doc="Matriz booleana (N, k) de valores fuera de rango.")
+    severity = property(lambda self: self._severity.T, doc="Índice en SEVERIDADES de cada valor (N, k).")
+
+    def __len__(self):
+        return self._values.shape[1]
+
+    def bounds(self, i):
+        """ Límites (inferior, superior) aplicados al paciente i, por campo. """
+        return self._lower_tab[:, self.grupo[i]], self._upper_tab[:, self.grupo[i]]
+
+    def n_alerts(self):
+        """ Número de valores fuera de rango de cada paciente. """
+        return np.count_nonzero(self._severity, axis=0)
+
+    def patient_severity(self):
+        """ Severidad máxima de cada paciente (0 = sin alertas). """
+        return self._severity.max(axis=0) if self.fields else np.zeros(len(self), dtype=np.int8)
+
+    def summary(self):
+        """ Por campo: valores presentes, alertas (bajo/alto) y conteo por severidad. """
+        resumen = pd.DataFrame({
+            'n_validos': (~np.isnan(self._values)).sum(axis=1),
+            'n_alertas': np.count_nonzero(self._severity, axis=1),
+            'n_bajo': self._bajo.sum(axis=1),
+            'n_alto': self._alto.sum(axis=1),
+        }, index=pd.Index(self.fields, name='campo'))
+        resumen['pct_alertas'] = resumen['n_alertas'] / resumen['n_validos'].clip(lower=1) * 100
+        for nivel in range(1, len(SEVERIDADES)):
+            resumen[SEVERIDADES[nivel]] = (self._severity == nivel).sum(axis=1)
+        return resumen
+
+    def by_age_group(self):
+        """ Alertas por grupo de edad (filas) y campo (columnas), más el número de pacientes del grupo. """
+        n_grupos = len(self.group_names)
+        conteos = np.stack([np.bincount(self.grupo, weights=fila > 0, minlength=n_grupos) for fila in self._severity], axis=1)
+        tabla = pd.DataFrame(conteos.astype(np.int64), index=pd.Index(self.group_names, name='grupo_edad'), columns=self.fields)
+        tabla.insert(0, 'pacientes', np.bincount(self.grupo, minlength=n_grupos))
+        return tabla
+
+    def records(self, i=0):
+        """ Alertas del paciente i como lista de dicts (campo, valor, límites y severidad). """
+        lower, upper = self.bounds(i)
+        return [{
+            'campo': campo, 'valor': self._values[j, i].item(),
+            'min': lower[j].item(), 'max': upper[j].item(),
+            'severidad': SEVERIDADES[self._severity[j, i]],
+        } for j, campo in enumerate(self.fields) if self._severity[j, i]]
+
+    def messages(self, i=0, raw=None):
+        """ Textos de alerta del paciente i tal como los muestra la app; `raw` conserva el formato de los valores de entrada. """
+        mensajes = []
+        for j, campo in enumerate(self.fields):
+            if self._severity[j, i]:
+                valor = raw[campo] if raw is not None else _formato(self._values[j, i].item())
+                min_val, max_val = self._limites[self.grupo[i]][j]
+                mensajes.append(f"⚠️ **{campo.upper()}** ({valor}) fuera del rango normal ({min_val} - {max_val}).")
+        return mensajes
+
+
+def _formato(valor):
+    return int(valor) if float(valor).is_integer() else valor
+
+
+class RangeValidator:
+    """
+    Tabla de rangos por grupo de edad compilada en arreglos (k, n_grupos). `validate`
+    recibe un DataFrame, un dict de columnas (por ejemplo, la salida de load_arrays) o el
+    dict de entradas de un paciente; los campos ausentes o NaN no generan alertas y sin
+    `edad` se aplican los rangos de adulto.
+    """
+
+    def __init__(self, rangos=RANGOS_CLINICOS, rangos_por_edad=None):
+        self.fields = list(rangos)
+        grupos = sorted(rangos_por_edad or GRUPO_UNICO, key=lambda g: g[0])
+        self.age_edges = np.array([edad for edad, _, _ in grupos], dtype=np.float64)
+        self.group_names = [nombre for _, nombre, _ in grupos]
+        # Límites tal como están en la tabla (para los mensajes) y compilados en arreglos
+        self.limites = [[tuple({**rangos, **ajustes}[campo]) for campo in self.fields] for _, _, ajustes in grupos]
+        limites = np.array(self.limites, dtype=np.float64).reshape(len(grupos), len(self.fields), 2)
+        self.lower = np.ascontiguousarray(limites[:, :, 0].T)
+        self.upper = np.ascontiguousarray(limites[:, :, 1].T)
+        self.adult_group = int(np.searchsorted(self.age_edges, 18, side='right') - 1)
+
+    @classmethod
+    def from_json(cls, path):
+        """
+        Tabla desde JSON: {"rangos": {"pas": [90, 180], ...},
+        "grupos_edad": [{"desde": 0, "nombre": "pediatrico", "rangos": {...}}, ...]}.
+        """
+        with open(path, encoding="utf-8") as f:
+            config = json.load(f)
+        rangos = {campo: tuple(limites) for campo, limites in config.get("rangos", RANGOS_CLINICOS).items()}
+        grupos = [(g["desde"], g["nombre"], {c: tuple(l) for c, l in g.get("rangos", {}).items()})
+                  for g in config.get("grupos_edad", [])]
+        return cls(rangos, grupos)
+
+    def _column(self, data, campo):
+        return np.atleast_1d(np.asarray(data[campo], dtype=np.float64))
+
+    def age_groups(self, data, n):
+        """ Índice del grupo de edad de cada paciente (adulto si falta la edad). """
+        if 'edad' not in data:
+            return np.full(n, self.adult_group, dtype=np.intp)
+        edad = self._column(data, 'edad')
+        grupo = np.clip(np.searchsorted(self.age_edges, edad, side='right') - 1, 0, len(self.age_edges) - 1)
+        grupo[np.isnan(edad)] = self.adult_group
+        return grupo
+
+    def validate(self, data):
+        """ Valida todos los pacientes de `data` y devuelve un ValidationResult. """
+        presentes = [c for c in [*self.fields, 'edad'] if c in data]
+        n = len(self._column(data, presentes[0])) if presentes else 1
+        k = len(self.fields)
+        values = np.full((k, n), np.nan)
+        for j, campo in enumerate(self.fields):
+            if campo in data:
+                values[j] = self._column(data, campo)
+        grupo = self.age_groups(data, n)
+
+        bajo = np.empty((k, n), dtype=bool)
+        alto = np.empty((k, n), dtype=bool)
+        severity = np.empty((k, n), dtype=np.int8)
+        if n == 0:
+            return ValidationResult(self, values, grupo, bajo, alto, severity)
+        ancho = min(BLOQUE, n)
+        lower, upper = np.empty((k, ancho)), np.empty((k, ancho))
+        desviacion, tmp = np.empty((k, ancho)), np.empty((k, ancho))
+        mayor = np.empty((k, ancho), dtype=bool)
+        # Se recorre por bloques de pacientes con buffers preasignados: sin temporales
+        # del tamaño del lote completo y con los límites de cada paciente según su grupo
+        for inicio in range(0, n, ancho):
+            fin = min(inicio + ancho, n)
+            m = fin - inicio
+            v, g = values[:, inicio:fin], grupo[inicio:fin]
+            lo, hi, d, t, c = lower[:, :m], upper[:, :m], desviacion[:, :m], tmp[:, :m], mayor[:, :m]
+            if m == ancho:
+                np.take(self.lower, g, axis=1, out=lo)
+                np.take(self.upper, g, axis=1, out=hi)
+            else:
+                lo[...] = np.take(self.lower, g, axis=1)
+                hi[...] = np.take(self.upper, g, axis=1)
+            np.less(v, lo, out=bajo[:, inicio:fin])
+            np.greater(v, hi, out=alto[:, inicio:fin])
+            # Desviación relativa a la amplitud del rango: > 0 solo fuera de él
+            np.subtract(lo, v, out=d)
+            np.subtract(v, hi, out=t)
+            np.maximum(d, t, out=d)
+            np.subtract(hi, lo, out=t)
+            np.divide(d, t, out=d)
+            s = severity[:, inicio:fin]
+            np.greater(d, 0, out=c)
+            s[...] = c
+            for umbral in UMBRALES_SEVERIDAD:
+                np.greater(d, umbral, out=c)
+                s += c
+        return ValidationResult(self, values, grupo, bajo, alto, severity)
+
+
+DEFAULT_VALIDATOR = RangeValidator()
+
+
+def validate(data, validator=None):
+    """ Atajo de (validator o DEFAULT_VALIDATOR).validate(data). """
+    return (validator or DEFAULT_VALIDATOR).validate(data)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Validación de rangos clínicos de un CSV de pacientes.")
+    parser.add_argument("input", help="CSV con las columnas clínicas (sin escalar).")
+    parser.add_argument("--rangos", default=None, help="JSON con la tabla de rangos y grupos de edad.")
+    parser.add_argument("--output", default=None, help="CSV de salida con n_alertas y severidad_max por paciente.")
+    args = parser.parse_args()
+
+    validator = RangeValidator.from_json(args.rangos) if args.rangos else DEFAULT_VALIDATOR
+    columnas = [c for c in pd.read_csv(args.input, nrows=0).columns if c in validator.fields or c in ('id', 'edad')]
+    df = pd.read_csv(args.input, usecols=columnas)
+    inicio = time.perf_counter()
+    resultado = validator.validate(df)
+    duracion = time.perf_counter() - inicio
+
+    print(f"{len(resultado)} pacientes validados en {duracion * 1000:.1f} ms")
+    print(resultado.summary().to_string(float_format="{:.2f}".format))
+    print("Alertas por grupo de edad:")
+    print(resultado.by_age_group().to_string())
+    if args.output:
+        salida = pd.DataFrame({'n_alertas': resultado.n_alerts(),
+                               'severidad_max': np.array(SEVERIDADES)[resultado.patient_severity()]})
+        if 'id' in df.columns:
+            salida.insert(0, 'id', df['id'].to_numpy())
+        salida.to_csv(args.output, index=False)
+        print(f"Resultados por paciente -> {args.output}")
+
+
+if __name__ == "__main__":
+    main()